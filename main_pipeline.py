@@ -1,21 +1,7 @@
 # Master Project - Scripts for working with RXTE-data
 # Written by David Gardenier, 2015-2016
 
-from subscripts.download_data import *
-from subscripts.locate_files import *
-from subscripts.determine_info import *
-from subscripts.spacecraft_filters import *
-from subscripts.goodxenon_to_fits import *
-from subscripts.pcu_filters import *
-from subscripts.create_backgrounds import *
-from subscripts.find_channels import *
-from subscripts.extract_lc_and_sp import *
-from subscripts.correct_for_background import *
-from subscripts.find_xray_flares import *
-from subscripts.create_power_spectra import *
-from subscripts.create_power_colours import *
-from subscripts.create_responses import *
-from subscripts.calculate_hi import *
+from subscripts.pipeline import STEPS, run_pipeline
 
 # Run the following first:
 # --------------------------------------
@@ -28,20 +14,19 @@ from subscripts.calculate_hi import *
 # --------------------------------------
 # deactivate
 # --------------------------------------
-# Do not deviate from this order in pipeline, as the subscripts all depend on
-# each other to have run in a particular order.
+# The steps run in the order set by their dependencies in subscripts/pipeline.py,
+# with independent steps (such as the timing and spectral analysis) running
+# alongside each other in up to the given number of processes.
 
-download()
-locate_files()
-determine_info()
-spacecraft_filters()
-goodxenon_to_fits()
-pcu_filters()
-create_backgrounds()
-find_channels()
-extract_lc_and_sp()
-correct_for_background()
-create_power_spectra()
-create_power_colours()
-create_response()
-calculate_hi()
+run_pipeline(STEPS, workers=2)
+
+# Alternatively, replace correct_for_background, create_power_spectra and
+# create_power_colours with a single in-memory pass, which also cuts X-ray
+# flares (use keep_intermediates=True to write the intermediate lightcurves)
+# steps = [s for s in STEPS if s[0] not in ('correct_for_background',
+#                                           'create_power_spectra',
+#                                           'rebin_power_spectra',
+#                                           'create_power_colours')]
+# steps.append(('timing_chain', 'timing_chain', ['extract_lc_and_sp'], False))
+# steps.append(('rebin_power_spectra', 'rebin_power_spectra', ['timing_chain'], False))
+# run_pipeline(steps, workers=2)
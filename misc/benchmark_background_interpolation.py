@@ -0,0 +1,85 @@
+# Script to time the interpolation of a background lightcurve onto the time
+# grid of a lightcurve, as done in correct_for_background, against the former
+# bin by bin loop. Both are checked to give identical backgrounds.
+# Written by David Gardenier, 2015-2016
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'subscripts'))
+from correct_for_background import interpolate_background
+
+
+def interpolate_background_loop(t, bkg_t, bkg_rate, bkg_dt):
+    '''
+    The former bin by bin interpolation of correct_for_background.rebin
+    '''
+    rebinned_bkg_rate = []
+    upper_index = 0
+
+    for k in range(len(t)):
+        if t[k] <= bkg_t[0]:
+            rebinned_bkg_rate.append(bkg_rate[0])
+        elif t[k] >= bkg_t[-1]:
+            rebinned_bkg_rate.append(bkg_rate[-1])
+        else:
+            if t[k] > bkg_t[upper_index]:
+                upper_index += 1
+                while t[k] - bkg_t[upper_index] > bkg_dt:
+                    upper_index += 1
+                lower_index = upper_index - 1
+                x = [bkg_t[lower_index], bkg_t[upper_index]]
+                y = [bkg_rate[lower_index], bkg_rate[upper_index]]
+            rebinned_bkg_rate.append(np.interp(t[k], x, y))
+
+    return rebinned_bkg_rate
+
+
+def simulate(length, dt, bkg_dt=16., n_gaps=5, seed=0):
+    '''
+    Simulate the time grids of a lightcurve with gaps, and of a background
+    lightcurve covering it with a few missing bins
+    '''
+    rs = np.random.RandomState(seed)
+
+    n = int(length/dt)
+    t = np.arange(n)*dt
+    for g in rs.randint(0, n, n_gaps):
+        t[g:] += rs.uniform(1, 100)
+
+    bkg_t = np.arange(t[0] - 2*bkg_dt, t[-1] + 2*bkg_dt, bkg_dt)
+    keep = np.ones(len(bkg_t), dtype=bool)
+    keep[rs.randint(0, len(bkg_t), n_gaps)] = False
+    bkg_t = bkg_t[keep]
+    bkg_rate = rs.uniform(10, 20, len(bkg_t)).astype(np.float32)
+
+    return t, bkg_t, bkg_rate, bkg_dt
+
+
+def timed(function, *args):
+    start = time.time()
+    output = function(*args)
+    return output, time.time() - start
+
+
+def benchmark():
+    print '{0:>10} {1:>10} {2:>10} {3:>12} {4:>12} {5:>10} {6:>10}'.format(
+        'length', 'dt', 'bins', 'loop (s)', 'array (s)', 'speedup', 'identical')
+
+    for length, dt in [(1000, 1/128.), (3000, 1/128.), (300, 1/8192.),
+                       (10000, 1/128.), (3000, 1.)]:
+        t, bkg_t, bkg_rate, bkg_dt = simulate(length, dt)
+
+        old, time_loop = timed(interpolate_background_loop, t, bkg_t, bkg_rate, bkg_dt)
+        (new, upper_index), time_array = timed(interpolate_background, t, bkg_t, bkg_rate, bkg_dt)
+
+        identical = np.array_equal(np.array(old, dtype=float), new)
+
+        print '{0:>10} {1:>10.3g} {2:>10} {3:>12.3f} {4:>12.4f} {5:>10.0f} {6:>10}'.format(
+            length, dt, len(t), time_loop, time_array, time_loop/time_array, str(identical))
+
+
+if __name__=='__main__':
+    benchmark()
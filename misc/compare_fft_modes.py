@@ -0,0 +1,58 @@
+# Script to check the real fft mode of create_power_spectra against the full
+# complex fft, by calculating both power spectra of a single lightcurve.
+# Written by David Gardenier, 2015-2016
+
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'subscripts'))
+from create_power_spectra import power_spectrum
+
+
+def compare_fft_modes(path_lc, path_bkg, path_std1, npcu, single_precision=False):
+    '''
+    Function to check the real fft mode of power_spectrum against the full
+    complex fft, with both power spectra computed from the same lightcurve.
+    Returns True if all columns agree within the numerical tolerance expected
+    for the chosen precision.
+    '''
+    full = power_spectrum(path_lc, path_bkg, path_std1, npcu)
+    real = power_spectrum(path_lc, path_bkg, path_std1, npcu, fft_mode='real',
+                          single_precision=single_precision)
+
+    if not (full and real):
+        print 'ERROR: Could not calculate both power spectra'
+        return
+
+    # Relative tolerance, with an absolute tolerance on the scale of the
+    # largest value to allow for powers close to zero after noise subtraction
+    if single_precision:
+        rtol = 1e-4
+    else:
+        rtol = 1e-8
+
+    names = ['ps', 'ps_error', 'ps_squared', 'number_of_segments',
+             'frequency', 'frequency_error']
+
+    agree = True
+    for name, f, r in zip(names, full, real):
+        f = np.atleast_1d(f)
+        r = np.atleast_1d(r)
+        atol = rtol*np.max(np.abs(f))
+        if f.shape != r.shape or not np.allclose(r, f, rtol=rtol, atol=atol):
+            print 'WARNING: Real fft differs from full fft in', name
+            agree = False
+
+    return agree
+
+
+if __name__=='__main__':
+    if len(sys.argv) < 5:
+        print 'Usage: compare_fft_modes.py lightcurve background std1 npcu [single]'
+        sys.exit(1)
+
+    path_lc, path_bkg, path_std1, npcu = sys.argv[1:5]
+    single_precision = sys.argv[5:] == ['single']
+    print compare_fft_modes(path_lc, path_bkg, path_std1, int(npcu),
+                            single_precision)
@@ -1,5 +1,9 @@
 import pandas as pd
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'subscripts'))
+from best_data import best_data
 
 obj = ['4U_0614p09',
 '4U_1636_m53',
@@ -35,45 +39,10 @@ obj = ['4U_0614p09',
 'H1743m322',
 'xte_J1550m564']
 
-def findbestres(res):
-    '''Find the smallest resolution from a list of resolutions'''
-
-    # Split resolutions into values and units
-    heads = []
-    tails = []
-    for s in res:
-        unit = s.strip('0123456789')
-        num = s[:-len(unit)]
-        heads.append(num)
-        tails.append(unit)
-
-    # Sort by unit, then by value
-    unitorder = ['ms','us','s']
-    for u in unitorder:
-        if u in tails:
-            indices = [i for i, x in enumerate(tails) if x==u]
-            sameunits = [heads[i] for i in indices]
-            sortvalues = sorted(sameunits)
-            return sortvalues[0]+u
-
-
-def findbestdataperobsid(df):
-    '''Select the data with best mode and resolution'''
-    ordering = ['gx1','gx2','event','binned','std2']
-    for mode in ordering:
-        if mode in df.modes.values:
-            df = df[df.modes==mode]
-            if df.shape[0] > 1:
-                bestres = findbestres(df.resolutions.values)
-                return df[df.resolutions==bestres].iloc[0]
-            else:
-                return df.iloc[0]
-
-
 def findbestdata(db):
     # Apply constraint to the data
     db = db[(db.pc1.notnull() & db.lt3sigma==True)]
-    db = db.groupby('obsids').apply(findbestdataperobsid)
+    db = best_data(db, units=['ms','us','s'])
     return db
     
 
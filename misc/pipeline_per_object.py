@@ -1,28 +1,14 @@
-# Quick script to run pipeline over multiple objects
+# Quick script to run pipeline over the objects given as arguments, several at
+# the same time
 import os
-import glob
 import sys
 
-objects = ['test_aquila.lst']
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+from subscripts.pipeline import STEPS, run_sources
+from subscripts.run_config import RunConfig
 
-filein = '/scratch/david/master_project/scripts/misc/paths.txt'
-fileout = '/scratch/david/master_project/scripts/subscripts/paths.py'
+# Be nice to other users of the machine
+os.nice(19)
 
-f = open(filein,'r')
-filedata = f.read()
-f.close()
-
-for arg in sys.argv[1:]:
-    newdata = filedata.replace("OBJECT",arg)
-
-    f = open(fileout,'w')
-    f.write(newdata)
-    f.close()
-
-    try:
-        print '====================='*2
-        print 'NEW DATA SERIES:', arg
-        print '====================='*2
-        os.system('nice -n 19 python main_pipeline.py')
-    except:
-        continue
+configs = [RunConfig(o, terminal_output=False) for o in sys.argv[1:]]
+run_sources(configs, STEPS, workers=2)
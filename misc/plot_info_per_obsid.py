@@ -8,7 +8,12 @@ mpluse('agg') # Prevents errors when running in multiple screens
 import matplotlib.pyplot as plt
 from matplotlib import gridspec
 from scipy.stats import binned_statistic
-from plot_power_colours import findbestdataperobsid, findbestdata
+from plot_power_colours import findbestdata
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'subscripts'))
+from best_data import best_data
 
 class Plots:
     '''
@@ -22,7 +27,7 @@ class Plots:
         self.gs = gridspec.GridSpec(2, 3)
 
         self.db = db
-        self.df = findbestdataperobsid(db)
+        self.df = best_data(db, units=['ms','us','s']).iloc[0]
         self.obj = obj
         self.lc = False
         self.ps = False
@@ -82,21 +87,15 @@ class Plots:
             return
 
         # Import data
+        import sys
+        sys.path.insert(0, '/scratch/david/master_project/scripts/subscripts')
+        from binary_files import read_power_spectrum
         try:
-            all_data = np.loadtxt(self.df.power_spectra,dtype=float)
-            inverted_data = np.transpose(all_data)
+            ps, ps_error, freq, freq_error, ps_squared, num_seg = read_power_spectrum(self.df.power_spectra)
         except IOError:
             print 'No power spectrum'
             return
 
-        # Give the columns their names
-        ps = inverted_data[0]
-        ps_error = inverted_data[1]
-        freq = inverted_data[2]
-        freq_error = inverted_data[3]
-        ps_squared = inverted_data[4]
-        num_seg = inverted_data[5][0]
-
         # Plot details
         ax2 = self.fig.add_subplot(self.gs[1,-2:-1])
         # Can choose to plot freq*ps on y
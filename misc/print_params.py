@@ -11,6 +11,11 @@ from pyx import *
 
 import pandas as pd
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'subscripts'))
+from hue import cal_hue
+from best_data import best_data
 
 # Import file with bursty obsids
 path = os.path.dirname(os.path.realpath(__file__))
@@ -30,45 +35,10 @@ def path(o):
     return '/scratch/david/master_project/' + o + '/info/database_' + o + '.csv'
 
 
-def findbestres(res):
-    '''Find the smallest resolution from a list of resolutions'''
-
-    # Split resolutions into values and units
-    heads = []
-    tails = []
-    for s in res:
-        unit = s.strip('0123456789')
-        num = s[:-len(unit)]
-        heads.append(num)
-        tails.append(unit)
-
-    # Sort by unit, then by value
-    unitorder = ['us','ms','s']
-    for u in unitorder:
-        if u in tails:
-            indices = [i for i, x in enumerate(tails) if x==u]
-            sameunits = [heads[i] for i in indices]
-            sortvalues = sorted(sameunits)
-            return sortvalues[0]+u
-
-
-def findbestdataperobsid(df):
-    '''Select the data with best mode and resolution'''
-    ordering = ['gx1','gx2','event','binned','std2']
-    for mode in ordering:
-        if mode in df.modes.values:
-            df = df[df.modes==mode]
-            if df.shape[0] > 1:
-                bestres = findbestres(df.resolutions.values)
-                return df[df.resolutions==bestres].iloc[0]
-            else:
-                return df.iloc[0]
-
-
 def findbestdata(db):
     # Apply constraint to the data
     db = db[(db.pc1.notnull() & db.lt3sigma==True)]
-    db = db.groupby('obsids').apply(findbestdataperobsid)
+    db = best_data(db)
     return db
 
 
@@ -78,49 +48,6 @@ def findhardness(db, obsid):
     hardness_error = db.hardness_err_i3t16_s6p4t9p7_h9p7t16.values[0]
     return hardness, hardness_error
 
-def cal_hue(x,y,xerr,yerr):
-    '''
-    Function to calculate the hue on basis of power colour-ratio values.
-
-    Assuming:
-     - errors symmetric along either axis
-     - errors uncorrelated with each other
-     - errors given relative to a value
-
-    Returns:
-     - [tuple] hue, hue_error
-    '''
-    # Central point
-    x0 = 4.51920
-    y0 = 0.453724
-
-    x = float(x)
-    y = float(y)
-
-    # Angles are defined in log-space
-    dx = log10(x) - log10(x0)
-    dy = log10(y) - log10(y0)
-
-    # Calculate angle
-    rads = atan2(dy,dx)
-    rads %= 2*pi
-    # Add 135 degrees as the hue angle is defined
-    # from the line extending in north-west direction
-    degs = -(rads*(180/pi)) + 135
-    # Fixing things with minus degrees
-    if degs < 0:
-        degs = (180 - abs(degs)) + 180
-
-    # Calculate errors with error propagation
-    above = (yerr*x*log10(x/x0))**2+(xerr*y*log10(y/y0))**2
-    below = (x*y*(log10(x/x0)**2 + log10(y/y0)**2))**2
-    radserr = sqrt(above/float(below))
-    radserr %= 2*pi
-    degserr = radserr*180/pi
-
-    return degs, degserr
-
-
 def plot_allpcs():
     import numpy as np
     import itertools
@@ -171,6 +98,10 @@ def plot_allpcs():
         print(name, len(bestdata))
 
         # Calculate hues
+        hues, hues_err = cal_hue(bestdata.pc1.values,
+                                 bestdata.pc2.values,
+                                 bestdata.pc1_err.values,
+                                 bestdata.pc2_err.values)
         for i in range(len(bestdata.pc1.values)):
             # Determine input parameters
             obsid = bestdata.obsids.values[i]
@@ -179,7 +110,7 @@ def plot_allpcs():
             pc2 = bestdata.pc2.values[i]
             pc1err = bestdata.pc1_err.values[i]
             pc2err = bestdata.pc2_err.values[i]
-            hue, hue_err = cal_hue(pc1,pc2,pc1err,pc2err)
+            hue, hue_err = hues[i], hues_err[i]
 
             hardness, hardness_err = findhardness(db, obsid)
             allhues.append((o, obsid, mode, pc1, pc1err, pc2, pc2err, hue, hue_err, hardness, hardness_err))
@@ -1,8 +1,10 @@
-# Quick script to run pipeline over multiple objects
-import os
-import glob
-import subprocess
+# Quick script to run pipeline over multiple objects, several at the same time
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+from subscripts.pipeline import STEPS, run_sources
+from subscripts.run_config import RunConfig
 
 objects = ['4U_0614p09',
             '4U_1636_m53',
@@ -42,25 +44,7 @@ objects = ['4U_0614p09',
             'xte_J1814m338',
             'xte_J2123_m058']
 
-filein = '/scratch/david/master_project/scripts/misc/paths.txt'
-fileout = '/scratch/david/master_project/scripts/subscripts/paths.py'
-
-f = open(filein,'r')
-filedata = f.read()
-f.close()
-
-for o in objects:
-    newdata = filedata.replace("OBJECT",o)
-
-    f = open(fileout,'w')
-    f.write(newdata)
-    f.close()
-
-    try:
-        print '====================='*2
-        print 'NEW DATA SERIES:', o
-        print '====================='*2
-        command = 'python main_pipeline.py'
-        os.system(command)
-    except:
-        continue
+# Output of each object is only written to its logs, as it would otherwise
+# be mixed up with the output of the other objects
+configs = [RunConfig(o, terminal_output=False) for o in objects]
+run_sources(configs, STEPS, workers=2)
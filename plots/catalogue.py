@@ -0,0 +1,205 @@
+# Functions to gather the best data of each obsid of all objects in a single
+# catalogue, so that plot scripts can load one file instead of the database of
+# each object. Run this script to bring the catalogue up to date.
+# Written by David Gardenier, 2015-2016
+
+import os
+import glob
+import sys
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'subscripts'))
+from hue import cal_hue
+from best_data import best_data
+from create_power_colours import BAND_SETS, power_colour_columns
+
+ROOT = '/scratch/david/master_project/'
+CATALOGUE = ROOT + 'catalogue.csv'
+# Size and modification time of each database at the last update
+SOURCES = ROOT + 'catalogue_sources.csv'
+
+# Columns taken from the rows with the best data of each obsid
+COLUMNS = ['obsids','modes','resolutions','times','power_spectra']
+
+
+def path(o):
+    return ROOT + o + '/info/database_' + o + '.csv'
+
+
+def find_objects():
+    '''Find all objects with a database'''
+    databases = glob.glob(ROOT + '*/info/database_*.csv')
+    objects = [p.split('/')[-3] for p in databases]
+    return sorted(o for o, p in zip(objects, databases) if p == path(o))
+
+
+def hardness_columns(db):
+    '''
+    Names of the flux and hardness columns in a database, per energy band.
+
+    Returns:
+     - [list] tuples with the flux, flux error, hardness and hardness error
+       columns
+    '''
+    columns = []
+    for c in db.columns:
+        if c.startswith('flux_') and not c.startswith('flux_err_'):
+            band = c[len('flux_'):]
+            hi = ['flux_' + band, 'flux_err_' + band,
+                  'hardness_' + band, 'hardness_err_' + band]
+            if all(h in db for h in hi):
+                columns.append(hi)
+    return columns
+
+
+def catalogue_rows(o, db):
+    '''
+    Function to gather the best data of each obsid of an object (see
+    best_data), for each band set of power colours in its database. The
+    hues are calculated from
+    the power colours, and the fluxes and hardnesses are taken from the
+    first row of an obsid with a flux, as in the plot scripts.
+
+    Returns:
+     - catalogue rows of the object (pandas dataframe)
+    '''
+    rows = []
+    for band_set, bands in BAND_SETS:
+        columns = power_colour_columns(band_set)
+        if not all(c in db for c in columns):
+            continue
+
+        # Only power colours below the 3 sigma limit
+        pc1, pc1_err, pc2, pc2_err, lt3sigma = columns
+        best = best_data(db[db[pc1].notnull() & (db[lt3sigma]==True)])
+        df = best[[c for c in COLUMNS if c in best]].reset_index(drop=True)
+        for c, name in zip(columns, power_colour_columns('')):
+            df[name] = best[c].values
+        df['hue'], df['hue_err'] = cal_hue(df.pc1.values, df.pc2.values,
+                                           df.pc1_err.values, df.pc2_err.values)
+        df['band_set'] = band_set
+        rows.append(df)
+
+    if not rows:
+        return pd.DataFrame()
+
+    df = pd.concat(rows, ignore_index=True, sort=False)
+
+    for hi in hardness_columns(db):
+        values = db.dropna(subset=[hi[0]]).drop_duplicates('obsids')
+        df = pd.merge(df, values[['obsids'] + hi], on='obsids', how='left')
+
+    df.insert(0, 'object', o)
+    return df
+
+
+def database_signature(p):
+    '''Size and modification time of a database file'''
+    stat = os.stat(p)
+    return stat.st_size, repr(stat.st_mtime)
+
+
+def update_catalogue(objects=None):
+    '''
+    Function to bring the catalogue up to date. Only objects whose database
+    changed since the last update are read again.
+
+    Input parameters:
+     - objects: names of objects to update, otherwise all objects with a
+                database. Other objects in the catalogue are kept as they are
+
+    Returns:
+     - [list] names of the objects which were updated
+    '''
+    catalogue = pd.DataFrame(columns=['object'])
+    sources = pd.DataFrame(columns=['object','size','mtime'])
+    if os.path.exists(CATALOGUE) and os.path.exists(SOURCES):
+        catalogue = pd.read_csv(CATALOGUE)
+        sources = pd.read_csv(SOURCES, dtype={'mtime': str})
+    known = dict((o, (s, t)) for o, s, t in zip(sources.object, sources['size'],
+                                                 sources.mtime))
+
+    parts = []
+    signatures = []
+    if objects is None:
+        objects = find_objects()
+    else:
+        parts.append(catalogue[~catalogue.object.isin(objects)])
+        signatures.extend(tuple(r) for r in sources[~sources.object.isin(objects)].values)
+
+    updated = []
+    for o in objects:
+        p = path(o)
+        if not os.path.exists(p):
+            continue
+        signature = database_signature(p)
+        signatures.append((o,) + signature)
+
+        if o in known and known[o] == signature:
+            parts.append(catalogue[catalogue.object == o])
+            continue
+
+        print o
+        parts.append(catalogue_rows(o, pd.read_csv(p)))
+        updated.append(o)
+
+    # Nothing to write if no database changed, appeared or disappeared
+    listed = sorted(o for o, size, mtime in signatures)
+    if not updated and listed == sorted(known) and os.path.exists(CATALOGUE):
+        return updated
+
+    parts = [df for df in parts if df.shape[0] > 0]
+    if parts:
+        catalogue = pd.concat(parts, ignore_index=True, sort=False)
+    else:
+        catalogue = pd.DataFrame(columns=['object'])
+
+    catalogue = catalogue.sort_values('object', kind='mergesort')
+    catalogue.to_csv(CATALOGUE, index=False)
+    sources = pd.DataFrame(signatures, columns=['object','size','mtime'])
+    sources.to_csv(SOURCES, index=False)
+    return updated
+
+
+def load_catalogue(band_set='', objects=None, update=True):
+    '''
+    Function to load the best data of each obsid of all objects. Power
+    colour columns are named as in the databases, e.g. pc1_s4 for band set
+    s4. Obsids removed by filter_bursts are flagged in the column bursts.
+
+    Input parameters:
+     - band_set: name of the band set of the power colours
+     - objects: names of the objects to load, otherwise all objects
+     - update: whether to first update the catalogue with any databases
+               which changed since (see update_catalogue)
+
+    Returns:
+     - catalogue (pandas dataframe)
+    '''
+    from filter_bursts import filter_bursts
+
+    if not os.path.exists(CATALOGUE):
+        update_catalogue()
+    elif update:
+        update_catalogue(objects)
+
+    df = pd.read_csv(CATALOGUE)
+    if df.shape[0] == 0:
+        return df
+    df = df[df.band_set.fillna('') == band_set]
+    if objects is not None:
+        df = df[df.object.isin(objects)]
+    df = df.copy()
+
+    df['bursts'] = ~df.obsids.isin(filter_bursts(df).obsids)
+
+    if band_set:
+        names = power_colour_columns('') + ['hue', 'hue_err']
+        df = df.rename(columns=dict((c, c + '_' + band_set) for c in names))
+
+    return df
+
+
+if __name__=='__main__':
+    updated = update_catalogue()
+    print 'Updated', len(updated), 'objects'
@@ -1,15 +1,24 @@
 import pandas as pd
 import os
+import glob
 
-# Import file with bursty obsids
+# Import the hand-maintained list with bursty obsids, together with the burst
+# catalogues written by find_bursts for each object
 path = os.path.dirname(os.path.realpath(__file__))
 file_name = path + '/bursts_list.txt'
 db_bursts = pd.read_csv(file_name, sep=' ')
+
+catalogues = glob.glob('/scratch/david/master_project/*/info/bursts_*.csv')
+if catalogues:
+    found = pd.concat([pd.read_csv(c) for c in catalogues])
+    found = found[found.type == 'burst']
+    db_bursts = pd.concat([db_bursts[['obsid']], found[['obsid']]])
+
 obsids_bursts = db_bursts.obsid.values.tolist()
 
 
 def filter_bursts(df):
-    """Filter out bursts found by Phil."""
+    """Filter out obsids with bursts."""
     df = df[~df['obsids'].isin(obsids_bursts)]
     df = df[~df['obsids'].astype(str).str.startswith('20161')]
     return df
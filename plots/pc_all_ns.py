@@ -8,53 +8,7 @@ import matplotlib.pyplot as plt
 import math
 from pyx import *
 
-from filter_bursts import filter_bursts
-
-def path(o):
-    return '/scratch/david/master_project/' + o + '/info/database_' + o + '.csv'
-
-
-def findbestres(res):
-    '''Find the smallest resolution from a list of resolutions'''
-
-    # Split resolutions into values and units
-    heads = []
-    tails = []
-    for s in res:
-        unit = s.strip('0123456789')
-        num = s[:-len(unit)]
-        heads.append(num)
-        tails.append(unit)
-
-    # Sort by unit, then by value
-    unitorder = ['us','ms','s']
-    for u in unitorder:
-        if u in tails:
-            indices = [i for i, x in enumerate(tails) if x==u]
-            sameunits = [heads[i] for i in indices]
-            sortvalues = sorted(sameunits)
-            return sortvalues[0]+u
-
-
-def findbestdataperobsid(df):
-    '''Select the data with best mode and resolution'''
-    ordering = ['gx1','gx2','event','binned','std2']
-    for mode in ordering:
-        if mode in df.modes.values:
-            df = df[df.modes==mode]
-            if df.shape[0] > 1:
-                bestres = findbestres(df.resolutions.values)
-                return df[df.resolutions==bestres].iloc[0]
-            else:
-                return df.iloc[0]
-
-
-def findbestdata(db):
-    # Apply constraint to the data
-    db = db[(db.pc1.notnull() & db.lt3sigma==True)]
-    db = db.groupby('obsids').apply(findbestdataperobsid)
-    return db
-
+from catalogue import load_catalogue
 
 def plot_allpcs():
     import numpy as np
@@ -103,15 +57,16 @@ def plot_allpcs():
                graph.style.errorbar(size=0,errorbarattrs=[color.gradient.Rainbow])]
     scatterstyle= [graph.style.symbol(size=0.1, symbolattrs=[color.gradient.Rainbow])]
 
+    # Best data of each obsid, without obsids with bursts
+    catalogue = load_catalogue()
+    catalogue = catalogue[~catalogue.bursts]
+
     objects = sorted(objects, key=lambda x: x[1])
     for i, o in enumerate(objects):
         print o[-1]
         name = o[-1]
         o = o[0]
-        p = path(o)
-        db = pd.read_csv(p)
-        db = findbestdata(db)
-        db = filter_bursts(db)
+        db = catalogue[catalogue.object==o]
 
         x = db.pc1.values
         y = db.pc2.values
@@ -7,10 +7,14 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import math
 from collections import defaultdict
-from scipy.stats import binned_statistic
 import numpy as np
+import sys
 from pyx import *
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'subscripts'))
+from binary_files import read_power_spectrum
+from rebin_power_spectra import log_rebin, rebinned_path, read_rebinned_power_spectrum
+
 ns={'4u_1705_m44':'4U 1705-44',
         '4U_0614p09':'4U 0614+09',
         '4U_1636_m53':'4U 1636-53',
@@ -45,44 +49,31 @@ ns={'4u_1705_m44':'4U 1705-44',
 
 def getdata(obj,obsid,mode):
 
-    path = '/scratch/david/master_project/' + obj + '/P' + obsid[:5] + '/' + obsid + '/' +mode + '_*.ps'
-    ps = glob.glob(path)
+    path = '/scratch/david/master_project/' + obj + '/P' + obsid[:5] + '/' + obsid + '/' +mode + '_*.ps*'
+    # Only the standard power spectra (<mode>_<res>), preferring binary files
+    ps = sorted(glob.glob(path), reverse=True)
+    ps = [p for p in ps if len(os.path.basename(p).split('_')) == 2]
 
-    # Import data
     try:
-        all_data = np.loadtxt(ps[0],dtype=float)
-        inverted_data = np.transpose(all_data)
-    except IOError:
+        path_ps = ps[0]
+    except IndexError:
         print 'No power spectrum'
         return
 
-    # Give the columns their names
-    ps = inverted_data[0]
-    ps_error = inverted_data[1]
-    freq = inverted_data[2]
-    freq_error = inverted_data[3]
-    ps_squared = inverted_data[4]
-    num_seg = inverted_data[5][0]
-
-    freqps_err = []
-    for i in range(len(freq)):
-        err = math.fabs(freq[i]*ps[i])*math.sqrt((freq_error[i]/float(freq[i]))**2 + (ps_error[i]/float(ps[i]))**2 + 2*(freq_error[i]*ps_error[i])/float(freq[i]*ps[i]))
-        freqps_err.append(err)
-
-    bin_means, bin_edges, binnumber = binned_statistic(freq, freq*ps, bins=np.logspace(-3,2, num=50))
-    counts, bin_edges, binnumber = binned_statistic(freq, freq*ps, statistic='count', bins=np.logspace(-3,2, num=50))
-
-    bin_errs = []
-    old_count = 0
-    for c in counts:
-        if c==0:
-            bin_errs.append(0)
-            continue
-        c = int(c)
-        indexes = [i for i in range(old_count,old_count+c)]
-        bin_err = 1/float(c)*math.sqrt(sum([e**2 for i, e in enumerate(freqps_err) if i in indexes]))
-        bin_errs.append(bin_err)
-        old_count = c
+    # Use the rebinned power spectrum if made by the pipeline, otherwise
+    # rebin here
+    path_rebinned = rebinned_path(path_ps)
+    if os.path.isfile(path_rebinned):
+        bin_means, bin_edges, bin_errs = read_rebinned_power_spectrum(path_rebinned)
+    else:
+        try:
+            ps, ps_error, freq, freq_error, ps_squared, num_seg = read_power_spectrum(path_ps)
+        except IOError:
+            print 'No power spectrum'
+            return
+
+        bin_edges = np.logspace(-3,2, num=50)
+        bin_means, bin_errs, counts = log_rebin(freq, ps, freq_error, ps_error, bin_edges)
 
     bin_centres = np.logspace(-2.95,2.05, num=50)
 
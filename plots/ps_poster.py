@@ -6,23 +6,18 @@ from scipy.stats import binned_statistic
 import matplotlib.pyplot as plt
 import numpy as np
 from collections import defaultdict
+import sys
 from pyx import *
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'subscripts'))
+from binary_files import read_power_spectrum
+
 # Import data
 try:
-    all_data = np.loadtxt('/scratch/david/master_project/aquila_X1/P40033/40033-10-03-00/event_125us.ps',dtype=float)
-    inverted_data = np.transpose(all_data)
+    ps, ps_error, freq, freq_error, ps_squared, num_seg = read_power_spectrum('/scratch/david/master_project/aquila_X1/P40033/40033-10-03-00/event_125us.psd')
 except IOError:
     print 'No power spectrum'
 
-
-# Give the columns their names
-ps = inverted_data[0]
-ps_error = inverted_data[1]
-freq = inverted_data[2]
-freq_error = inverted_data[3]
-ps_squared = inverted_data[4]
-num_seg = inverted_data[5][0]
 binmeans, binedges, binnumber = binned_statistic(freq, freq*ps, bins=np.logspace(-3,2, num=50))
 values = graph.data.values(x=binedges[:-1], y=binmeans)
 
@@ -0,0 +1,105 @@
+# Functions to select the data with the best mode and resolution of each
+# obsid, as used by the plot scripts
+# Written by David Gardenier, 2015-2016
+
+# Modes in order of preference
+MODES = ['gx1','gx2','event','binned','std2']
+
+# Length of the units in which resolutions are given
+UNITS = {'us': 1e-6, 'ms': 1e-3, 's': 1.}
+
+
+def resolution_seconds(resolutions):
+    '''
+    Function to convert resolutions such as '125us', '2ms' or '16s' to
+    seconds. Works on single values as well as on whole arrays or pandas
+    columns.
+
+    Input parameters:
+     - resolutions: resolutions as text
+
+    Returns:
+     - resolutions in seconds, NaN if not understood (float or pandas series)
+    '''
+    import numpy as np
+    import pandas as pd
+
+    scalar = np.ndim(resolutions) == 0
+
+    parts = split_resolutions(resolutions)
+    seconds = parts[0].astype(float) * parts[1].map(UNITS)
+
+    if scalar:
+        return float(seconds.iloc[0])
+
+    return seconds
+
+
+def split_resolutions(resolutions):
+    '''
+    Function to split resolutions such as '125us' into their value and unit.
+
+    Returns:
+     - pandas dataframe with the values (column 0) and units (column 1) as
+       text, NaN if not understood
+    '''
+    import numpy as np
+    import pandas as pd
+
+    resolutions = pd.Series(np.atleast_1d(resolutions)).astype(str)
+    parts = resolutions.str.extract(r'^\s*([0-9]*\.?[0-9]+)\s*([a-z]*)\s*$',
+                                    expand=True)
+    parts.index = resolutions.index
+    return parts
+
+
+def best_data(db, by=['obsids'], modes=MODES, units=None):
+    '''
+    Function to select the row with the best mode and finest resolution of
+    each obsid. Rows with other modes are left out. Of equally good rows the
+    first is taken.
+
+    Input parameters:
+     - db: database (pandas dataframe), which can hold several objects
+     - by: columns identifying an obsid, such as ['object', 'obsids'] when
+           selecting over several objects at once
+     - modes: modes in order of preference
+     - units: units of the resolutions in order of preference, for instance
+              ['ms','us','s'] to take millisecond over microsecond
+              resolutions, taking the finest resolution within a unit. By
+              default the finest resolution is taken whatever its unit
+
+    Returns:
+     - the selected rows, indexed by obsid
+    '''
+    import numpy as np
+    import pandas as pd
+
+    by = list(by)
+
+    mode_rank = pd.Categorical(db.modes, categories=modes, ordered=True).codes
+    order = db[by].copy()
+    order['mode_rank'] = mode_rank
+    order['unit_rank'] = 0.
+    if units is not None:
+        unit_rank = dict((u, i) for i, u in enumerate(units))
+        parts = split_resolutions(db.resolutions)
+        order['unit_rank'] = parts[1].map(unit_rank).values
+    order['seconds'] = resolution_seconds(db.resolutions).values
+    order['position'] = np.arange(db.shape[0])
+    order = order[order.mode_rank >= 0]
+
+    # Unknown resolutions (and units) come last
+    order = order.sort_values(by + ['mode_rank','unit_rank','seconds',
+                                    'position'],
+                              na_position='last')
+    order = order.drop_duplicates(by)
+
+    db = db.iloc[order.position.values]
+    if len(by) == 1:
+        db.index = db[by[0]].values
+        db.index.name = by[0]
+    else:
+        db.index = pd.MultiIndex.from_arrays([db[b].values for b in by],
+                                             names=by)
+    return db
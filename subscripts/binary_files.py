@@ -0,0 +1,235 @@
+# Functions to write and read the binary data files created by Chromos. Each
+# file consists of a short header describing the columns and any metadata,
+# followed by the columns themselves, which can be memory-mapped when read.
+# Written by David Gardenier, 2015-2016
+
+# Identifies a Chromos binary file, and the version of its layout
+MAGIC = 'CHROMOS1'
+
+# Columns start at a multiple of this number of bytes in the file
+ALIGNMENT = 64
+
+# Names of the columns in a power spectrum file
+PS_COLUMNS = ['power_spectrum',
+              'power_spectrum_error',
+              'frequency',
+              'frequency_error',
+              'power_spectrum_squared']
+
+# Names of the columns in a (background corrected) lightcurve file
+LC_COLUMNS = ['time',
+              'rate',
+              'error',
+              'background']
+
+
+def is_binary_file(path):
+    '''
+    Function to check whether a file is a Chromos binary file.
+    '''
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_columns(path, columns, names, meta={}):
+    '''
+    Function to write columns of equal length to a binary file.
+
+    Input parameters:
+     - path: path of the output file
+     - columns: list with arrays
+     - names: list with a name per column
+     - meta: dictionary with metadata, which must be json serialisable
+    '''
+    import json
+    import struct
+    import numpy as np
+
+    # Store everything little-endian, whatever the machine
+    arrays = []
+    for c in columns:
+        c = np.asarray(c)
+        arrays.append(np.ascontiguousarray(c, dtype=c.dtype.newbyteorder('<')))
+
+    length = len(arrays[0]) if arrays else 0
+    if any(len(a) != length for a in arrays):
+        raise ValueError('Columns are not of equal length')
+
+    header = {'columns': list(names),
+              'dtypes': [a.dtype.str for a in arrays],
+              'length': length,
+              'meta': meta}
+    header = json.dumps(header)
+
+    # Pad the header so the columns are aligned
+    start = len(MAGIC) + 4
+    padding = -(start + len(header)) % ALIGNMENT
+    header += padding*' '
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        for a in arrays:
+            f.write(a.tostring())
+
+
+def read_columns(path, mmap=True):
+    '''
+    Function to read the columns of a binary file.
+
+    Input parameters:
+     - path: path of the binary file
+     - mmap: whether to memory-map the columns rather than read them
+
+    Output parameters:
+     - columns: ordered dictionary with an array per column name
+     - meta: dictionary with the metadata
+    '''
+    import json
+    import struct
+    import numpy as np
+    from collections import OrderedDict
+
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise IOError('Not a Chromos binary file: ' + path)
+        header_length = struct.unpack('<I', f.read(4))[0]
+        header = json.loads(f.read(header_length))
+
+        offset = len(MAGIC) + 4 + header_length
+        length = header['length']
+
+        if mmap and length > 0:
+            raw = np.memmap(path, dtype=np.uint8, mode='r')
+        else:
+            f.seek(offset)
+            raw = np.frombuffer(f.read(), dtype=np.uint8)
+            offset = 0
+
+    columns = OrderedDict()
+    for name, dtype in zip(header['columns'], header['dtypes']):
+        dtype = np.dtype(str(dtype))
+        n_bytes = length*dtype.itemsize
+        columns[str(name)] = raw[offset:offset+n_bytes].view(dtype)
+        offset += n_bytes
+
+    return columns, header['meta']
+
+
+def write_power_spectrum(path, output, **meta):
+    '''
+    Function to write the output of a power spectrum calculation to a binary
+    power spectrum file.
+
+    Input parameters:
+     - path: path of the output file
+     - output: power spectrum, its error, the squared power spectrum, the
+               number of segments, frequency grid and frequency errors
+     - meta: any further information to store in the header, such as the
+             segment length
+    '''
+    ps, ps_error, ps_squared, number_of_segments, freq, freq_error = output
+
+    meta['number_of_segments'] = int(number_of_segments)
+    write_columns(path,
+                  [ps, ps_error, freq, freq_error, ps_squared],
+                  PS_COLUMNS,
+                  meta)
+
+
+def read_power_spectrum(path, mmap=True):
+    '''
+    Function to read a power spectrum file, being either a binary file or a
+    six column text file as written by earlier versions of Chromos.
+
+    Output parameters:
+     - power spectrum, power spectrum error, frequency, frequency error,
+       squared power spectrum and the number of segments (the order of the
+       columns in the text files)
+    '''
+    import numpy as np
+
+    if is_binary_file(path):
+        columns, meta = read_columns(path, mmap=mmap)
+        data = [columns[c] for c in PS_COLUMNS]
+        data.append(meta['number_of_segments'])
+    else:
+        all_data = np.loadtxt(path, dtype=float)
+        inverted_data = np.transpose(all_data)
+        data = list(inverted_data[:5])
+        data.append(int(inverted_data[5][0]))
+
+    return tuple(data)
+
+
+def convert_power_spectrum(path):
+    '''
+    Function to convert a six column text power spectrum to the binary
+    format. The binary file is written next to the text file, with the
+    extension .psd, and its path is returned.
+    '''
+    ps, ps_error, freq, freq_error, ps_squared, num_seg = read_power_spectrum(path)
+
+    new_path = path
+    if new_path.endswith('.ps'):
+        new_path = new_path[:-3]
+    new_path += '.psd'
+
+    write_power_spectrum(new_path,
+                         (ps, ps_error, ps_squared, num_seg, freq, freq_error),
+                         converted_from=path)
+
+    return new_path
+
+
+def write_light_curve(path, t, rate, error, bkg_rate, dt, **meta):
+    '''
+    Function to write a background corrected lightcurve, together with the
+    background rate which was subtracted, to a binary lightcurve file. The
+    time resolution and number of bins are stored in the header.
+
+    Input parameters:
+     - path: path of the output file
+     - t, rate, error: time grid, corrected rate and error on the rate
+     - bkg_rate: background rate on the same time grid
+     - dt: time resolution
+     - meta: any further information to store in the header
+    '''
+    meta['dt'] = float(dt)
+    meta['n_bins'] = len(t)
+    write_columns(path, [t, rate, error, bkg_rate], LC_COLUMNS, meta)
+
+
+def read_light_curve(path, path_bkg=None, mmap=True):
+    '''
+    Function to read a background corrected lightcurve, being either a
+    binary lightcurve file, or a five column text file (rate, time, dt,
+    number of bins, error) with its background in a separate text file, as
+    written by earlier versions of Chromos.
+
+    Input parameters:
+     - path: path of the lightcurve
+     - path_bkg: path of the background, only needed for text files
+     - mmap: whether to memory-map the columns of a binary file
+
+    Output parameters:
+     - rate, t, dt, n_bins, error and the background rate
+    '''
+    import numpy as np
+
+    if is_binary_file(path):
+        columns, meta = read_columns(path, mmap=mmap)
+        return (columns['rate'], columns['time'], meta['dt'], meta['n_bins'],
+                columns['error'], columns['background'])
+
+    rate, t, dt, n_bins, error = np.loadtxt(path, dtype=float, ndmin=2, unpack=True)
+    if path_bkg is None:
+        bkg_rate = None
+    else:
+        bkg_rate = np.loadtxt(path_bkg, dtype=float, ndmin=1)
+
+    if len(t) == 0:
+        return rate, t, float('NaN'), 0, error, bkg_rate
+
+    return rate, t, dt[0], int(n_bins[0]), error, bkg_rate
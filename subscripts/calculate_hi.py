@@ -41,7 +41,8 @@ def calculate_hi(low_e=3.0,
 
     # Import data
     os.chdir(paths.data)
-    db = pd.read_csv(paths.database)
+    db = database.load(['obsids', 'modes', 'paths_obsid', 'spectra',
+                        'spectra_bkg', 'rsp', 'filters'])
 
     # Compile Fortran code for later use
     cmpl = ['gfortran',
@@ -157,11 +158,7 @@ def calculate_hi(low_e=3.0,
 
     # Update database and save
     df = pd.DataFrame(d)
-    cols = ['flux_i3t16_s6p4t9p7_h9p7t16',
-            'flux_err_i3t16_s6p4t9p7_h9p7t16',
-            'hardness_i3t16_s6p4t9p7_h9p7t16',
-            'hardness_err_i3t16_s6p4t9p7_h9p7t16']
-    db = database.merge(db,df,cols)
+    db = database.upsert(db,['spectra'],df)
     print 'Number of unique elements in database'
     print '======================='
     print db.apply(pd.Series.nunique)
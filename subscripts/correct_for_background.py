@@ -32,89 +32,209 @@ def read_light_curve(path):
     return rate, t, dt, n_bins, error
 
 
-def rebin(path_obsid, path_lc, path_bkg, mode, resolution):
+def read_light_curve_chunks(path, chunk_length):
     '''
-    Function to rebin backgrounds and correct lightcurves for them
+    Generator to read the data from a lightcurve fits file in consecutive
+    chunks, so that a long lightcurve never has to be in memory as a whole.
+
+    Input parameters:
+     - path: path of the lightcurve
+     - chunk_length: length of each chunk in seconds
+
+    Output parameters (per chunk):
+     - rate, t, dt, n_bins, error: as for read_light_curve, with dt and
+       n_bins being those of the full lightcurve
+    '''
+    import numpy as np
+    from astropy.io import fits
+
+    hdulist = fits.open(path, memmap=True)
+    try:
+        # Header stuff
+        header = hdulist[1].header
+        n_bins = header['NAXIS2']
+        dt = header['TIMEDEL']
+        chunk_size = max(1, int(round(chunk_length/dt)))
+
+        # Data stuff, copying each chunk out of the memory map
+        data = hdulist[1].data
+        for start in xrange(0, n_bins, chunk_size):
+            chunk = data[start:start+chunk_size]
+            t = np.array(chunk['TIME'])
+            rate = np.array(chunk['RATE'])
+            error = np.array(chunk['ERROR'])
+            yield rate, t, dt, n_bins, error
+    finally:
+        hdulist.close()
+
+
+def interpolate_background(t, bkg_t, bkg_rate, bkg_dt, upper_index=0):
+    '''
+    Function to interpolate a background lightcurve onto the time grid of a
+    lightcurve. Times before or after the background are given the first or
+    last background rate. The time grid can be handed over in consecutive
+    chunks, by passing on the upper index returned by the previous chunk.
+
+    The value at each time is interpolated on the line between the
+    background bins upper_index-1 and upper_index, clamped to the end points
+    of that line. Whenever a time passes the background bin at the upper
+    index, the upper index moves up by one, and further for as long as the
+    time lies more than bkg_dt beyond the background bin (to skip gaps).
+    With h the first background bin not before a time and g the first
+    background bin within bkg_dt of it, this gives the recurrence
+
+        upper_index = min(h, max(previous upper_index + 1, g))
+
+    which mostly equals h. Only after a jump in time can it stay behind h
+    for a few bins, so these are the only bins followed one by one.
+
+    Input parameters:
+     - t: time grid of (a chunk of) the lightcurve
+     - bkg_t: time grid of the background
+     - bkg_rate: background rate
+     - bkg_dt: time resolution of the background
+     - upper_index: upper index returned by the previous chunk, if any
+
+    Output parameters:
+     - rebinned_bkg_rate: array with the background rate for each time in t
+     - upper_index: index to pass on with the next chunk
     '''
     import numpy as np
 
+    t = np.asarray(t, dtype=float)
+    bkg_t = np.asarray(bkg_t, dtype=float)
+    bkg_rate = np.asarray(bkg_rate, dtype=float)
+
+    # Times before or after the background take the first or last rate
+    rebinned_bkg_rate = np.empty(len(t))
+    before = t <= bkg_t[0]
+    after = ~before & (t >= bkg_t[-1])
+    rebinned_bkg_rate[before] = bkg_rate[0]
+    rebinned_bkg_rate[after] = bkg_rate[-1]
+
+    inside = np.flatnonzero(~before & ~after)
+    if len(inside) == 0:
+        return rebinned_bkg_rate, upper_index
+
+    t_inside = t[inside]
+    h = np.searchsorted(bkg_t, t_inside, side='left')
+    g = np.searchsorted(bkg_t, t_inside - bkg_dt, side='left')
+
+    # Upper index assuming the upper index of each previous bin had caught
+    # up with its h
+    previous = np.concatenate(([upper_index], h[:-1]))
+    u = np.minimum(h, np.maximum(previous + 1, g))
+
+    # Wherever the upper index falls behind, follow the next bins one by
+    # one until it has caught up again
+    followed = 0
+    for k in np.flatnonzero(u < h):
+        if k < followed:
+            continue
+        k += 1
+        while k < len(u) and u[k-1] < h[k-1]:
+            u[k] = min(h[k], max(u[k-1] + 1, g[k]))
+            k += 1
+        followed = k
+
+    # Interpolate on the line between the background bins around each upper
+    # index, as np.interp would on those two points
+    x0 = bkg_t[u-1]
+    x1 = bkg_t[u]
+    y0 = bkg_rate[u-1]
+    y1 = bkg_rate[u]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (y1 - y0)/(x1 - x0)
+        values = slope*(t_inside - x0) + y0
+        # If we get nan in one direction, try the other
+        nan = np.isnan(values)
+        values[nan] = slope[nan]*(t_inside[nan] - x1[nan]) + y1[nan]
+        values = np.where(np.isnan(values) & (y0 == y1), y0, values)
+
+    values = np.where(t_inside >= x1, y1, values)
+    values = np.where(t_inside < x0, y0, values)
+    values = np.where(t_inside == x0, y0, values)
+
+    rebinned_bkg_rate[inside] = values
+
+    return rebinned_bkg_rate, int(u[-1])
+
+
+def subtract_background(path_lc, path_bkg, mode):
+    '''
+    Function to correct a lightcurve for its background in memory, by
+    interpolating the background onto the time grid of the lightcurve (apart
+    from std2 files, which share the time grid of their background).
+
+    Input parameters:
+     - path_lc: path of the lightcurve
+     - path_bkg: path of the background lightcurve
+     - mode: data mode of the lightcurve
+
+    Output parameters:
+     - t, bkg_corrected_lc, error, rebinned_bkg_rate: time grid, corrected
+       rate, error on the rate and the subtracted background, all cut to
+       n_bins
+     - dt: time resolution
+
+    Raises an IOError if either lightcurve can't be read.
+    '''
+    rate, t, dt, n_bins, error = read_light_curve(path_lc)
+    bkg_rate, bkg_t, bkg_dt, bkg_n_bins, bkg_error = read_light_curve(path_bkg)
+
+    if mode != 'std2':
+        # Interpolate the background onto the time grid of the lightcurve
+        rebinned_bkg_rate, _ = interpolate_background(t, bkg_t, bkg_rate, bkg_dt)
+    else:
+        rebinned_bkg_rate = bkg_rate
+
+    # Correct the rate for the background
+    bkg_corrected_lc = rate - rebinned_bkg_rate
+
+    return (t[:n_bins], bkg_corrected_lc[:n_bins], error[:n_bins],
+            rebinned_bkg_rate[:n_bins], dt)
+
+
+def bkg_corrected_lc_path(path_obsid, mode, resolution):
+    '''
+    Path of the background corrected lightcurve file in an obsid folder.
+    '''
+    if mode == 'std2':
+        return path_obsid + 'bkg_corrected_lc_' + mode
+    return path_obsid + 'bkg_corrected_lc_' + mode + '_' + resolution
+
+
+def rebin(path_obsid, path_lc, path_bkg, mode, resolution):
+    '''
+    Function to rebin backgrounds and correct lightcurves for them. The
+    corrected lightcurve and the rebinned background are written to a single
+    binary lightcurve file (see binary_files.write_light_curve), of which
+    the path is returned twice, as both the rebinned background and the
+    background corrected lightcurve.
+    '''
+    import binary_files
+
     try:
-        rate, t, dt, n_bins, error = read_light_curve(path_lc)
-        bkg_rate, bkg_t, bkg_dt, bkg_n_bins, bkg_error = read_light_curve(path_bkg)
+        t, bkg_corrected_lc, error, rebinned_bkg_rate, dt = subtract_background(path_lc, path_bkg, mode)
     except IOError:
         print 'ERROR: No lightcurve!'
         return float('NaN'), float('Nan')
 
     # Output
-    path_rebinned_bkg = path_obsid + 'rebinned_bkg_lc_' + mode
-    path_bkg_corrected_lc = path_obsid + 'bkg_corrected_lc_' + mode
-
-    if mode != 'std2':
-        path_rebinned_bkg += '_' + resolution
-        path_bkg_corrected_lc += '_' + resolution
-
-        # Set up an array for the rebinned background data
-        rebinned_bkg_rate = []
-        upper_index = 0
-
-        # For each datapoint of the actual light curve
-        for k in range(n_bins):
-            # If its time value is smaller than the background time
-            if t[k] <= bkg_t[0]:
-                # Then always take the rate value of the smallest bkg time
-                rebinned_bkg_rate.append(bkg_rate[0])
-            # If its time value is larger than the background time
-            elif t[k] >= bkg_t[-1]:
-                # Then take the rate value of the last background time
-                rebinned_bkg_rate.append(bkg_rate[-1])
-            else:
-                # If the time value is larger than the background time upper
-                # index
-                if t[k] > bkg_t[upper_index]:
-
-                    # Add to the index, so the next line can be calculated
-                    upper_index += 1
-
-                    # Keep adding if there's a large gap - you only want to
-                    # start where the rate begins
-                    while t[k] - bkg_t[upper_index] > bkg_dt:
-                        upper_index += 1
-
-                    # Logically, the lower index is one less
-                    lower_index = upper_index - 1
-                    # The x-coordinates of the line:
-                    x = [bkg_t[lower_index], bkg_t[upper_index]]
-                    # The y-coordinates of the line
-                    y = [bkg_rate[lower_index], bkg_rate[upper_index]]
-
-                # Add the necessary rate value
-                rebinned_bkg_rate.append(np.interp(t[k], x, y))
-
-        # Write the rebinned background data to a file
-        with open(path_rebinned_bkg, 'w') as out_file:
-            for n in range(n_bins):
-                out_file.write(repr(rebinned_bkg_rate[n]) + '\n')
-
-        # Correct the rate for the background
-        bkg_corrected_lc = rate - rebinned_bkg_rate
-
-    else:
-        bkg_corrected_lc = rate - bkg_rate
-        # Write the rebinned background data to a file
-        with open(path_rebinned_bkg, 'w') as out_file:
-            for n in range(n_bins):
-                out_file.write(repr(bkg_rate[n]) + '\n')
+    path_bkg_corrected_lc = bkg_corrected_lc_path(path_obsid, mode, resolution)
 
     # Write the background corrected data to a file
-    with open(path_bkg_corrected_lc, 'w') as out_file:
-        for n in range(n_bins):
-            out_file.write(repr(bkg_corrected_lc[n]) + ' ' +
-                           repr(t[n]) + ' ' +
-                           repr(dt) + ' ' +
-                           str(n_bins) + ' ' +
-                           repr(error[n]) + '\n')
+    binary_files.write_light_curve(path_bkg_corrected_lc,
+                                   t,
+                                   bkg_corrected_lc,
+                                   error,
+                                   rebinned_bkg_rate,
+                                   dt,
+                                   lightcurve=path_lc,
+                                   background=path_bkg)
 
-    return path_rebinned_bkg, path_bkg_corrected_lc
+    return path_bkg_corrected_lc, path_bkg_corrected_lc
 
 
 def correct_for_background():
@@ -141,7 +261,8 @@ def correct_for_background():
     logs.output(filename)
 
     os.chdir(paths.data)
-    db = pd.read_csv(paths.database)
+    db = database.load(['obsids', 'modes', 'resolutions', 'paths_obsid',
+                        'lightcurves', 'lightcurves_bkg'])
 
     d = defaultdict(list)
     for path_lc, group in db.groupby('lightcurves'):
@@ -176,6 +297,6 @@ def correct_for_background():
 
     # Update database and save
     df = pd.DataFrame(d)
-    db = database.merge(db,df,['rebinned_bkg','bkg_corrected_lc'])
+    db = database.upsert(db,['lightcurves'],df)
     database.save(db)
     logs.stop_logging()
@@ -50,11 +50,12 @@ def pcabackest(mode,infile,outfile,filt,allpcus=True):
     shell.execute(pcabackest)
 
 
-def create_backgrounds():
+def create_backgrounds(force=False):
     '''
     Function to create a background files for each standard2 data file, and
     create a list of paths directing to these piles. Uses the ftool pcabackest
-    to create the backgrounds.
+    to create the backgrounds. Backgrounds of which the standard2 and filter
+    files haven't changed since the last run are skipped, unless forced.
     '''
 
     purpose = 'Creating background files'
@@ -68,15 +69,20 @@ def create_backgrounds():
     import logs
     import execute_shell_commands as shell
     import database
+    import provenance
 
     # Set log file
     filename = __file__.split('/')[-1].split('.')[0]
     logs.output(filename)
 
     os.chdir(paths.data)
-    db = pd.read_csv(paths.database)
+    db = database.load()
+    code = provenance.code_version(['create_backgrounds',
+                                    'execute_shell_commands'])
+    column = provenance.provenance_column('create_backgrounds')
 
     d = defaultdict(list)
+    layered = {}
     for obsid, group in db.groupby(['obsids']):
         path_obsid = group.paths_obsid.values[0]
 
@@ -95,6 +101,19 @@ def create_backgrounds():
                 print 'ERROR: No standard-2 files for this obsid'
                 continue
 
+            # Skip if made before from the same files. The rows of the
+            # layered background are only copies, so aren't compared
+            inputs = list(ngroup.paths_data) + list(ngroup.filters)
+            h = provenance.input_hash(inputs, [mode], code)
+            if 'paths_bkg' in modegroup:
+                path_list = path_obsid + 'bkg_' + mode + '.lst'
+                rows = modegroup[modegroup.paths_bkg == path_list]
+            else:
+                rows = modegroup.iloc[:0]
+            if not force and provenance.unchanged(rows, 'create_backgrounds', h, ['paths_bkg']):
+                print 'Unchanged since last run'
+                continue
+
             # Keep track of files you'll create
             bkgs = []
             bkgs_per_layer = []
@@ -126,23 +145,41 @@ def create_backgrounds():
                 d['obsids'].append(obsid)
                 d['modes'].append('gx2')
                 d['paths_bkg'].append(outfile)
+                d[column].append(h)
                 mode = 'gx1'
 
             d['obsids'].append(obsid)
             d['modes'].append(mode)
             d['paths_bkg'].append(outfile)
+            d[column].append(h)
 
             # Ugly way of getting the files for the layered background
             if mode == 'std2':
                 outfile = path_obsid + 'bkg_std2_per_layer.lst'
                 with open(outfile, 'w') as text:
                     text.write('\n'.join(bkgs_per_layer) + '\n')
-                d['obsids'].append(obsid)
-                d['modes'].append(mode)
-                d['paths_bkg'].append(outfile)
-
-    # Update database and save
+                layered[obsid] = outfile
+
+    # Rows for the layered backgrounds are kept apart, as they share their
+    # obsids and modes with the other std2 rows
+    if 'paths_bkg' in db:
+        per_layer = db.paths_bkg.str.endswith('_per_layer.lst', na=False)
+    else:
+        per_layer = pd.Series(False, index=db.index)
+    db_layered = db[per_layer]
+    db = db[~per_layer].copy()
+
+    # Update database
     df = pd.DataFrame(d)
-    db = database.merge(db,df,['paths_bkg'])
-    database.save(db)
+    db = database.upsert(db,['obsids','modes'],df)
+
+    # Copy the std2 rows of each obsid for the layered background, unless
+    # done in an earlier run
+    new = db[(db.modes=='std2') & db.obsids.isin(layered.keys()) &
+             ~db.obsids.isin(db_layered.obsids)].copy()
+    new['paths_bkg'] = new.obsids.map(layered)
+    db = pd.concat([db, db_layered, new], ignore_index=True, sort=False)
+
+    # Rows were added outside of upserts
+    database.save(db, whole=True)
     logs.stop_logging()
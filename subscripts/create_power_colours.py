@@ -2,92 +2,463 @@
 # Written by David Gardenier, 2015-2016
 
 
-def power_colour(path):
+# Define the frequency bands in Hz
+FREQUENCY_BANDS = [1/256.,1/32.,0.25,2.0,16.0]
+
+# Named sets of frequency bands, each giving its own power colours. The name
+# is appended to the database columns, apart from the standard bands
+BAND_SETS = [('', FREQUENCY_BANDS),
+             # Frequency bands shifted by 4
+             ('s4', [f*4 for f in FREQUENCY_BANDS]),
+             # Frequency bands shifted by 5
+             ('shiftedby5', [0.0195,0.155,1.25,10.0,80.0])]
+
+
+def band_indices(frequency, frequency_bands=FREQUENCY_BANDS):
     '''
-    Function to calculate the power colour values per power spectrum.
-    Integrates between 4 areas under the power spectrum (variance), and takes
-    the ratio of the variances to calculate the power colour values.
+    Function to convert frequency bands to index values in a (sorted)
+    frequency grid, taking the nearest frequency to each band edge. If two
+    frequencies are equally near, the lower one is taken.
     '''
     import numpy as np
 
-    # Define the frequency bands in Hz
-    frequency_bands = [1/256.,1/32.,0.25,2.0,16.0]
-    # If you wish to shift the frequency bands by 5
-    # frequency_bands = [0.0195,0.155,1.25,10.0,80.0]
-    # If you wish to shift the frequency bands by 4
-    # frequency_bands = [f*4 for f in frequency_bands]
-
-    # Import data
-    try:
-        all_data = np.loadtxt(path,dtype=float)
-        inverted_data = np.transpose(all_data)
-    except IOError:
-        print 'ERROR: Power spectrum not present'
-        return
-
-    # Give the columns their names
-    power_spectrum = inverted_data[0]
-    power_spectrum_error = inverted_data[1]
-    frequency = inverted_data[2]
-    frequency_error = inverted_data[3]
-    power_spectrum_squared = inverted_data[4]
-    number_of_segments = inverted_data[5][0]
-
-    variances = []
-    variance_errors = []
-    index_frequency_bands = []
-
-    # Convert frequency bands to index values from in the frequency list
-    for fb in frequency_bands:
-        index = min(range(len(frequency)), key=lambda i: abs(frequency[i]-fb))
-        index_frequency_bands.append([index])
-
-    # Group indexes into sets of style [low, high)
-    for i, e in enumerate(index_frequency_bands[:-1]):
-        e.append(index_frequency_bands[i+1][0]-1)
-
-    del index_frequency_bands[-1]
+    frequency = np.asarray(frequency)
+    frequency_bands = np.asarray(frequency_bands, dtype=float)
+
+    upper = np.searchsorted(frequency, frequency_bands)
+    upper = np.clip(upper, 0, len(frequency) - 1)
+    lower = np.clip(upper - 1, 0, len(frequency) - 1)
+
+    distance_lower = np.abs(frequency[lower] - frequency_bands)
+    distance_upper = np.abs(frequency[upper] - frequency_bands)
+
+    return np.where(distance_lower <= distance_upper, lower, upper)
 
-    # Integrate the power spectra within the frequency bands
-    bin_width = frequency[1]-frequency[0]
 
-    for e in index_frequency_bands:
-        variance = bin_width*sum(power_spectrum[e[0]:e[1]])
-        variances.append(variance)
+def band_limits(index):
+    '''
+    Function to group band edge indexes into sets of style [low, high),
+    where high is one below the index of the next band edge.
+    '''
+    import numpy as np
+
+    low = index[:-1]
+    high = np.maximum(index[1:] - 1, low)
 
-        # Calculate errors on the variance
-        # (see appendix Heil, Vaughan & Uttley 2012)
-        # M refers to the number of segments
-        one_over_sqrt_M = 1/float(np.sqrt(number_of_segments))
-        prop_std = sum(power_spectrum_squared[e[0]:e[1]])
-        variance_error = bin_width*one_over_sqrt_M*np.sqrt(prop_std)
-        variance_errors.append(variance_error)
+    return low, high
 
-    pc1 = variances[2]/float(variances[0])
-    pc2 = variances[1]/float(variances[3])
 
-    pc1_error = np.sqrt((variance_errors[2]/float(variances[2]))**2 +
-                        (variance_errors[0]/float(variances[0]))**2)*pc1
-    pc2_error = np.sqrt((variance_errors[1]/float(variances[1]))**2 +
-                        (variance_errors[3]/float(variances[3]))**2)*pc2
+def cumulative_integral(x, start, stop):
+    '''
+    Function to calculate the cumulative sums along each row of a 2-D array,
+    from bin start up to bin stop, preceded by a zero. The sum over bins
+    [low, high) is then c[high-start] - c[low-start].
+    '''
+    import numpy as np
+
+    cumulative = np.zeros((x.shape[0], stop - start + 1))
+    np.cumsum(x[:, start:stop], axis=1, out=cumulative[:, 1:])
+
+    return cumulative
+
+
+def colours_from_integrals(cumulative_ps, cumulative_ps_squared, start, index,
+                           bin_width, number_of_segments):
+    '''
+    Function to calculate power colours from cumulative integrals of the
+    power spectra and squared power spectra (see cumulative_integral).
+
+    Input parameters:
+     - cumulative_ps, cumulative_ps_squared: cumulative integrals per row
+     - start: bin at which the cumulative integrals start
+     - index: indexes of the band edges (see band_indices)
+     - bin_width: width of a frequency bin
+     - number_of_segments: array with the number of segments per row
+
+    Output parameters:
+     - arrays with pc1, pc1_error, pc2, pc2_error and whether all variances
+       were constrained within 3 sigma
+    '''
+    import numpy as np
+
+    low, high = band_limits(index)
+    low = low - start
+    high = high - start
+
+    # Integrate the power spectra within the frequency bands
+    variances = bin_width*(cumulative_ps[:, high] - cumulative_ps[:, low])
+
+    # Calculate errors on the variance
+    # (see appendix Heil, Vaughan & Uttley 2012)
+    # M refers to the number of segments
+    one_over_sqrt_M = 1/np.sqrt(np.asarray(number_of_segments, dtype=float))
+    prop_std = cumulative_ps_squared[:, high] - cumulative_ps_squared[:, low]
+    variance_errors = bin_width*one_over_sqrt_M[:, np.newaxis]*np.sqrt(prop_std)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pc1 = variances[:, 2]/variances[:, 0]
+        pc2 = variances[:, 1]/variances[:, 3]
+
+        pc1_error = np.sqrt((variance_errors[:, 2]/variances[:, 2])**2 +
+                            (variance_errors[:, 0]/variances[:, 0])**2)*pc1
+        pc2_error = np.sqrt((variance_errors[:, 1]/variances[:, 1])**2 +
+                            (variance_errors[:, 3]/variances[:, 3])**2)*pc2
 
     # Applying similar filter to Lucy, only plotting if variance constrained
     # within 3sigma
-    for i, e in enumerate(variance_errors):
-        v = variances[i]
-
-        if v - 3*e > 0:
-            constrained = True
-        else:
-            constrained = False
-            break
+    constrained = np.all(variances - 3*variance_errors > 0, axis=1)
 
     return pc1, pc1_error, pc2, pc2_error, constrained
 
 
-def create_power_colours():
+def monte_carlo_colours(cumulative_ps, cumulative_raw, cumulative_ps_squared,
+                        start, index, bin_width, number_of_segments,
+                        n_draws=1000, random_state=None):
+    '''
+    Function to determine power colour errors by drawing realisations of
+    the band variances, for all power spectra at once.
+
+    The powers in each frequency bin are averages over M segments of powers
+    which are exponentially distributed before the noise is subtracted, so
+    the mean raw power per bin follows from the mean squared power as
+    sqrt(<P^2>/2), and the variance of its average as <P^2>/(2M). The raw
+    power integrated over each band is drawn from a gamma distribution with
+    the same mean and variance, after which the noise level is subtracted
+    again. Unlike linear error propagation, this also holds for bands of
+    only a few bins or segments, as found for faint sources.
+
+    Input parameters:
+     - cumulative_ps: cumulative integral of the power spectra
+     - cumulative_raw: cumulative integral of the mean raw powers
+     - cumulative_ps_squared: cumulative integral of the squared powers
+     - start, index, bin_width, number_of_segments: see
+       colours_from_integrals
+     - n_draws: number of realisations per power spectrum
+     - random_state: numpy RandomState to draw from
+
+    Output parameters:
+     - arrays with pc1, pc1_error, pc2, pc2_error, whether all variances
+       were constrained within 3 sigma, the lower and upper errors on pc1
+       and pc2 (from the 16th and 84th percentiles), the hue, and its lower
+       and upper errors
+    '''
+    import warnings
+    import numpy as np
+    from hue import cal_hue
+
+    if random_state is None:
+        random_state = np.random.RandomState()
+
+    low, high = band_limits(index)
+    low = low - start
+    high = high - start
+
+    def band_sums(c):
+        return c[:, high] - c[:, low]
+
+    M = np.asarray(number_of_segments, dtype=float)[:, np.newaxis]
+
+    variances = bin_width*band_sums(cumulative_ps)
+    raw = bin_width*band_sums(cumulative_raw)
+    raw_variance = bin_width**2*band_sums(cumulative_ps_squared)/(2*M)
+
+    # Moment matched gamma distributions of the raw band powers. Bands
+    # without a valid (positive) mean or spread don't vary
+    valid = (raw > 0) & (raw_variance > 0)
+    shape = np.where(valid, raw**2/np.where(valid, raw_variance, 1), 1)
+    scale = np.where(valid, raw_variance/np.where(valid, raw, 1), 1)
+
+    draws = random_state.gamma(shape[..., np.newaxis], scale[..., np.newaxis],
+                               size=shape.shape + (n_draws,))
+    draws = np.where(valid[..., np.newaxis], draws, raw[..., np.newaxis])
+
+    # Subtract the noise level from each realisation
+    draws += (variances - raw)[..., np.newaxis]
+
+    # Power spectra without any valid realisation give NaN errors
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+
+        pc1 = variances[:, 2]/variances[:, 0]
+        pc2 = variances[:, 1]/variances[:, 3]
+        pc1_draws = draws[:, 2]/draws[:, 0]
+        pc2_draws = draws[:, 1]/draws[:, 3]
+
+        pc1_low, pc1_high = np.nanpercentile(pc1_draws, [16, 84], axis=1)
+        pc2_low, pc2_high = np.nanpercentile(pc2_draws, [16, 84], axis=1)
+
+        # The hue is an angle, so measure the spread of the realisations
+        # around the hue of the power colours
+        hue, hue_err = cal_hue(pc1, pc2, 0, 0)
+        hue_draws, hue_draws_err = cal_hue(pc1_draws, pc2_draws, 0, 0)
+        offsets = (hue_draws - hue[:, np.newaxis] + 180) % 360 - 180
+        hue_low, hue_high = np.nanpercentile(offsets, [16, 84], axis=1)
+
+    pc1_err_low = pc1 - pc1_low
+    pc1_err_high = pc1_high - pc1
+    pc2_err_low = pc2 - pc2_low
+    pc2_err_high = pc2_high - pc2
+
+    # Only keep variances of which less than 0.135 per cent of the
+    # realisations are negative, the equivalent of the 3 sigma constraint
+    lowest = np.percentile(draws, 0.135, axis=2)
+    constrained = np.all(lowest > 0, axis=1)
+
+    return (pc1, (pc1_err_low + pc1_err_high)/2.,
+            pc2, (pc2_err_low + pc2_err_high)/2.,
+            constrained,
+            pc1_err_low, pc1_err_high,
+            pc2_err_low, pc2_err_high,
+            hue, -hue_low, hue_high)
+
+
+def power_colours(power_spectra, power_spectra_squared, frequency,
+                  number_of_segments, frequency_bands=FREQUENCY_BANDS):
+    '''
+    Function to calculate the power colour values of many power spectra on
+    the same frequency grid at once. Integrates between 4 areas under each
+    power spectrum (variance), and takes the ratio of the variances to
+    calculate the power colour values.
+
+    Input parameters:
+     - power_spectra: 2-D array with a power spectrum per row
+     - power_spectra_squared: 2-D array with the squared power spectra
+     - frequency: frequency grid shared by all power spectra
+     - number_of_segments: array with the number of segments per power
+                           spectrum
+     - frequency_bands: edges of the frequency bands in Hz
+
+    Output parameters:
+     - see colours_from_integrals
+    '''
+    import numpy as np
+
+    power_spectra = np.atleast_2d(power_spectra)
+    power_spectra_squared = np.atleast_2d(power_spectra_squared)
+
+    index = band_indices(frequency, frequency_bands)
+    low, high = band_limits(index)
+
+    # Integrate using cumulative sums, so that all bands follow from a single
+    # pass (starting at the first band edge, to keep the rounding small)
+    start = low.min()
+    stop = high.max()
+    cumulative_ps = cumulative_integral(power_spectra, start, stop)
+    cumulative_ps_squared = cumulative_integral(power_spectra_squared, start,
+                                                stop)
+
+    bin_width = frequency[1]-frequency[0]
+
+    return colours_from_integrals(cumulative_ps, cumulative_ps_squared, start,
+                                  index, bin_width, number_of_segments)
+
+
+def trim_power_spectrum(data, band_sets=BAND_SETS):
+    '''
+    Function to copy the part of a power spectrum needed for its power
+    colours, being the bins spanned by any of the band sets, so the rest of
+    the power spectrum (and any file it is memory-mapped from) can be let go.
+
+    Input parameters:
+     - data: power spectrum as given by binary_files.read_power_spectrum
+     - band_sets: list with (name, frequency bands) tuples
+
+    Output parameters:
+     - grid: tuple with a key identifying the frequency grid, the band edge
+             indexes per band set counted from the first copied bin, and
+             the bin width
+     - copied bins of the power spectrum
+     - copied bins of the squared power spectrum
+     - number of segments
+    '''
+    import hashlib
+    import numpy as np
+
+    frequency = data[2]
+    key = (len(frequency),
+           hashlib.sha1(np.ascontiguousarray(frequency).tostring()).hexdigest())
+
+    indexes = [band_indices(frequency, bands) for name, bands in band_sets]
+    limits = [band_limits(index) for index in indexes]
+    start = min(low.min() for low, high in limits)
+    stop = max(high.max() for low, high in limits)
+
+    grid = (key, [index - start for index in indexes],
+            frequency[1]-frequency[0])
+    ps = np.array(data[0][start:stop], dtype=float)
+    ps_squared = np.array(data[4][start:stop], dtype=float)
+
+    return grid, ps, ps_squared, data[5]
+
+
+def batch_power_colours(paths_ps, band_sets=BAND_SETS, chunk_size=1000,
+                        error_mode='linear', n_draws=1000, seed=None):
+    '''
+    Function to calculate the power colours of a list of power spectra files
+    for several sets of frequency bands (see grid_power_colours).
+
+    Input parameters:
+     - paths_ps: list with paths to power spectra
+     - band_sets, chunk_size, error_mode, n_draws, seed: see
+       grid_power_colours
+
+    Output parameters:
+     - dictionary with per path a dictionary with the output of
+       colours_from_integrals or monte_carlo_colours per band set name,
+       without the power spectra which could not be read
+    '''
+    import binary_files
+
+    # Only keep the bins within the bands of each power spectrum, letting go
+    # of its file before reading the next one
+    power_spectra = []
+    for path in paths_ps:
+        try:
+            data = binary_files.read_power_spectrum(path)
+        except IOError:
+            print 'ERROR: Power spectrum not present', path
+            continue
+        power_spectra.append((path, trim_power_spectrum(data, band_sets)))
+        del data
+
+    return trimmed_power_colours(power_spectra, band_sets, chunk_size,
+                                 error_mode, n_draws, seed)
+
+
+def grid_power_colours(power_spectra, band_sets=BAND_SETS, chunk_size=1000,
+                       error_mode='linear', n_draws=1000, seed=None):
+    '''
+    Function to calculate the power colours of power spectra in memory for
+    several sets of frequency bands (see trimmed_power_colours).
+
+    Input parameters:
+     - power_spectra: list with (key, data) tuples, with data as given by
+                      binary_files.read_power_spectrum
+     - band_sets, chunk_size, error_mode, n_draws, seed: see
+       trimmed_power_colours
+
+    Output parameters:
+     - dictionary with per key a dictionary with the output of
+       colours_from_integrals or monte_carlo_colours per band set name
+    '''
+    trimmed = [(key, trim_power_spectrum(data, band_sets))
+               for key, data in power_spectra]
+
+    return trimmed_power_colours(trimmed, band_sets, chunk_size, error_mode,
+                                 n_draws, seed)
+
+
+def trimmed_power_colours(power_spectra, band_sets=BAND_SETS, chunk_size=1000,
+                          error_mode='linear', n_draws=1000, seed=None):
+    '''
+    Function to calculate the power colours of trimmed power spectra for
+    several sets of frequency bands. Power spectra sharing a frequency grid
+    are stacked into 2-D arrays and handled together, in chunks of at most
+    chunk_size power spectra. A single cumulative integral per power
+    spectrum, covering the bands of all sets, is used for every band set.
+
+    Input parameters:
+     - power_spectra: list with (key, trimmed) tuples, with trimmed as given
+                      by trim_power_spectrum for the same band sets
+     - band_sets: list with (name, frequency bands) tuples
+     - error_mode: 'linear' for linear error propagation, or 'monte_carlo'
+                   for errors from drawn realisations of the band variances
+                   (see monte_carlo_colours)
+     - n_draws: number of realisations per power spectrum
+     - seed: seed of the random draws
+
+    Output parameters:
+     - dictionary with per key a dictionary with the output of
+       colours_from_integrals or monte_carlo_colours per band set name
+    '''
+    import numpy as np
+    from collections import OrderedDict
+
+    if error_mode not in ('linear', 'monte_carlo'):
+        raise ValueError('Unknown error mode: ' + str(error_mode))
+
+    random_state = np.random.RandomState(seed)
+
+    # Group the power spectra by frequency grid
+    grids = OrderedDict()
+    for path, trimmed in power_spectra:
+        grids.setdefault(trimmed[0][0], []).append((path, trimmed))
+
+    outputs = {}
+    for group in grids.itervalues():
+        key, indexes, bin_width = group[0][1][0]
+
+        for i in xrange(0, len(group), chunk_size):
+            chunk = group[i:i+chunk_size]
+
+            ps = np.array([trimmed[1] for path, trimmed in chunk])
+            ps_squared = np.array([trimmed[2] for path, trimmed in chunk])
+            number_of_segments = [trimmed[3] for path, trimmed in chunk]
+            length = ps.shape[1]
+
+            cumulative_ps = cumulative_integral(ps, 0, length)
+            cumulative_ps_squared = cumulative_integral(ps_squared, 0, length)
+            if error_mode == 'monte_carlo':
+                cumulative_raw = cumulative_integral(np.sqrt(ps_squared/2.), 0,
+                                                     length)
+
+            for (name, bands), index in zip(band_sets, indexes):
+                if error_mode == 'monte_carlo':
+                    output = monte_carlo_colours(cumulative_ps, cumulative_raw,
+                                                 cumulative_ps_squared,
+                                                 0, index, bin_width,
+                                                 number_of_segments,
+                                                 n_draws, random_state)
+                else:
+                    output = colours_from_integrals(cumulative_ps,
+                                                    cumulative_ps_squared,
+                                                    0, index, bin_width,
+                                                    number_of_segments)
+
+                for j, (path, trimmed) in enumerate(chunk):
+                    outputs.setdefault(path, {})[name] = tuple(o[j] for o in output)
+
+    return outputs
+
+
+def power_colour(path, frequency_bands=FREQUENCY_BANDS):
+    '''
+    Function to calculate the power colour values of a single power
+    spectrum (see power_colours).
+    '''
+    outputs = batch_power_colours([path], [('', frequency_bands)])
+
+    if path in outputs:
+        return outputs[path]['']
+
+
+def power_colour_columns(name, error_mode='linear'):
+    '''
+    Names of the database columns with the power colours of a band set.
+    '''
+    columns = ['pc1','pc1_err','pc2','pc2_err','lt3sigma']
+    if error_mode == 'monte_carlo':
+        columns += ['pc1_err_low','pc1_err_high','pc2_err_low','pc2_err_high',
+                    'hue','hue_err_low','hue_err_high']
+    if name:
+        columns = [c + '_' + name for c in columns]
+    return columns
+
+
+def create_power_colours(band_sets=BAND_SETS, error_mode='linear',
+                         n_draws=1000, seed=None):
     '''
     Function to generate power spectral density based on RXTE lightcurves.
+
+    Arguments:
+     - band_sets: list with (name, frequency bands) tuples, of which the power
+                  colours are stored in separate columns (see
+                  power_colour_columns)
+     - error_mode: 'linear' or 'monte_carlo'. The latter bases the errors and
+                   the 3 sigma constraint on n_draws realisations of each
+                   power spectrum, and also stores percentile errors on pc1,
+                   pc2 and the hue (see monte_carlo_colours)
+     - n_draws, seed: number of realisations and seed of the random draws
     '''
 
     # Let the user know what's going to happen
@@ -110,10 +481,17 @@ def create_power_colours():
 
     # Get database
     os.chdir(paths.data)
-    db = pd.read_csv(paths.database)
+    db = database.load(['obsids', 'modes', 'resolutions', 'paths_obsid',
+                        'power_spectra'])
+
+    # Calculate the power colours of all power spectra at once
+    groups = db.groupby('power_spectra')
+    outputs = batch_power_colours([ps for ps, group in groups], band_sets,
+                                  error_mode=error_mode, n_draws=n_draws,
+                                  seed=seed)
 
     d = defaultdict(list)
-    for ps, group in db.groupby('power_spectra'):
+    for ps, group in groups:
 
         # Determine parameters
         obsid = group.obsids.values[0]
@@ -123,22 +501,18 @@ def create_power_colours():
 
         print obsid, mode, res
 
-        # Calculate power colour
-        output = power_colour(ps)
-
-        if output:
-            pc1, pc1err, pc2, pc2err, constraint = output
+        if ps not in outputs:
+            continue
 
-            d['power_spectra'].append(ps)
-            d['pc1'].append(pc1)
-            d['pc1_err'].append(pc1err)
-            d['pc2'].append(pc2)
-            d['pc2_err'].append(pc2err)
-            d['lt3sigma'].append(constraint)
+        d['power_spectra'].append(ps)
+        for name, bands in band_sets:
+            for column, value in zip(power_colour_columns(name, error_mode),
+                                     outputs[ps][name]):
+                d[column].append(value)
 
     # Update database and save
     df = pd.DataFrame(d)
-    db = database.merge(db,df,['pc1','pc1_err','pc2','pc2_err','lt3sigma'])
+    db = database.upsert(db,['power_spectra'],df)
     print 'DBNUNIQUE\n', db.apply(pd.Series.nunique)
     database.save(db)
     logs.stop_logging()
@@ -1,114 +1,146 @@
 # Functions to create power spectra from lightcurves
 # Written by David Gardenier, 2015-2016
 
-def power_spectrum(path_lc, path_bkg, path_std1, npcu):
+def find_runs(t, dt):
+    '''
+    Function to find the stretches of uninterrupted data in a lightcurve. A
+    new stretch starts wherever the step to the previous time bin is not
+    smaller than 1.5 times the bin width.
+
+    Input parameters:
+     - t: time grid of the observation
+     - dt: time resolution
 
+    Output parameters:
+     - starts: index of the first bin of each stretch
+     - ends: index of the last bin of each stretch
+    '''
     import numpy as np
-    import numpy.fft as fft
-    import math
-    import deadtime as deadt
 
-    try:
-        # Reading in the lightcurve data for each path/file
-        rate, t, dt, n_bins, error = np.loadtxt(path_lc,dtype=float,unpack=True)
-        bkg_rate = np.loadtxt(path_bkg, dtype=float, unpack=True)
-    except IOError:
-        print 'ERROR: Lightcurve does not exist'
-        return
+    # Written as not(<) rather than >= so that NaN times also count as gaps,
+    # as they did in the original loop
+    gaps = np.flatnonzero(~(np.diff(t) < 1.5*dt)) + 1
 
-    # Check whether there are any counts
-    if sum(rate) < 10:
-        print 'ERROR: Lightcurve has zero count rate'
-        return
+    starts = np.concatenate(([0], gaps))
+    ends = np.concatenate((gaps - 1, [len(t) - 1]))
 
-    # Determine the number of bins
-    try:
-        n_bins = int(n_bins[0])
-    except IndexError:
-        print 'ERROR: No data in lightcurve file'
-        return
+    return starts, ends
 
-    # Determine the (time) width of each bin
-    dt = dt[0]
 
-    # Express the length of each segment size in units of dt
-    n = 256/dt
-    # n should already be a power of 2 - but in case if isn't
-    # this line will round it off to the nearest power of 2
-    n_seg = pow(2, int(math.log(n, 2) + 0.5))
+def find_segments(starts, ends, n_seg):
+    '''
+    Function to cut stretches of uninterrupted data into segments of n_seg
+    bins. A segment ends at bin j if the n_seg steps leading up to j are all
+    free of gaps, after which the next segment starts at j. This gives
+    exactly the endpoints of the former bin-by-bin loop.
+
+    Input parameters:
+     - starts: index of the first bin of each stretch (see find_runs)
+     - ends: index of the last bin of each stretch (see find_runs)
+     - n_seg: number of bins per segment
+
+    Output parameters:
+     - endpoints: array with the (exclusive) end index of each segment
+    '''
+    import numpy as np
 
-    # Whether you wish subtract white noise
-    noise_subtraction = True
+    # Number of complete segments fitting in each stretch
+    counts = np.maximum((ends - starts) // n_seg, 0)
 
-    # A list with indexes of segment end points
-    segment_endpoints = []
+    # Number each segment within its own stretch (1, 2, ...) using the
+    # cumulative segment counts
+    offsets = np.cumsum(counts) - counts
+    k = np.arange(1, counts.sum() + 1) - np.repeat(offsets, counts)
 
-    # The length of a segment starts at zero
-    length = 0
+    return np.repeat(starts, counts) + k*n_seg
 
-    # Calculate where the data should be cut
-    for j in xrange(1, n_bins):
 
-        # Check for gaps; in case of a gap, set length to zero.
-        if (t[j] - t[j-1]) < 1.5*dt:
-            length = length+1
-        else:
-            length = 0
+def stack_segments(x, endpoints, n_seg):
+    '''
+    Function to gather all segments of an array into a single 2-D array, with
+    one segment per row, ready for a batched Fourier transform.
+    '''
+    import numpy as np
+    from numpy.lib.stride_tricks import as_strided
 
-        # Check if the length has reached the required segment size
-        if length == n_seg:
+    x = np.ascontiguousarray(x)
+    step = x.strides[0]
 
-            # If so, add the endpoint to the endpoint list
-            segment_endpoints.append(j)
-            # And reset the length to zero:
-            length = 0
+    # A view with every possible window of n_seg bins, from which only the
+    # windows of the segments are copied
+    windows = as_strided(x, shape=(len(x) - n_seg + 1, n_seg),
+                         strides=(step, step))
 
-    # Calculating the number of segments
-    number_of_segments = len(segment_endpoints)
-    # For ease, using M for the total number of segments
-    M = float(number_of_segments)
+    return windows[endpoints - n_seg]
 
-    # Stop calculations if no segments can be found
-    if number_of_segments == 0:
-        print 'WARNING: No segments found'
-        return
 
-    # Initialise the power spectrum array
-    power_spectrum = np.zeros((n_seg))
-    # Necessary for errors on power colour values
-    power_spectrum_squared = np.zeros((n_seg))
+def segment_bins(segment_length, dt):
+    '''
+    Function to express a segment length in seconds as a number of bins.
+    '''
+    import math
 
-    # Calculate the corresponding frequency grid
-    # (assuming that dt is the same for all)
-    frequency = fft.fftfreq(n_seg, dt)
+    # Express the length of each segment size in units of dt
+    n = segment_length/dt
+    # n should already be a power of 2 - but in case if isn't
+    # this line will round it off to the nearest power of 2
+    return pow(2, int(math.log(n, 2) + 0.5))
 
-    # Calculate the error on the frequencies
-    frequency_error = (1.0/(2*dt*float(n_seg)))*np.ones(n_seg/2 - 1)
 
-    # Initialise rate arrays
-    rate_tot = []
-    bkg_tot = []
+def segment_powers(segments, n_seg, fft_mode='full'):
+    '''
+    Function to calculate the squared modulus of the fast Fourier transform of
+    each segment (row) in a 2-D array, using either a complex fft over all
+    frequencies ('full'), or a real fft only giving the zero and positive
+    frequencies up to the Nyquist frequency ('real').
+    '''
+    import numpy as np
+    import numpy.fft as fft
 
-    # For each segment
-    for j in xrange(number_of_segments):
-        # Make an array containing the segment of the light curve
-        segment = rate[segment_endpoints[j]-n_seg : segment_endpoints[j]]
-        bkg_segment = bkg_rate[segment_endpoints[j]-n_seg : segment_endpoints[j]]
+    if fft_mode == 'full':
+        four_trans = fft.fft(segments, n_seg, 1)
+        return (np.absolute(four_trans))**2
+    elif fft_mode == 'real':
+        four_trans = fft.rfft(segments, n_seg, 1)
+        return four_trans.real**2 + four_trans.imag**2
+    else:
+        raise ValueError('Unknown fft mode: ' + str(fft_mode))
 
-        # Calculate the fast Fourier transform
-        four_trans = fft.fft(segment, n_seg, 0)
 
-        # Add the square of the FFT to the power spectrum
-        fft_sq = (np.absolute(four_trans))**2
-        power_spectrum += fft_sq
+def finish_power_spectrum(power_spectrum, power_spectrum_squared, M, norm,
+                          mean_rate, mean_bkg, dt, n_seg, path_std1, npcu,
+                          noise_subtraction=True):
+    '''
+    Function to turn summed (squared) powers into an averaged, normalised,
+    noise subtracted power spectrum.
+
+    Input parameters:
+     - power_spectrum: sum of the powers over all segments, either over the
+                       full frequency grid or up to the Nyquist frequency
+     - power_spectrum_squared: sum of the squared powers
+     - M: number of segments
+     - norm: normalisation still to be applied to the powers
+     - mean_rate, mean_bkg: mean (background) rate over all segments
+     - dt, n_seg: time resolution and number of bins per segment
+     - path_std1, npcu: std1 file and number of pcus for the dead time
+     - noise_subtraction: whether to subtract the white noise
+
+    Output parameters:
+     - power spectrum, its error, the squared power spectrum, the number of
+       segments, the frequency grid and the error on the frequencies
+    '''
+    import numpy as np
+    import numpy.fft as fft
+    import deadtime as deadt
 
-        # Add the squared power spectrum
-        power_spectrum_squared += (fft_sq)**2
+    M = float(M)
 
-        # For calculating the total white noise
-        if noise_subtraction:
-            rate_tot.extend(segment)
-            bkg_tot.extend(bkg_segment)
+    # Calculate the corresponding frequency grid
+    # (assuming that dt is the same for all)
+    frequency = fft.fftfreq(n_seg, dt)
+
+    # Calculate the error on the frequencies
+    frequency_error = (1.0/(2*dt*float(n_seg)))*np.ones(n_seg/2 - 1)
 
     # Calculate the mean power spectrum
     power_spectrum = power_spectrum/M
@@ -119,17 +151,18 @@ def power_spectrum(path_lc, path_bkg, path_std1, npcu):
     # Calculating the error on the power spectrum
     power_spectrum_error = power_spectrum/np.sqrt(M)
 
-    # Calculate the normalisation of the power spectrum
-    # (rms normalisation)
-    norm = (2*dt)/(float(n_seg)*(np.mean(rate_tot)**2))
+    # Apply the normalisation to the power spectrum
     power_spectrum *= norm
     power_spectrum_squared *= norm**2
     power_spectrum_error *= norm
 
     # Calculate the noise & subtract from the power spectrum
     if noise_subtraction:
-        white_noise = (2*(np.mean(rate_tot)+np.mean(bkg_tot))/np.mean(rate_tot)**2)
+        white_noise = (2*(mean_rate+mean_bkg)/mean_rate**2)
+        # The dead time correction depends on the length of the full
+        # frequency grid, so always calculate it on that grid
         dead_noise = deadt.calculate_deadtime(path_std1, frequency, npcu=npcu)
+        dead_noise = dead_noise[:len(power_spectrum)]
         power_spectrum -= (white_noise*(dead_noise/2.))
 
     # Note the range of the power spectrum - this is due to the output
@@ -140,27 +173,680 @@ def power_spectrum(path_lc, path_bkg, path_std1, npcu):
     ps_squared = power_spectrum_squared[1:n_seg/2]
     frequency = frequency[1:n_seg/2]
 
-    return ps, ps_error, ps_squared, number_of_segments, frequency, frequency_error
+    return ps, ps_error, ps_squared, int(M), frequency, frequency_error
+
+
+def averaged_power_spectrum(rate, bkg_rate, dt, starts, ends, path_std1, npcu,
+                            segment_length=256, fft_mode='full',
+                            single_precision=False, accumulator=None):
+    '''
+    Function to calculate an averaged, rms normalised power spectrum from the
+    arrays of a background corrected lightcurve, split up in segments of
+    segment_length seconds.
+
+    Input parameters:
+     - rate: background corrected rate
+     - bkg_rate: rebinned background rate
+     - dt: time resolution
+     - starts, ends: stretches of uninterrupted data (see find_runs)
+     - path_std1: path to the std1 file, for the dead time correction
+     - npcu: number of pcus on during the observation
+     - segment_length: length of each segment in seconds
+     - fft_mode: 'full' for a complex fft over all frequencies, or 'real' to
+                 only compute and accumulate the positive frequencies
+     - single_precision: accumulate the powers in float32 (real mode only)
+     - accumulator: PowerSpectrumAccumulator to which the raw sums of all
+                    segments are added, so they can be stored
+
+    Output parameters:
+     - power spectrum, its error, the squared power spectrum, the number of
+       segments, the frequency grid and the error on the frequencies
+    '''
+
+    import numpy as np
+
+    n_seg = segment_bins(segment_length, dt)
+
+    # Calculate where the data should be cut
+    segment_endpoints = find_segments(starts, ends, n_seg)
+
+    # Calculating the number of segments
+    number_of_segments = len(segment_endpoints)
+
+    # Stop calculations if no segments can be found
+    if number_of_segments == 0:
+        print 'WARNING: No segments found'
+        return
+
+    # Make 2-D arrays containing all segments of the light curve, one per row
+    segments = stack_segments(rate, segment_endpoints, n_seg)
+    bkg_segments = stack_segments(bkg_rate, segment_endpoints, n_seg)
+
+    # For calculating the normalisation and the total white noise
+    mean_rate = np.mean(segments.ravel())
+    mean_bkg = np.mean(bkg_segments.ravel())
+
+    # Calculate the normalisation of the power spectrum
+    # (rms normalisation)
+    norm = (2*dt)/(float(n_seg)*(mean_rate**2))
+
+    if fft_mode == 'full':
+        # Initialise the power spectrum array
+        power_spectrum = np.zeros((n_seg))
+        # Necessary for errors on power colour values
+        power_spectrum_squared = np.zeros((n_seg))
+
+        # Calculate the fast Fourier transform of all segments at once
+        fft_sq = segment_powers(segments, n_seg)
+
+        # Add the square of the FFT to the power spectrum, and the squared
+        # power spectrum. Adding row by row keeps the summation order (and
+        # therefore the rounding) of a segment by segment accumulation
+        for j in xrange(number_of_segments):
+            power_spectrum += fft_sq[j]
+            power_spectrum_squared += (fft_sq[j])**2
+
+        if accumulator is not None:
+            accumulator.add_sums(power_spectrum, power_spectrum_squared,
+                                 number_of_segments, np.sum(segments),
+                                 np.sum(bkg_segments))
+
+    elif fft_mode == 'real':
+        # Only the zero and positive frequencies (up to the Nyquist
+        # frequency) of a real input are independent
+        n_half = n_seg/2 + 1
+        dtype = np.float32 if single_precision else np.float64
+
+        power_spectrum = np.zeros(n_half, dtype=dtype)
+        power_spectrum_squared = np.zeros(n_half, dtype=dtype)
+
+        fft_sq = segment_powers(segments, n_seg, fft_mode='real')
+
+        # The stored sums are kept unnormalised and in double precision
+        if accumulator is not None:
+            accumulator.add_sums(np.sum(fft_sq, axis=0),
+                                 np.sum(fft_sq**2, axis=0),
+                                 number_of_segments, np.sum(segments),
+                                 np.sum(bkg_segments))
+
+        # Normalise before accumulating, so that the fourth powers of long
+        # segments can't overflow a single precision accumulator
+        fft_sq = (fft_sq*norm).astype(dtype)
+        for j in xrange(number_of_segments):
+            power_spectrum += fft_sq[j]
+            power_spectrum_squared += (fft_sq[j])**2
+
+        # Already normalised
+        norm = 1.
+
+    else:
+        print 'ERROR: Unknown fft mode', fft_mode
+        return
+
+    return finish_power_spectrum(power_spectrum, power_spectrum_squared,
+                                 number_of_segments, norm, mean_rate, mean_bkg,
+                                 dt, n_seg, path_std1, npcu)
+
+
+def power_spectra(path_lc, path_bkg, path_std1, npcu, segment_lengths=[256],
+                  fft_mode='full', single_precision=False, sums=None):
+    '''
+    Function to calculate averaged power spectra for several segment lengths
+    from a single read of a lightcurve (see light_curve_power_spectra).
+
+    Input parameters:
+     - path_lc: path to the background corrected lightcurve
+     - path_bkg: path to the rebinned background lightcurve (only used if
+                 the lightcurve is in the former text format)
+     - path_std1, npcu, segment_lengths, fft_mode, single_precision, sums:
+       see light_curve_power_spectra
+
+    Output parameters:
+     - see light_curve_power_spectra
+    '''
+
+    import binary_files
+
+    try:
+        # Reading in the lightcurve data for each path/file
+        rate, t, dt, n_bins, error, bkg_rate = binary_files.read_light_curve(path_lc, path_bkg)
+    except IOError:
+        print 'ERROR: Lightcurve does not exist'
+        return
+
+    return light_curve_power_spectra(rate, t, dt, n_bins, bkg_rate, path_std1,
+                                     npcu, segment_lengths=segment_lengths,
+                                     fft_mode=fft_mode,
+                                     single_precision=single_precision,
+                                     sums=sums)
+
+
+def light_curve_power_spectra(rate, t, dt, n_bins, bkg_rate, path_std1, npcu,
+                              segment_lengths=[256], fft_mode='full',
+                              single_precision=False, sums=None):
+    '''
+    Function to calculate averaged power spectra for several segment lengths
+    from a background corrected lightcurve in memory. The stretches of
+    uninterrupted data are found once, and reused for each segment length.
+
+    Input parameters:
+     - rate: background corrected rate
+     - t: time grid of the observation
+     - dt: time resolution
+     - n_bins: number of time bins in the lightcurve
+     - bkg_rate: background rate which was subtracted
+     - path_std1: path to the std1 file, for the dead time correction
+     - npcu: number of pcus on during the observation
+     - segment_lengths: list with segment lengths in seconds
+     - fft_mode, single_precision: see averaged_power_spectrum
+     - sums: dictionary to which a PowerSpectrumAccumulator with the raw
+             sums is added per segment length
+
+    Output parameters:
+     - dictionary with the output of averaged_power_spectrum per segment
+       length, only containing the segment lengths for which a power
+       spectrum could be calculated
+    '''
+
+    # Check whether there are any counts
+    if sum(rate) < 10:
+        print 'ERROR: Lightcurve has zero count rate'
+        return
+
+    # Check the number of bins
+    if n_bins == 0:
+        print 'ERROR: No data in lightcurve file'
+        return
+
+    # Find the stretches without gaps, shared by all segment lengths
+    starts, ends = find_runs(t[:n_bins], dt)
+
+    outputs = {}
+    for segment_length in segment_lengths:
+        accumulator = None
+        if sums is not None:
+            accumulator = PowerSpectrumAccumulator(dt, segment_length, fft_mode)
+
+        output = averaged_power_spectrum(rate, bkg_rate, dt, starts, ends,
+                                         path_std1, npcu,
+                                         segment_length=segment_length,
+                                         fft_mode=fft_mode,
+                                         single_precision=single_precision,
+                                         accumulator=accumulator)
+        if output:
+            outputs[segment_length] = output
+            if accumulator is not None:
+                sums[segment_length] = accumulator
+
+    return outputs
+
+
+def power_spectrum(path_lc, path_bkg, path_std1, npcu, segment_length=256,
+                   fft_mode='full', single_precision=False):
+    '''
+    Function to calculate an averaged, rms normalised power spectrum from a
+    background corrected lightcurve for a single segment length. See
+    power_spectra for the input parameters.
+    '''
+
+    outputs = power_spectra(path_lc, path_bkg, path_std1, npcu,
+                            segment_lengths=[segment_length],
+                            fft_mode=fft_mode,
+                            single_precision=single_precision)
+    if outputs:
+        return outputs[segment_length]
+
+
+class PowerSpectrumAccumulator(object):
+    '''
+    Running sums of an averaged power spectrum, to which consecutive chunks of
+    a lightcurve can be added. Apart from the sums, only the bins of the
+    segment still being filled are kept, so the memory needed doesn't depend
+    on the length of the observation.
+    '''
+
+    def __init__(self, dt, segment_length=256, fft_mode='full'):
+        import numpy as np
+
+        self.dt = dt
+        self.segment_length = segment_length
+        self.fft_mode = fft_mode
+        self.n_seg = segment_bins(segment_length, dt)
+
+        if fft_mode == 'full':
+            n = self.n_seg
+        else:
+            n = self.n_seg/2 + 1
+
+        self.power_sum = np.zeros(n)
+        self.power_squared_sum = np.zeros(n)
+        self.number_of_segments = 0
+        self.rate_sum = 0.
+        self.bkg_sum = 0.
+
+        # Time, rate and background of the segment being filled
+        self.pending = [np.zeros(0), np.zeros(0), np.zeros(0)]
+
+    def add_segments(self, segments, bkg_segments):
+        '''Add complete segments (one per row) to the sums'''
+        import numpy as np
+
+        fft_sq = segment_powers(segments, self.n_seg, self.fft_mode)
+        for row in fft_sq:
+            self.power_sum += row
+            self.power_squared_sum += row**2
+
+        self.number_of_segments += len(segments)
+        self.rate_sum += np.sum(segments)
+        self.bkg_sum += np.sum(bkg_segments)
+
+    def add_sums(self, power_sum, power_squared_sum, number_of_segments,
+                 rate_sum, bkg_sum):
+        '''Add sums over segments calculated elsewhere'''
+        self.power_sum += power_sum
+        self.power_squared_sum += power_squared_sum
+        self.number_of_segments += number_of_segments
+        self.rate_sum += rate_sum
+        self.bkg_sum += bkg_sum
+
+    def merge(self, other):
+        '''Add the sums of another accumulator with the same binning'''
+        if (other.dt != self.dt or other.n_seg != self.n_seg or
+            other.fft_mode != self.fft_mode):
+            raise ValueError('Cannot merge power spectrum sums with a different dt, segment length or fft mode')
+
+        self.add_sums(other.power_sum, other.power_squared_sum,
+                      other.number_of_segments, other.rate_sum, other.bkg_sum)
+
+    def save(self, path):
+        '''
+        Write the sums to a binary file. Bins of an incomplete segment are
+        not stored, so data added after loading starts a new segment.
+        '''
+        import binary_files
+
+        binary_files.write_columns(path,
+                                   [self.power_sum, self.power_squared_sum],
+                                   ['power_sum', 'power_squared_sum'],
+                                   {'dt': self.dt,
+                                    'segment_length': self.segment_length,
+                                    'fft_mode': self.fft_mode,
+                                    'number_of_segments': self.number_of_segments,
+                                    'rate_sum': self.rate_sum,
+                                    'bkg_sum': self.bkg_sum})
+
+    def add(self, t, rate, bkg_rate):
+        '''Add the next chunk of a lightcurve'''
+        import numpy as np
+
+        t = np.concatenate((self.pending[0], t))
+        rate = np.concatenate((self.pending[1], rate))
+        bkg_rate = np.concatenate((self.pending[2], bkg_rate))
+
+        if len(t) == 0:
+            return
+
+        # The pending bins start at a segment boundary, so segments are cut
+        # exactly where they would be in the full lightcurve
+        starts, ends = find_runs(t, self.dt)
+        endpoints = find_segments(starts, ends, self.n_seg)
+
+        if len(endpoints) > 0:
+            self.add_segments(stack_segments(rate, endpoints, self.n_seg),
+                              stack_segments(bkg_rate, endpoints, self.n_seg))
+
+        # Keep the bins after the last complete segment of the last stretch
+        done = starts[-1] + ((ends[-1] - starts[-1])//self.n_seg)*self.n_seg
+        self.pending = [t[done:].copy(), rate[done:].copy(), bkg_rate[done:].copy()]
+
+    def power_spectrum(self, path_std1, npcu):
+        '''Averaged power spectrum of all segments added so far'''
+
+        if self.number_of_segments == 0:
+            print 'WARNING: No segments found'
+            return
+
+        n_rate = float(self.number_of_segments*self.n_seg)
+        mean_rate = self.rate_sum/n_rate
+        mean_bkg = self.bkg_sum/n_rate
+
+        # Calculate the normalisation of the power spectrum
+        # (rms normalisation)
+        norm = (2*self.dt)/(float(self.n_seg)*(mean_rate**2))
+
+        return finish_power_spectrum(self.power_sum, self.power_squared_sum,
+                                     self.number_of_segments, norm, mean_rate,
+                                     mean_bkg, self.dt, self.n_seg, path_std1,
+                                     npcu)
+
+
+def load_accumulator(path):
+    '''
+    Function to read the sums of a power spectrum as written by
+    PowerSpectrumAccumulator.save.
+    '''
+    import numpy as np
+    import binary_files
+
+    columns, meta = binary_files.read_columns(path, mmap=False)
+
+    accumulator = PowerSpectrumAccumulator(meta['dt'], meta['segment_length'],
+                                           str(meta['fft_mode']))
+    accumulator.add_sums(np.array(columns['power_sum']),
+                         np.array(columns['power_squared_sum']),
+                         meta['number_of_segments'], meta['rate_sum'],
+                         meta['bkg_sum'])
+
+    return accumulator
+
+
+def merge_power_spectra(paths_sums, path_std1, npcu):
+    '''
+    Function to derive a single averaged power spectrum from the stored sums
+    of several sets of segments (for instance an earlier power spectrum and
+    the segments of newly arrived data), without reading any lightcurves.
+
+    Input parameters:
+     - paths_sums: list with paths to files with sums (see
+                   power_spectrum_sums_path)
+     - path_std1, npcu: std1 file and number of pcus for the dead time
+
+    Output parameters:
+     - merged accumulator
+     - power spectrum, as given by averaged_power_spectrum
+    '''
+    accumulator = load_accumulator(paths_sums[0])
+    for path in paths_sums[1:]:
+        accumulator.merge(load_accumulator(path))
+
+    return accumulator, accumulator.power_spectrum(path_std1, npcu)
+
+
+def stream_power_spectra(path_lc, path_bkg, path_std1, npcu,
+                         segment_lengths=[256], fft_mode='full',
+                         chunk_length=None, sums=None):
+    '''
+    Function to calculate averaged power spectra straight from an extracted
+    lightcurve and its background (both fits files), reading the lightcurve in
+    chunks and only keeping running sums. Peak memory is bounded by a few
+    segments, whatever the length of the observation. The background is
+    interpolated and subtracted on the fly, as done in correct_for_background,
+    but no X-ray flares are cut.
+
+    Input parameters:
+     - path_lc: path to the lightcurve (.lc)
+     - path_bkg: path to the background lightcurve (.lc)
+     - path_std1, npcu: std1 file and number of pcus for the dead time
+     - segment_lengths: list with segment lengths in seconds
+     - fft_mode: 'full' or 'real', see segment_powers
+     - chunk_length: seconds of lightcurve to read at once, by default the
+                     longest segment length
+     - sums: dictionary to which the PowerSpectrumAccumulator is added per
+             segment length
+
+    Output parameters:
+     - dictionary with the power spectrum per segment length, as given by
+       power_spectra
+    '''
+    import numpy as np
+    from correct_for_background import read_light_curve, read_light_curve_chunks
+    from correct_for_background import interpolate_background
+
+    if chunk_length is None:
+        chunk_length = max(segment_lengths)
+
+    accumulators = None
+    upper_index = 0
+    total_rate = 0.
+
+    try:
+        bkg_rate, bkg_t, bkg_dt, bkg_n_bins, bkg_error = read_light_curve(path_bkg)
+
+        for rate, t, dt, n_bins, error in read_light_curve_chunks(path_lc, chunk_length):
+
+            if accumulators is None:
+                accumulators = [PowerSpectrumAccumulator(dt, l, fft_mode)
+                                for l in segment_lengths]
+
+            # Correct the chunk for the background
+            rebinned_bkg_rate, upper_index = interpolate_background(t, bkg_t, bkg_rate, bkg_dt, upper_index)
+            rebinned_bkg_rate = np.asarray(rebinned_bkg_rate, dtype=float)
+            rate = rate - rebinned_bkg_rate
+            total_rate += np.sum(rate)
+
+            for accumulator in accumulators:
+                accumulator.add(t, rate, rebinned_bkg_rate)
+
+    except IOError:
+        print 'ERROR: Lightcurve does not exist'
+        return
+
+    if accumulators is None:
+        print 'ERROR: No data in lightcurve file'
+        return
+
+    # Check whether there are any counts
+    if total_rate < 10:
+        print 'ERROR: Lightcurve has zero count rate'
+        return
+
+    outputs = {}
+    for accumulator in accumulators:
+        output = accumulator.power_spectrum(path_std1, npcu)
+        if output:
+            outputs[accumulator.segment_length] = output
+            if sums is not None:
+                sums[accumulator.segment_length] = accumulator
+
+    return outputs
+
+
+def power_spectra_column(segment_length):
+    '''
+    Name of the database column with the paths to the power spectra of a
+    segment length. The standard 256s power spectra keep the original name.
+    '''
+    if segment_length == 256:
+        return 'power_spectra'
+    return 'power_spectra_' + str(segment_length) + 's'
+
+
+def power_spectrum_path(path_obsid, mode, res, segment_length):
+    '''
+    Path of the power spectrum file of a segment length in an obsid folder.
+    '''
+    if segment_length == 256:
+        return path_obsid + mode + '_' + res + '.psd'
+    return path_obsid + mode + '_' + res + '_' + str(segment_length) + 's.psd'
 
 
-def create_power_spectra():
+def power_spectrum_sums_column(segment_length):
+    '''
+    Name of the database column with the paths to the stored sums behind the
+    power spectra of a segment length.
+    '''
+    if segment_length == 256:
+        return 'power_spectrum_sums'
+    return 'power_spectrum_sums_' + str(segment_length) + 's'
+
+
+def power_spectrum_sums_path(path_obsid, mode, res, segment_length):
+    '''
+    Path of the file with the sums behind a power spectrum in an obsid folder.
+    '''
+    if segment_length == 256:
+        return path_obsid + mode + '_' + res + '.sums'
+    return path_obsid + mode + '_' + res + '_' + str(segment_length) + 's.sums'
+
+
+def write_power_spectra(outputs, sums, path_obsid, mode, res, segment_lengths,
+                        fft_mode='full'):
+    '''
+    Function to write the power spectra of a lightcurve, and the sums behind
+    them, to their files in the obsid folder.
+
+    Input parameters:
+     - outputs: dictionary with the power spectrum per segment length
+     - sums: dictionary with the PowerSpectrumAccumulator per segment length
+     - path_obsid, mode, res: obsid folder, mode and resolution
+     - segment_lengths: list with all segment lengths asked for
+     - fft_mode: fft mode with which the power spectra were calculated
+
+    Output parameters:
+     - dictionary with the paths per database column, being NaN for segment
+       lengths without a power spectrum
+    '''
+    import binary_files
+
+    row = {}
+    for segment_length in segment_lengths:
+        column = power_spectra_column(segment_length)
+        sums_column = power_spectrum_sums_column(segment_length)
+
+        if segment_length not in outputs:
+            row[column] = float('NaN')
+            row[sums_column] = float('NaN')
+            continue
+
+        path_ps = power_spectrum_path(path_obsid, mode, res, segment_length)
+        binary_files.write_power_spectrum(path_ps,
+                                          outputs[segment_length],
+                                          segment_length=segment_length,
+                                          fft_mode=fft_mode)
+        row[column] = path_ps
+
+        path_sums = power_spectrum_sums_path(path_obsid, mode, res,
+                                             segment_length)
+        sums[segment_length].save(path_sums)
+        row[sums_column] = path_sums
+
+    return row
+
+
+def process_lightcurve(task):
+    '''
+    Function to create the power spectra of a single lightcurve. Runs either
+    in the main process or in a worker of a process pool, so anything printed
+    is captured and handed back to be logged by the main process, in the same
+    order as a serial run. Any failure only affects this lightcurve.
+
+    Input parameters:
+     - task: dictionary with the lightcurve parameters, as set up in
+             create_power_spectra
+
+    Output parameters:
+     - text printed while processing the lightcurve
+     - dictionary with a database row, or None if no power spectra were made
+    '''
+    import sys
+    import traceback
+    from StringIO import StringIO
+
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+
+    row = None
+    try:
+        print task['obsid'], task['mode'], task['res']
+
+        if task['path_std1'] is None:
+            print('ERROR: No std1 file for this obsid. Aborting power spectrum.')
+        else:
+            # Calculate power spectra, keeping the sums behind them
+            sums = {}
+            if task['stream']:
+                outputs = stream_power_spectra(task['path_lc'],
+                                               task['path_bkg'],
+                                               task['path_std1'],
+                                               task['npcu'],
+                                               segment_lengths=task['segment_lengths'],
+                                               fft_mode=task['fft_mode'],
+                                               sums=sums)
+            else:
+                outputs = power_spectra(task['path_lc'],
+                                        task['path_bkg'],
+                                        task['path_std1'],
+                                        task['npcu'],
+                                        segment_lengths=task['segment_lengths'],
+                                        fft_mode=task['fft_mode'],
+                                        single_precision=task['single_precision'],
+                                        sums=sums)
+
+            if outputs:
+                row = write_power_spectra(outputs, sums, task['path_obsid'],
+                                          task['mode'], task['res'],
+                                          task['segment_lengths'],
+                                          task['fft_mode'])
+                if task['stream']:
+                    row['lightcurves'] = task['path_lc']
+                elif not task['flare']:
+                    row['bkg_corrected_lc'] = task['path_lc']
+                else:
+                    row['bkg_corrected_lc'] = task['former_lc']
+
+    except Exception:
+        print 'ERROR: Failed to create power spectrum'
+        print traceback.format_exc().rstrip()
+        row = None
+
+    finally:
+        text = sys.stdout.getvalue()
+        sys.stdout = stdout
+
+    return text, row
+
+
+def create_power_spectra(segment_lengths=[256], fft_mode='full',
+                         single_precision=False, workers=1, stream=False,
+                         force=False):
     '''
     Function to generate power spectral density based on RXTE lightcurves.
+    Each lightcurve is read once, after which a power spectrum is written for
+    each of the segment lengths.
+
+    Arguments:
+     - segment_lengths: list of segment lengths in seconds
+     - fft_mode: 'full' or 'real', see averaged_power_spectrum
+     - single_precision: accumulate powers in float32 (only for 'real', and
+                         not together with stream)
+     - workers: number of processes over which to spread the lightcurves.
+                The database is only updated by the main process, and the
+                output is identical to a serial run.
+     - stream: calculate the power spectra straight from the extracted
+               lightcurves in bounded memory (see stream_power_spectra),
+               without the intermediate files of correct_for_background or
+               any cut X-ray flares
+     - force: also calculate the power spectra of which the lightcurves,
+              arguments and code haven't changed since the last run (see
+              provenance.code_version for which code is followed)
+
+    Next to each power spectrum, the unnormalised sums behind it are stored
+    (.sums), so new segments can later be merged in without the original
+    lightcurve (see merge_power_spectra).
     '''
 
+    # The streamed power spectra follow from the unnormalised sums, which
+    # can't be kept in single precision without overflowing
+    if stream and single_precision:
+        raise ValueError('Single precision is not available when streaming')
+
     # Let the user know what's going to happen
     purpose = 'Creating Power Spectra'
     print len(purpose)*'=' + '\n' + purpose + '\n' + len(purpose)*'='
 
     import os
+    import sys
     import pandas as pd
     import glob
+    import multiprocessing
+    from itertools import imap
     from collections import defaultdict
     from math import isnan
     import paths
     import logs
     import execute_shell_commands as shell
     import database
+    import provenance
 
     # Set log file
     filename = __file__.split('/')[-1].split('.')[0]
@@ -168,73 +854,162 @@ def create_power_spectra():
 
     # Get database
     os.chdir(paths.data)
-    db = pd.read_csv(paths.database)
+    code = provenance.code_version(['create_power_spectra', 'binary_files',
+                                    'deadtime', 'correct_for_background'])
+    column = provenance.provenance_column('create_power_spectra')
+    outputs = [power_spectra_column(s) for s in segment_lengths]
+    outputs += [power_spectrum_sums_column(s) for s in segment_lengths]
+    db = database.load(['obsids', 'modes', 'resolutions', 'paths_obsid',
+                        'paths_data', 'npcu', 'lightcurves', 'lightcurves_bkg',
+                        'bkg_corrected_lc', 'rebinned_bkg', 'lc_no_flare',
+                        'bkg_no_flare', column] + outputs)
+
+    # Gather the parameters of each lightcurve
+    tasks = []
+    if stream:
+        groups = db.groupby('lightcurves')
+    else:
+        groups = db.groupby('bkg_corrected_lc')
+
+    for path_lc, group in groups:
 
-    d = defaultdict(list)
-    for path_lc, group in db.groupby('bkg_corrected_lc'):
-
-        # Check whether x-ray flare was present
-        path_bkg = group.rebinned_bkg.values[0]
         flare = False
-        if 'lc_no_flare' in group:
-            if pd.notnull(group.lc_no_flare.values[0]):
-                flare = True
-                former_lc = path_lc
-                path_lc = group.lc_no_flare.values[0]
-                path_bkg = group.bkg_no_flare.values[0]
+        former_lc = None
+
+        if stream:
+            # Only lightcurves with a high enough time resolution, and not
+            # those for layer background subtraction in xspec
+            if path_lc.endswith('per_layer.lc'):
+                continue
+            if group.modes.values[0] in ('std1', 'std2'):
+                continue
+            path_bkg = group.lightcurves_bkg.values[0]
+        else:
+            # Check whether x-ray flare was present
+            path_bkg = group.rebinned_bkg.values[0]
+            if 'lc_no_flare' in group:
+                if pd.notnull(group.lc_no_flare.values[0]):
+                    flare = True
+                    former_lc = path_lc
+                    path_lc = group.lc_no_flare.values[0]
+                    path_bkg = group.bkg_no_flare.values[0]
 
         # Determine parameters
         obsid = group.obsids.values[0]
-        path_obsid = group.paths_obsid.values[0]
         mode = group.modes.values[0]
-        res = group.resolutions.values[0]
 
         if mode == 'gx2':
             mode = 'gx'
 
-        print obsid, mode, res
-
         # Find std1 path
         try:
             std1 = db[((db.obsids==obsid) & (db.modes=='std1'))].paths_data.iloc[0]
             path_std1 = glob.glob(std1 + '*')[0]
         except IndexError:
-            print('ERROR: No std1 file for this obsid. Aborting power spectrum.')
-            continue
+            path_std1 = None
 
-        # Determine the maximum number of pcus on during the observation
+        # Skip if made before from the same lightcurves and arguments
         npcu = group.npcu.values[0]
+        h = provenance.input_hash([path_lc, path_bkg, path_std1],
+                                  [segment_lengths, fft_mode, single_precision,
+                                   stream, npcu], code)
+        if not force and provenance.unchanged(group, 'create_power_spectra', h, outputs):
+            print obsid, mode, group.resolutions.values[0], 'Unchanged since last run'
+            continue
 
-        # Calculate power spectrum
-        output = power_spectrum(path_lc, path_bkg, path_std1, npcu)
+        tasks.append({'path_lc': path_lc,
+                      'path_bkg': path_bkg,
+                      'flare': flare,
+                      'former_lc': former_lc,
+                      'obsid': obsid,
+                      'path_obsid': group.paths_obsid.values[0],
+                      'mode': mode,
+                      'res': group.resolutions.values[0],
+                      'path_std1': path_std1,
+                      # Maximum number of pcus on during the observation
+                      'npcu': npcu,
+                      'segment_lengths': segment_lengths,
+                      'fft_mode': fft_mode,
+                      'single_precision': single_precision,
+                      'stream': stream,
+                      'provenance': h})
+
+    # Results are handed back in the order of the tasks, whether or not the
+    # lightcurves are spread over a pool of processes
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap(process_lightcurve, tasks)
+    else:
+        pool = None
+        results = imap(process_lightcurve, tasks)
 
-        if output:
-            ps, ps_er, ps_sq, num_seg, freq, freq_er = output
-            path_ps = path_obsid + mode + '_' + res + '.ps'
-
-            # Create file within obsid folder
-            with open(path_ps, 'w') as f:
-                # For each value in a power spectrum
-                for i, value in enumerate(ps):
-                    line = (repr(value) + ' ' +
-                            repr(ps_er[i]) + ' ' +
-                            repr(freq[i]) + ' ' +
-                            repr(freq_er[i]) + ' ' +
-                            repr(ps_sq[i]) + ' ' +
-                            repr(num_seg) + '\n')
-                    f.write(line)
-
-            if not flare:
-                d['bkg_corrected_lc'].append(path_lc)
-                d['lc_no_flare'].append(float('NaN'))
-                d['power_spectra'].append(path_ps)
+    d = defaultdict(list)
+    # Workers are stopped straight away if anything goes wrong
+    finished = False
+    try:
+        for task, (text, row) in zip(tasks, results):
+            sys.stdout.write(text)
+            if row:
+                row[column] = task['provenance']
+                for c, value in row.iteritems():
+                    d[c].append(value)
+        finished = True
+    finally:
+        if pool:
+            if finished:
+                pool.close()
             else:
-                d['bkg_corrected_lc'].append(former_lc)
-                d['lc_no_flare'].append(path_lc)
-                d['power_spectra'].append(path_ps)
+                pool.terminate()
+            pool.join()
 
     # Update database and save
     df = pd.DataFrame(d)
-    db = database.merge(db,df,['power_spectra'])
+    if stream:
+        db = database.upsert(db,['lightcurves'],df)
+    else:
+        db = database.upsert(db,['bkg_corrected_lc'],df)
     database.save(db)
     logs.stop_logging()
+
+
+def convert_power_spectra():
+    '''
+    Function to convert all power spectra in the database still in the six
+    column text format to the binary format, and to update the database with
+    the paths to the new files.
+    '''
+
+    purpose = 'Converting Power Spectra'
+    print len(purpose)*'=' + '\n' + purpose + '\n' + len(purpose)*'='
+
+    import os
+    import pandas as pd
+    import paths
+    import logs
+    import database
+    import binary_files
+
+    # Set log file
+    filename = __file__.split('/')[-1].split('.')[0]
+    logs.output(filename)
+
+    os.chdir(paths.data)
+    db = database.load()
+
+    columns = [c for c in db.columns if c.startswith('power_spectra')]
+    for column in columns:
+        converted = {}
+        for path_ps in db[column].dropna().unique():
+            try:
+                if binary_files.is_binary_file(path_ps):
+                    continue
+                converted[path_ps] = binary_files.convert_power_spectrum(path_ps)
+                print path_ps, '-->', converted[path_ps]
+            except IOError:
+                print 'ERROR: Power spectrum not present', path_ps
+
+        db[column] = db[column].replace(converted)
+
+    # Paths were replaced outside of merges
+    database.save(db, whole=True)
+    logs.stop_logging()
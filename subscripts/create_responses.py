@@ -26,7 +26,8 @@ def create_response():
     logs.output(filename)
 
     os.chdir(paths.data)
-    db = pd.read_csv(paths.database)
+    db = database.load(['obsids', 'modes', 'paths_obsid', 'spectra',
+                        'spectra_bkg', 'filters'])
 
     # Only want std2 data
     d = defaultdict(list)
@@ -75,6 +76,6 @@ def create_response():
 
     # Update database and save
     df = pd.DataFrame(d)
-    db = database.merge(db,df,['rsp'])
+    db = database.upsert(db,['spectra'],df)
     database.save(db)
     logs.stop_logging()
@@ -1,18 +1,130 @@
 import pandas as pd
 import os
+from contextlib import contextmanager
 import paths
 
+# Merges and upserts since loading the database, waiting to be written to the
+# sqlite database by save, or to be done again if another step saved the
+# database in the meantime (see rebase)
+pending = []
+# State of the database file when it was loaded (see signature), and the
+# columns which were loaded if not all of them
+loaded = {}
+
+
+def backend():
+    '''
+    Name of the database backend set in the paths file, being either 'csv'
+    (default) or 'sqlite'.
+    '''
+    return getattr(paths, 'database_backend', 'csv')
+
+
+def database_path():
+    '''
+    Path of the database file of the backend in use.
+    '''
+    if backend() == 'sqlite':
+        return paths.database_sqlite
+    return paths.database
+
+
+def signature():
+    '''
+    Size and modification time of the database file, or None if there is no
+    database file yet.
+    '''
+    try:
+        stat = os.stat(database_path())
+    except OSError:
+        return None
+    return stat.st_size, repr(stat.st_mtime)
+
+
+@contextmanager
+def lock(shared=False):
+    '''
+    Lock to ensure the database is saved by one process at a time, and isn't
+    read while being saved, for when steps run alongside each other (see
+    pipeline). Any number of processes can hold a shared lock for reading.
+    '''
+    import fcntl
+
+    with open(database_path() + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
 
 def create_db():
 
-    if os.path.exists(paths.database):
+    if os.path.exists(database_path()):
         print 'WARNING: OVERWRITING DATABASE'
 
     with open(paths.obsid_list,'r') as f:
         obsids = [l.strip() for l in f.readlines()]
 
     db = pd.DataFrame({'obsids':obsids})
-    db.to_csv(paths.database)
+    loaded['columns'] = None
+
+    if backend() == 'sqlite':
+        save(db, whole=True)
+    else:
+        write_csv(db, paths.database)
+
+
+def write_csv(db, location):
+    '''
+    Function to write the database to a csv file. The file is written next
+    to its location first and then moved into place, so that the database
+    is never found half written.
+    '''
+    temporary = location + '.tmp'
+    db.to_csv(temporary)
+    os.rename(temporary, location)
+
+
+def load(columns=None):
+    '''
+    Function to load the database as a pandas dataframe.
+
+    Arguments:
+     - List of columns to load, or None for all columns. With the sqlite
+       backend only the tables needed for these columns are read. Changes
+       to such a part of the database are saved by doing them again on the
+       whole database (see save)
+
+    Output:
+     - Database (pandas dataframe)
+    '''
+    # Only create the database when first needed, as the paths file may be
+    # set to the configuration of a run after importing (see run_config)
+    if not os.path.exists(database_path()):
+        create_db()
+
+    with lock(shared=True):
+        return read_database(columns)
+
+
+def read_database(columns=None):
+    '''
+    Function to read the database, as load but without taking the lock.
+    '''
+    # Forget merges of any earlier run which weren't saved
+    del pending[:]
+    loaded['signature'] = signature()
+    loaded['columns'] = columns
+
+    if backend() == 'sqlite':
+        return load_sqlite(columns)
+
+    if columns is None:
+        return pd.read_csv(paths.database)
+
+    header = pd.read_csv(paths.database, nrows=0).columns
+    return pd.read_csv(paths.database, usecols=[c for c in columns if c in header])
 
 
 def merge(db, df, columns):
@@ -20,6 +132,9 @@ def merge(db, df, columns):
     Careful with merging not to lose any data. This method checks whether it is
     merely an update of the database, or an extension.
 
+    The merge is also kept, to be written to its own table by save with the
+    sqlite backend.
+
     Arguments:
      - Main database (pandas dataframe)
      - New database (pandas dataframe)
@@ -48,18 +163,573 @@ def merge(db, df, columns):
     df = df.drop_duplicates()
 
     ns = [n for n in df if n in db]
+
+    pending.append(('merge', df, ns, list(columns)))
+
     db = pd.merge(db,df, on=ns, how='left')
     return db
 
 
-def save(db,location=paths.database):
-    # Remove unnamed columns from merges
+def upsert(db, keys, df):
+    '''
+    Function to update the rows of the database with the given keys. Only
+    the rows and columns in the new dataframe are changed; rows with other
+    keys keep their values, and columns not yet in the database are added.
+    As each key may only be given once, rows are never multiplied, unlike
+    with merge.
+
+    The update is also kept, to be written by save with the sqlite backend.
+
+    Arguments:
+     - Main database (pandas dataframe)
+     - Columns identifying the rows to update (list)
+     - New rows (pandas dataframe), with the key columns and the columns to
+       update
+
+    Output:
+     - Updated main database
+    '''
+    import numpy as np
+
+    keys = list(keys)
+
+    # Nothing to update, e.g. when all outputs of a step were up to date
+    if df.shape[0]==0:
+        return db
+
+    missing = [k for k in keys if k not in db or k not in df]
+    if missing:
+        raise KeyError('Key columns not found: ' + ', '.join(missing))
+
+    # Rows given more than once are fine, as long as they're the same
+    df = df.drop_duplicates()
+    duplicated = df.duplicated(keys, keep=False)
+    if duplicated.any():
+        raise ValueError('Different rows given for the same keys:\n' +
+                         str(df[duplicated].sort_values(keys)))
+
+    columns = [c for c in df if c not in keys]
+    if not columns:
+        return db
+
+    # Find which rows of the database belong to which new row, only looking
+    # at the key columns
+    left = db[keys].copy()
+    left['row'] = np.arange(db.shape[0])
+    right = df[keys].copy()
+    right['new'] = np.arange(df.shape[0])
+    matches = pd.merge(left, right, on=keys)
+    rows = matches.row.values
+    new = matches.new.values
+
+    for c in columns:
+        values = df[c].values[new]
+        if c in db:
+            db.iloc[rows, db.columns.get_loc(c)] = values
+        else:
+            column = pd.Series(values, index=rows)
+            db[c] = column.reindex(np.arange(db.shape[0])).values
+
+    pending.append(('upsert', df, keys, columns))
+
+    return db
+
+
+def save(db,location=None,whole=False):
+    '''
+    Function to save the database. With the sqlite backend, only the merges
+    and upserts done since loading the database are written, unless the
+    database was changed in other ways as well (whole=True).
+
+    If another step saved the database since it was loaded, or if only some
+    of its columns were loaded, the merges and upserts are done again on the
+    whole database as it is now (see rebase), so that steps can run
+    alongside each other. This isn't possible for steps saving the whole
+    database, which therefore have to load all columns.
+
+    Arguments:
+     - Main database (pandas dataframe)
+     - Location of the csv file (only for the csv backend), by default the
+       database in the paths file
+     - Whether to write the whole database
+    '''
+    if location is None:
+        location = paths.database
+
+    partial = (location == paths.database and
+               loaded.get('columns') is not None)
+    if partial and whole:
+        raise ValueError('Only some columns of the database were loaded, '
+                         'so it cannot be saved as a whole')
+    if partial and any(change[0] == 'merge' for change in pending):
+        # Merges depend on which columns the database has
+        raise ValueError('Only some columns of the database were loaded, '
+                         'so merges cannot be saved')
+
+    with lock():
+        if partial and not pending:
+            # Nothing to save
+            return
+
+        changed = signature() != loaded.get('signature')
+        if (not whole and pending and location == paths.database and
+                (partial or changed)):
+            if changed:
+                print 'Database saved by another step in the meantime, updating'
+            db = rebase()
+
+        # Remove unnamed columns from merges
+        for col in db.columns:
+           if 'Unnamed' in col:
+               del db[col]
+        db.drop_duplicates()
+
+        if backend() != 'sqlite':
+            write_csv(db, location)
+            del pending[:]
+            loaded['signature'] = signature()
+            return
+
+        try:
+            if not whole:
+                con = connect()
+                try:
+                    for kind, df, keys, columns in pending:
+                        if kind == 'merge':
+                            write_merge(con, df, keys, columns)
+                        elif not write_upsert(con, db, df, keys, columns):
+                            # The database as a whole includes any
+                            # remaining changes
+                            whole = True
+                            break
+                    con.commit()
+                finally:
+                    con.close()
+            if whole:
+                replace_all(db)
+        finally:
+            del pending[:]
+            loaded['signature'] = signature()
+
+
+def rebase():
+    '''
+    Function to do the merges and upserts since loading the database again,
+    on the database as it is now.
+
+    Output:
+     - Updated database
+    '''
+    changes = list(pending)
+
+    # The lock is already held by save
+    db = read_database()
+    for kind, df, keys, columns in changes:
+        if kind == 'merge':
+            db = merge(db, df, columns)
+        else:
+            db = upsert(db, keys, df)
+
+    return db
+
+
+def export_csv(location=None):
+    '''
+    Function to write the whole database to a csv file, for instance to
+    share it, or to use it with the scripts reading the csv file directly.
+    '''
+    if location is None:
+        location = paths.database
+    db = load()
     for col in db.columns:
        if 'Unnamed' in col:
            del db[col]
-    db.drop_duplicates()
-    db.to_csv(location)
+    write_csv(db, location)
+
+
+def import_csv(location=None):
+    '''
+    Function to fill the sqlite database with a csv database.
+    '''
+    if location is None:
+        location = paths.database
+    db = pd.read_csv(location)
+    loaded['columns'] = None
+    save(db, whole=True)
+
+
+# Sqlite backend
+# --------------
+# The sqlite database holds a base table, with the database as it was last
+# saved as a whole, and a table for each merge since, with the columns it
+# added keyed (and indexed) by the columns it was merged on, such as the
+# obsids, modes, resolutions or paths. A table registry keeps the order of
+# the tables, so that the database follows from repeating the merges (see
+# replay). When columns are overwritten they are removed from their former
+# table, and tables which were merged on them are merged on other columns
+# instead. Columns which are upserted are kept in tables with a unique index
+# on their keys, so that later upserts only write the rows they change.
+
+def connect(location=None):
+    '''
+    Function to connect to the sqlite database, or to another sqlite file.
+    '''
+    import sqlite3
+
+    if location is None:
+        location = paths.database_sqlite
+    con = sqlite3.connect(location)
+    con.execute('CREATE TABLE IF NOT EXISTS registry '
+                '(name TEXT PRIMARY KEY, position REAL, keys TEXT, columns TEXT)')
+    return con
+
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
 
 
-if not os.path.exists(paths.database):
-    create_db()
+def read_registry(con):
+    '''
+    Function to read the tables of the sqlite database in order.
+
+    Output:
+     - List with a dictionary per table with its name, position, key
+       columns and value columns
+    '''
+    import json
+
+    rows = con.execute('SELECT name, position, keys, columns FROM registry '
+                       'ORDER BY position').fetchall()
+    return [{'name': str(n), 'position': p,
+             'keys': [str(k) for k in json.loads(k)],
+             'columns': [str(c) for c in json.loads(c)]}
+            for n, p, k, c in rows]
+
+
+def write_table(con, table, df, unique=False):
+    '''
+    Function to (over)write a table in the sqlite database, indexing its
+    key columns, with a unique index if asked for.
+    '''
+    con.execute('DROP TABLE IF EXISTS ' + quote(table['name']))
+    df.to_sql(table['name'], con, index=False)
+    if table['keys']:
+        con.execute('CREATE ' + ('UNIQUE ' if unique else '') +
+                    'INDEX ' + quote('index_' + table['name']) +
+                    ' ON ' + quote(table['name']) +
+                    ' (' + ', '.join(quote(k) for k in table['keys']) + ')')
+    write_table_registry(con, table)
+
+
+def write_table_registry(con, table):
+    '''
+    Function to (over)write the entry of a table in the registry.
+    '''
+    import json
+
+    con.execute('INSERT OR REPLACE INTO registry VALUES (?, ?, ?, ?)',
+                (table['name'], table['position'], json.dumps(table['keys']),
+                 json.dumps(table['columns'])))
+
+
+def has_unique_index(con, table):
+    '''
+    Function to check whether the keys of a table have a unique index.
+    '''
+    indices = con.execute('PRAGMA index_list(' + quote(table['name']) + ')')
+    return any(index[2] for index in indices.fetchall())
+
+
+def table_name(registry, prefix):
+    '''
+    Function to find a name for a new table not yet in the registry.
+    '''
+    names = [t['name'] for t in registry]
+    n = len(names)
+    while prefix + str(n) in names:
+        n += 1
+    return prefix + str(n)
+
+
+def read_table(con, table, columns=None):
+    '''
+    Function to read (some of the columns of) a table in the sqlite
+    database, with missing values as NaN, like in the csv files.
+    '''
+    import numpy as np
+
+    if columns is None:
+        columns = table['keys'] + table['columns']
+
+    if columns:
+        select = ', '.join(quote(c) for c in columns)
+    else:
+        select = 'NULL AS empty'
+
+    df = pd.read_sql('SELECT ' + select + ' FROM ' + quote(table['name']), con)
+    df = df.where(pd.notnull(df), np.nan)
+
+    if not columns:
+        del df['empty']
+
+    return df
+
+
+def replace_all(db):
+    '''
+    Function to replace the sqlite database by one with a base table holding
+    the whole database. The new database is written next to the old one and
+    then moved into place, as pandas commits while writing a table.
+    '''
+    temporary = paths.database_sqlite + '.tmp'
+    if os.path.exists(temporary):
+        os.remove(temporary)
+
+    con = connect(temporary)
+    try:
+        write_table(con, {'name': 'base', 'position': 0, 'keys': [],
+                          'columns': [str(c) for c in db.columns]}, db)
+        con.commit()
+    finally:
+        con.close()
+
+    os.rename(temporary, paths.database_sqlite)
+
+
+def rekey_table(con, registry, i, overwritten):
+    '''
+    Function to merge a table on other columns when a column it was merged
+    on is about to be overwritten. The table is joined with the database
+    as it was before the table (see replay), and then merged on all columns
+    known at that point which are there to stay. The values of the table
+    thereby stay with the rows they were merged into, as they would in the
+    csv database.
+
+    Arguments:
+     - Connection to the sqlite database
+     - Registry of tables (see read_registry)
+     - Index of the table in the registry
+     - Columns which are about to be overwritten
+    '''
+    table = registry[i]
+    if not [k for k in table['keys'] if k in overwritten]:
+        return
+
+    known = []
+    for t in registry[:i]:
+        known.extend(c for c in t['keys'] + t['columns']
+                     if c not in known and c not in overwritten)
+
+    db = replay(con, registry[:i], set(known + table['keys']))
+    db = db[known + [k for k in table['keys'] if k not in known]]
+    df = pd.merge(db.drop_duplicates(), read_table(con, table).drop_duplicates(),
+                  on=table['keys'], how='left')
+
+    table['keys'] = known + [k for k in table['keys']
+                             if k not in known and k not in overwritten]
+    write_table(con, table, df[table['keys'] + table['columns']])
+
+
+def write_merge(con, df, keys, columns):
+    '''
+    Function to write a merge to its own table at the end of the sqlite
+    database, removing the columns it overwrites from the other tables.
+
+    Arguments:
+     - Connection to the sqlite database
+     - New database which was merged (pandas dataframe)
+     - Columns on which it was merged
+     - Columns which were overwritten
+    '''
+    values = [str(c) for c in df if c not in keys]
+    overwritten = set(columns) | set(values)
+
+    registry = read_registry(con)
+
+    if not [c for c in registry[0]['columns'] if c not in overwritten]:
+        raise ValueError('Can not overwrite all columns of the base table')
+
+    # Tables merged on overwritten columns are first merged on other columns,
+    # starting from the last, so that each is joined with the tables before
+    # it as they were
+    for i in reversed(range(len(registry))):
+        rekey_table(con, registry, i, overwritten)
+
+    remove_columns(con, registry, overwritten)
+
+    position = max([t['position'] for t in registry] + [0]) + 1
+    write_table(con, {'name': table_name(registry, 'merge_'),
+                      'position': position,
+                      'keys': [str(k) for k in keys], 'columns': values},
+                df[list(keys) + values])
+
+
+def remove_columns(con, registry, columns):
+    '''
+    Function to remove columns from the tables holding them, dropping tables
+    without any columns left (apart from the base table).
+    '''
+    for table in registry:
+        overlap = [c for c in table['columns'] if c in columns]
+        if not overlap:
+            continue
+
+        unique = has_unique_index(con, table)
+        table['columns'] = [c for c in table['columns'] if c not in overlap]
+
+        if table['columns'] or table['name'] == 'base':
+            write_table(con, table, read_table(con, table), unique=unique)
+        else:
+            con.execute('DROP TABLE IF EXISTS ' + quote(table['name']))
+            con.execute('DELETE FROM registry WHERE name=?', (table['name'],))
+
+
+def write_upsert(con, db, df, keys, columns):
+    '''
+    Function to write an upsert to the sqlite database. If the columns are
+    already kept in a table with a unique index on the same keys, only the
+    rows of the upsert are updated or inserted. Otherwise the columns are
+    moved to a new such table, taking their values from the whole database,
+    as long as each key has a single value.
+
+    Arguments:
+     - Connection to the sqlite database
+     - Main database, with the upsert done (pandas dataframe)
+     - New rows which were upserted (pandas dataframe)
+     - Key columns
+     - Columns which were upserted
+
+    Output:
+     - False if the upsert couldn't be written, in which case the database
+       should be written as a whole
+    '''
+    registry = read_registry(con)
+
+    # The rows can only be found if the keys are known, and columns on which
+    # other tables were merged can't simply be changed
+    known = [c for t in registry for c in t['keys'] + t['columns']]
+    if [k for k in keys if k not in known]:
+        return False
+    if [c for t in registry for c in t['keys'] if c in columns]:
+        return False
+
+    homes = [t for t in registry if [c for c in t['columns'] if c in columns]]
+    if len(homes) == 1 and homes[0]['keys'] == keys and \
+            has_unique_index(con, homes[0]):
+
+        table = homes[0]
+        for c in columns:
+            if c not in table['columns']:
+                con.execute('ALTER TABLE ' + quote(table['name']) +
+                            ' ADD COLUMN ' + quote(c))
+                table['columns'].append(c)
+        write_table_registry(con, table)
+
+        update = ('UPDATE ' + quote(table['name']) + ' SET ' +
+                  ', '.join(quote(c) + '=?' for c in columns) + ' WHERE ' +
+                  ' AND '.join(quote(k) + ' IS ?' for k in keys))
+        insert = ('INSERT INTO ' + quote(table['name']) + ' (' +
+                  ', '.join(quote(c) for c in keys + columns) + ') VALUES (' +
+                  ', '.join('?' for c in keys + columns) + ')')
+
+        for row in df[columns + keys].itertuples(index=False):
+            row = [sql_value(v) for v in row]
+            if con.execute(update, row).rowcount == 0:
+                con.execute(insert, row[len(columns):] + row[:len(columns)])
+        return True
+
+    if homes:
+        # Take the current values of the columns from the whole database
+        df = db[keys + columns].drop_duplicates()
+        if df.duplicated(keys).any():
+            return False
+        if not [c for c in registry[0]['columns'] if c not in columns]:
+            return False
+        remove_columns(con, registry, set(columns))
+
+    df = df[df[columns].notnull().any(axis=1)]
+    position = max([t['position'] for t in registry] + [0]) + 1
+    write_table(con, {'name': table_name(registry, 'upsert_'),
+                      'position': position,
+                      'keys': keys, 'columns': columns},
+                df[keys + columns], unique=True)
+    return True
+
+
+def sql_value(value):
+    '''
+    Function to convert a value to one which can be stored in sqlite, with
+    missing values as NULL.
+    '''
+    import numpy as np
+
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+def replay(con, registry, needed):
+    '''
+    Function to build (part of) the database by repeating the merges of the
+    tables in the registry in order, only reading the tables, and columns,
+    needed for the columns asked for.
+
+    Arguments:
+     - Connection to the sqlite database
+     - Registry of tables (see read_registry)
+     - Set of needed columns
+
+    Output:
+     - Database (pandas dataframe)
+    '''
+    needed = set(needed)
+
+    # Find which tables, and which of their columns, are needed, which
+    # includes the columns any needed table is merged on
+    selected = []
+    for table in reversed(registry[1:]):
+        wanted = [c for c in table['columns'] if c in needed]
+        if wanted:
+            needed.update(table['keys'])
+            selected.append((table, table['keys'] + wanted))
+    selected.reverse()
+
+    base = registry[0]
+    db = read_table(con, base, [c for c in base['columns'] if c in needed])
+
+    for table, wanted in selected:
+        df = read_table(con, table, wanted)
+        db = db.drop_duplicates()
+        df = df.drop_duplicates()
+        db = pd.merge(db, df, on=table['keys'], how='left')
+
+    return db
+
+
+def load_sqlite(columns=None):
+    '''
+    Function to load the sqlite database, only reading the tables needed for
+    the columns asked for (see load).
+    '''
+    con = connect()
+    try:
+        registry = read_registry(con)
+        if not registry:
+            return pd.DataFrame()
+
+        if columns is None:
+            needed = set(c for t in registry for c in t['keys'] + t['columns'])
+        else:
+            needed = set(columns)
+
+        db = replay(con, registry, needed)
+    finally:
+        con.close()
+
+    if columns is not None:
+        db = db[[c for c in columns if c in db]]
+
+    return db
+
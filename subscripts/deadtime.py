@@ -1,25 +1,38 @@
 # Functions to determine the Poisson noise level with dead-time correction
 # Written by David Gardenier, 2016-2017
 
-def calculate_deadtime(std1path, f, npcu=5, vle_correction='mean'):
+# Rate summaries of std1 files already determined in this process
+summaries = {}
+
+
+def summary_cache(std1path):
     '''
-    Function to calculate the deadtime correction factor upon being given the
-    path, array with frequencies and number of pcus
-    
-    Based partially on a script written by Daniella Huppenkothen
-    (see https://github.com/dhuppenkothen/RXTEAnalysis/)
+    Path of the file in which the rate summary of a std1 file is cached.
+    '''
+    import hashlib
+    import paths
+
+    name = hashlib.md5(std1path).hexdigest() + '.json'
+    return paths.data_info + 'deadtime_cache/' + name
+
+
+def calculate_rates(std1path):
+    '''
+    Function to calculate the mean count rates needed for the dead time
+    correction from a std1 file.
+
+    Output parameters:
+     - dictionary with the mean VLE, good xenon and total count rates
     '''
 
-    import pandas as pd
     import pyfits
-    from numpy import sin, cos, pi, mean
-        
+    from numpy import mean
+
     hdulist = pyfits.open(std1path)
     data = hdulist[1].data
-    header = hdulist[1].header
-        
+
     vlecnt = data["VLECnt"].flatten()
-    
+
     # Good Xenon events
     xecntpcu0 = data["XeCntPcu0"].flatten()
     xecntpcu1 = data["XeCntPcu1"].flatten()
@@ -27,16 +40,76 @@ def calculate_deadtime(std1path, f, npcu=5, vle_correction='mean'):
     xecntpcu3 = data["XeCntPcu3"].flatten()
     xecntpcu4 = data["XeCntPcu4"].flatten()
     xecnt = xecntpcu0+xecntpcu1+xecntpcu2+xecntpcu3+xecntpcu4
-    
+
     # Propane layer events
     vpcnt = data["VpCnt"].flatten()
 
     # Coincident events
     remainingcnt = data["RemainingCnt"].flatten()
-    
+
     # Total events
     totalcnt = vlecnt + xecnt + vpcnt + remainingcnt
 
+    rates = {'vle': float(mean(vlecnt)),
+             'xe': float(mean(xecnt)),
+             'total': float(mean(totalcnt))}
+
+    hdulist.close()
+
+    return rates
+
+
+def rate_summary(std1path):
+    '''
+    Function to get the mean count rates of a std1 file. These are cached per
+    file path and modification time, both in memory and on disk, so the std1
+    file is only read once, however many lightcurves of an obsid use it.
+    '''
+    import os
+    import json
+
+    mtime = os.path.getmtime(std1path)
+    key = (std1path, mtime)
+
+    if key in summaries:
+        return summaries[key]
+
+    cache = summary_cache(std1path)
+    try:
+        with open(cache, 'r') as f:
+            cached = json.load(f)
+        if cached['path'] == std1path and cached['mtime'] == mtime:
+            summaries[key] = cached['rates']
+            return cached['rates']
+    except (IOError, ValueError, KeyError):
+        pass
+
+    rates = calculate_rates(std1path)
+    summaries[key] = rates
+
+    # Write to a temporary file first, so that processes running in parallel
+    # never see a half written cache
+    if not os.path.exists(os.path.dirname(cache)):
+        try:
+            os.makedirs(os.path.dirname(cache))
+        except OSError:
+            pass
+    temp = cache + '.' + str(os.getpid())
+    with open(temp, 'w') as f:
+        json.dump({'path': std1path, 'mtime': mtime, 'rates': rates}, f)
+    os.rename(temp, cache)
+
+    return rates
+
+
+def deadtime_correction(rates, f, npcu=5):
+    '''
+    Function to calculate the deadtime correction factor for a frequency
+    grid, given the mean count rates of a std1 file (see rate_summary).
+    '''
+
+    from numpy import sin, cos, pi
+
     # Default VLE window
     tau = 1.7e-4
     # Bin size
@@ -47,21 +120,37 @@ def calculate_deadtime(std1path, f, npcu=5, vle_correction='mean'):
     td = 1.0e-5
     # Total number of frequencies
     N = len(f)
-    
-    # Method of correction (could be also use the mean)
-    if vle_correction == 'mean':
-        corvle = mean(vlecnt)/float(npcu)
-        corxe = mean(xecnt)/float(npcu)
-        cortotal = mean(totalcnt)/float(npcu)
-    
+
+    corvle = rates['vle']/float(npcu)
+    corxe = rates['xe']/float(npcu)
+    cortotal = rates['total']/float(npcu)
+
     # VLE correction factor
     pvle = 2*corvle*corxe*tau**2*(sin(pi*tau*f)/(pi*tau*f))**2
-    
+
     # Dead time coefficients
     p1 = 2*(1-2*cortotal*td*(1-(td/float(2*tb))))
     p2 = 2*cortotal*td*((N-1)/float(N))*(td/float(tb))
-    
+
     # Total correction factor
     pd = p1 - p2*cos((pi*f)/float(fnyq))
 
     return pd + pvle
+
+
+def calculate_deadtime(std1path, f, npcu=5, vle_correction='mean'):
+    '''
+    Function to calculate the deadtime correction factor upon being given the
+    path, array with frequencies and number of pcus
+
+    Based partially on a script written by Daniella Huppenkothen
+    (see https://github.com/dhuppenkothen/RXTEAnalysis/)
+    '''
+
+    # Method of correction (could be also use the mean)
+    if vle_correction != 'mean':
+        raise ValueError('Unknown VLE correction: ' + str(vle_correction))
+
+    rates = rate_summary(std1path)
+
+    return deadtime_correction(rates, f, npcu=npcu)
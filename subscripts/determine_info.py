@@ -28,7 +28,7 @@ def determine_info():
     with open(paths.obsid_list,'r') as f:
         obsids = [l.strip() for l in f.readlines()]
 
-    db = pd.read_csv(paths.database)
+    db = database.load()
     db['P'] = ['P' + o.split('-')[0] for o in db['obsids']]
     db['paths_obsid'] = paths.data + db['P'] + '/' + db['obsids'] + '/'
 
@@ -183,11 +183,12 @@ def determine_info():
 
     #Add to database
     new_data = pd.DataFrame(d)
-    db = database.merge(db, new_data, ['paths_po_pm_pr'])
+    db = database.upsert(db, ['obsids','modes','resolutions'], new_data)
     unfound_obsids = db[db.modes.isnull()].obsids.values
     if len(unfound_obsids) > 0:
         print 'ERROR: NO DATA FOR THESE OBSIDS', unfound_obsids
         db = db[db.modes.notnull()]
 
-    database.save(db)
+    # Columns were added and rows removed outside of merges
+    database.save(db, whole=True)
     logs.stop_logging()
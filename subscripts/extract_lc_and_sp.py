@@ -82,9 +82,11 @@ def saextrct(mode, path_data, gti, output, time_range, channels, layer):
     shell.execute(command)
 
 
-def extract_lc_and_sp():
+def extract_lc_and_sp(force=False):
     '''
-    Function to extract light curves and spectra from data files
+    Function to extract light curves and spectra from data files. Light curves
+    of which the data, background, time filters and energy channels haven't
+    changed since the last run are skipped, unless forced.
     '''
 
     purpose = 'Extracting light curves & spectra'
@@ -101,13 +103,21 @@ def extract_lc_and_sp():
     import logs
     import execute_shell_commands as shell
     import database
+    import provenance
 
     # Set log file
     filename = __file__.split('/')[-1].split('.')[0]
     logs.output(filename)
 
     os.chdir(paths.data)
-    db = pd.read_csv(paths.database)
+    code = provenance.code_version(['extract_lc_and_sp',
+                                    'execute_shell_commands',
+                                    'bitfile_M', 'pcu2_columns.txt'])
+    db = database.load(['obsids', 'modes', 'resolutions', 'paths_obsid',
+                        'paths_bkg', 'gti', 'times_pcu', 'energy_channels',
+                        'paths_gx', 'paths_po_pm_pr', 'lightcurves',
+                        'lightcurves_bkg', 'spectra', 'spectra_bkg',
+                        provenance.provenance_column('extract_lc_and_sp')])
 
     # Backgrounds together with resolutions are the longest list over which one
     # loops - want to prevent having to extract a file which has already been
@@ -146,6 +156,15 @@ def extract_lc_and_sp():
                 print obsid, mode, res, 'ERROR: No gti times'
                 continue
 
+        inputs = [path_data, path_bkg, gti, times_pcu]
+        inputs += provenance.listed_files(path_data)
+        inputs += provenance.listed_files(path_bkg)
+        h = provenance.input_hash(inputs, [mode, res, channels], code)
+        outputs = ['lightcurves', 'lightcurves_bkg', 'spectra', 'spectra_bkg']
+        if not force and provenance.unchanged(df, 'extract_lc_and_sp', h, outputs):
+            print obsid, mode, res, 'Unchanged since last run'
+            continue
+
         # You get problems if the file name is longer than 80 characters (incl@)
         filenametoolong = False
         if len(times_pcu) > 79:
@@ -205,9 +224,10 @@ def extract_lc_and_sp():
         d['lightcurves_bkg'].append(lc_bkg)
         d['spectra'].append(sp)
         d['spectra_bkg'].append(sp_bkg)
+        d[provenance.provenance_column('extract_lc_and_sp')].append(h)
 
     # Update database and save
     df = pd.DataFrame(d)
-    db = database.merge(db,df,['lightcurves','lightcurves_bkg','spectra','spectra_bkg'])
+    db = database.upsert(db,['paths_bkg','resolutions'],df)
     database.save(db)
     logs.stop_logging()
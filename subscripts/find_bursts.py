@@ -0,0 +1,396 @@
+# Functions to detect X-ray bursts and flares in lightcurves against a rolling
+# median, streaming through each lightcurve so that it never has to be in
+# memory as a whole, and to collect them in a burst catalogue per object
+# Written by David Gardenier, 2015-2016
+
+def bin_chunks(chunks, bin_length):
+    '''
+    Generator to average consecutive chunks of a lightcurve onto a coarser
+    time grid. Bins are counted in steps of bin_length from the first time
+    of the lightcurve, and a bin spanning two chunks is held back until the
+    next chunk has been read.
+
+    Input parameters:
+     - chunks: iterable with (rate, t, dt, n_bins, error) per chunk, as given
+               by correct_for_background.read_light_curve_chunks
+     - bin_length: length of the coarse bins in seconds. Lightcurves with a
+                   coarser time resolution keep their own bins
+
+    Output parameters (per chunk):
+     - t: start time of each coarse bin
+     - rate: mean rate in each coarse bin
+    '''
+    import numpy as np
+
+    t0 = None
+    held_t = np.array([])
+    held_rate = np.array([])
+
+    for rate, t, dt, n_bins, error in chunks:
+        if t0 is None:
+            if len(t) == 0:
+                continue
+            t0 = t[0]
+            bin_length = max(bin_length, dt)
+
+        t = np.concatenate((held_t, t))
+        rate = np.concatenate((held_rate, rate))
+        if len(t) == 0:
+            continue
+
+        # Hold back the bin which may still continue in the next chunk
+        k = np.floor((t - t0)/bin_length).astype(np.int64)
+        last = np.searchsorted(k, k[-1])
+        held_t, held_rate = t[last:], rate[last:]
+        k, rate = k[:last], rate[:last]
+        if len(k) == 0:
+            continue
+
+        # Average the rate within each coarse bin
+        starts = np.flatnonzero(np.concatenate(([True], k[1:] != k[:-1])))
+        counts = np.diff(np.append(starts, len(k)))
+        means = np.add.reduceat(rate, starts)/counts
+
+        yield t0 + k[starts]*bin_length, means
+
+    if len(held_t):
+        k = np.floor((held_t[0] - t0)/bin_length)
+        yield np.array([t0 + k*bin_length]), np.array([np.mean(held_rate)])
+
+
+class RollingDetector(object):
+    '''
+    Class to detect bursts and flares in a lightcurve handed over in
+    consecutive chunks of coarse bins (see bin_chunks), in a single pass.
+
+    Each bin is compared to the median and median absolute deviation (MAD)
+    of the window of bins preceding it, which are hardly affected by the
+    bursts and flares themselves, nor by slow changes of the source or
+    background. A bin is flagged if its rate lies more than threshold
+    sigma above the median, with sigma the larger of 1.4826 times the MAD
+    and the Poisson spread expected from the median rate. Runs of flagged
+    bins less than merge_length seconds apart form an event, which is kept
+    if it spans at least min_bins flagged bins. Events lasting no longer
+    than burst_length are bursts, and longer ones flares. Apart from the
+    events, only the last window bins are kept from one chunk to the next.
+    '''
+
+    def __init__(self, bin_length=1., window=2048, threshold=5., min_bins=2,
+                 burst_length=150., merge_length=10., min_history=16):
+        self.bin_length = bin_length
+        self.window = window
+        self.threshold = threshold
+        self.min_bins = min_bins
+        self.burst_length = burst_length
+        self.merge_length = merge_length
+        self.min_history = min_history
+
+        self.history = []
+        self.last_t = None
+        # Event still running at the end of the previous chunk
+        self.current = None
+        self.events = []
+
+    def baseline(self, rate):
+        '''
+        Function to calculate the median and sigma of the window preceding
+        each bin of a chunk. Bins with fewer than min_history preceding
+        bins get NaN.
+        '''
+        import numpy as np
+        from numpy.lib.stride_tricks import as_strided
+
+        history = np.array(self.history, dtype=float)
+        padding = np.empty(self.window - len(history))
+        padding.fill(np.nan)
+        x = np.concatenate((padding, history, rate))
+
+        # Rows with the window of bins preceding each bin of the chunk
+        stride = x.strides[0]
+        windows = as_strided(x, shape=(len(rate), self.window),
+                             strides=(stride, stride))
+
+        median = np.empty(len(rate))
+        mad = np.empty(len(rate))
+
+        # Only the first bins of a lightcurve have incomplete windows
+        n_short = min(len(rate), max(self.window - len(history), 0))
+        full = windows[n_short:]
+        median[n_short:] = np.median(full, axis=1)
+        mad[n_short:] = np.median(np.abs(full - median[n_short:, np.newaxis]), axis=1)
+
+        for i in xrange(n_short):
+            w = windows[i][~np.isnan(windows[i])]
+            if len(w) < self.min_history:
+                median[i] = np.nan
+                mad[i] = np.nan
+            else:
+                median[i] = np.median(w)
+                mad[i] = np.median(np.abs(w - median[i]))
+
+        with np.errstate(invalid='ignore'):
+            sigma = np.maximum(1.4826*mad,
+                               np.sqrt(np.abs(median)/self.bin_length))
+
+        return median, sigma
+
+    def add(self, t, rate):
+        '''
+        Function to search a chunk of coarse bins for bursts and flares.
+        '''
+        import numpy as np
+
+        t = np.asarray(t, dtype=float)
+        rate = np.asarray(rate, dtype=float)
+        if len(t) == 0:
+            return
+
+        median, sigma = self.baseline(rate)
+        with np.errstate(invalid='ignore'):
+            significance = (rate - median)/sigma
+            flagged = significance > self.threshold
+
+        # Events are broken off at gaps in the data
+        previous_t = np.concatenate(([self.last_t if self.last_t is not None
+                                      else -np.inf], t[:-1]))
+        gap = ~(t - previous_t < 1.5*self.bin_length)
+
+        # Find the runs of flagged bins
+        padded = np.concatenate(([False], flagged, [False]))
+        edges = np.diff(padded.astype(int))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+
+        # Split runs at gaps
+        breaks = np.flatnonzero(gap & flagged)
+        bounds = np.union1d(starts, breaks)
+        run_ends = np.empty(len(bounds), dtype=int)
+        for n, b in enumerate(bounds):
+            end = ends[np.searchsorted(ends, b, side='right')]
+            following = bounds[n+1] if n + 1 < len(bounds) else end
+            run_ends[n] = min(end, following)
+
+        # An event still running continues into the first run, unless a
+        # gap or an unflagged bin lies in between
+        if self.current is not None:
+            if len(bounds) == 0 or bounds[0] != 0 or gap[0]:
+                self.close()
+
+        for b, e in zip(bounds, run_ends):
+            peak = b + np.argmax(rate[b:e])
+            if self.current is None:
+                self.current = {'start': t[b], 'n_bins': 0, 'peak_rate': -np.inf}
+            self.current['n_bins'] += e - b
+            self.current['end'] = t[e-1] + self.bin_length
+            if rate[peak] > self.current['peak_rate']:
+                self.current['peak_rate'] = rate[peak]
+                self.current['baseline'] = median[peak]
+                self.current['significance'] = significance[peak]
+
+            # Runs ending before the end of the chunk are complete
+            if e < len(t):
+                self.close()
+
+        self.history = np.concatenate((self.history, rate))[-self.window:]
+        self.last_t = t[-1]
+
+    def close(self):
+        '''
+        Function to finish the event currently running. Events starting
+        within merge_length of the end of the previous one are merged
+        with it, as a bright event may dip below the threshold now and then.
+        '''
+        event = self.current
+        self.current = None
+        if event is None:
+            return
+
+        if self.events and event['start'] - self.events[-1]['end'] <= self.merge_length:
+            previous = self.events[-1]
+            previous['n_bins'] += event['n_bins']
+            previous['end'] = event['end']
+            if event['peak_rate'] > previous['peak_rate']:
+                for key in ('peak_rate', 'baseline', 'significance'):
+                    previous[key] = event[key]
+        else:
+            self.events.append(event)
+
+    def finish(self):
+        '''
+        Function to close any event still running at the end of the
+        lightcurve, and return all events spanning at least min_bins
+        flagged bins.
+
+        Output parameters:
+         - list with a dictionary per event, giving its start and end time,
+           duration, number of flagged bins, peak rate, the median rate
+           and significance at the peak and its type (burst or flare)
+        '''
+        self.close()
+
+        events = []
+        for event in self.events:
+            if event['n_bins'] < self.min_bins:
+                continue
+            event['duration'] = event['end'] - event['start']
+            if event['duration'] <= self.burst_length:
+                event['type'] = 'burst'
+            else:
+                event['type'] = 'flare'
+            events.append(event)
+
+        return events
+
+
+def detect_bursts(path_lc, bin_length=1., window_length=2048., threshold=5.,
+                  min_bins=2, burst_length=150., merge_length=10.,
+                  chunk_length=256.):
+    '''
+    Function to detect bursts and flares in a lightcurve fits file, reading
+    it in chunks (see RollingDetector).
+
+    Input parameters:
+     - path_lc: path to the lightcurve
+     - bin_length: length in seconds of the bins in which to search
+     - window_length: length in seconds of the rolling window
+     - threshold, min_bins, burst_length, merge_length: see RollingDetector
+     - chunk_length: length in seconds of the chunks to read
+
+    Output parameters:
+     - list with the events found (see RollingDetector.finish)
+    '''
+    from correct_for_background import read_light_curve_chunks
+
+    dt = light_curve_resolution(path_lc)
+    if dt is None:
+        print 'ERROR: No lightcurve'
+        return []
+
+    # Lightcurves with coarser bins keep their own bins
+    step = max(bin_length, dt)
+    detector = RollingDetector(bin_length=step,
+                               window=max(int(window_length/step), 1),
+                               threshold=threshold,
+                               min_bins=min_bins,
+                               burst_length=burst_length,
+                               merge_length=merge_length)
+
+    chunks = read_light_curve_chunks(path_lc, chunk_length)
+    for t, rate in bin_chunks(chunks, bin_length):
+        detector.add(t, rate)
+
+    return detector.finish()
+
+
+def light_curve_resolution(path_lc):
+    '''
+    Function to read the time resolution of a lightcurve fits file from its
+    header, or None if it can't be read.
+    '''
+    from astropy.io import fits
+
+    try:
+        with fits.open(path_lc, memmap=True) as hdulist:
+            return hdulist[1].header['TIMEDEL']
+    except (IOError, KeyError, IndexError):
+        return
+
+
+def burst_catalogue_path():
+    '''
+    Path of the burst catalogue of the object in the paths file.
+    '''
+    import paths
+    return paths.data_info + 'bursts_' + paths.selection + '.csv'
+
+
+def find_bursts(bin_length=1., window_length=2048., threshold=5., min_bins=2,
+                burst_length=150., merge_length=10., chunk_length=256.):
+    '''
+    Function to search the lightcurves of each obsid for bursts and flares
+    against a rolling median (see detect_bursts), and to write them to a
+    burst catalogue of the object. Per obsid, only the lightcurve with the
+    coarsest time resolution still finer than bin_length is searched, being
+    the smallest file which still resolves the bursts. The times of the
+    bursts and flares are added to the database per obsid.
+
+    Arguments:
+     - bin_length, window_length, threshold, min_bins, burst_length,
+       merge_length, chunk_length: see detect_bursts
+    '''
+
+    # Let the user know what's going to happen
+    purpose = 'Finding bursts and flares'
+    print len(purpose)*'=' + '\n' + purpose + '\n' + len(purpose)*'='
+
+    import os
+    import pandas as pd
+    from collections import defaultdict
+    import paths
+    import logs
+    import database
+
+    # Set log file
+    filename = __file__.split('/')[-1].split('.')[0]
+    logs.output(filename)
+
+    os.chdir(paths.data)
+    db = database.load(['obsids', 'lightcurves'])
+
+    catalogue = []
+    d = defaultdict(list)
+    for obsid, group in db[db.lightcurves.notnull()].groupby('obsids'):
+
+        # Layer background subtraction is done in xspec, so skip these
+        lightcurves = [lc for lc in group.lightcurves.unique()
+                       if not lc.endswith('per_layer.lc')]
+
+        resolutions = [(light_curve_resolution(lc), lc) for lc in lightcurves]
+        resolutions = [(dt, lc) for dt, lc in resolutions if dt is not None]
+        if not resolutions:
+            print obsid, 'ERROR: No lightcurve'
+            continue
+
+        fine = [r for r in resolutions if r[0] <= bin_length]
+        if fine:
+            dt, path_lc = max(fine)
+        else:
+            dt, path_lc = min(resolutions)
+
+        print obsid, path_lc
+
+        events = detect_bursts(path_lc,
+                               bin_length=bin_length,
+                               window_length=window_length,
+                               threshold=threshold,
+                               min_bins=min_bins,
+                               burst_length=burst_length,
+                               merge_length=merge_length,
+                               chunk_length=chunk_length)
+
+        for event in events:
+            print event['type'].capitalize(), 'between:', event['start'], '-', event['end']
+            event['obsid'] = obsid
+            event['object'] = paths.selection
+            event['lightcurve'] = path_lc
+            catalogue.append(event)
+
+        bursts = [e for e in events if e['type'] == 'burst']
+        flares = [e for e in events if e['type'] == 'flare']
+        d['obsids'].append(obsid)
+        d['burst_times'].append(','.join(str(e['start']) + '-' + str(e['end'])
+                                         for e in bursts) or float('NaN'))
+        d['rolling_flare_times'].append(','.join(str(e['start']) + '-' + str(e['end'])
+                                                 for e in flares) or float('NaN'))
+
+    # Write the burst catalogue of this object
+    columns = ['obsid', 'object', 'type', 'start', 'end', 'duration', 'n_bins',
+               'peak_rate', 'baseline', 'significance', 'lightcurve']
+    pd.DataFrame(catalogue, columns=columns).to_csv(burst_catalogue_path(),
+                                                    index=False)
+
+    # Update database and save
+    df = pd.DataFrame(d)
+    db = database.upsert(db,['obsids'],df)
+    database.save(db)
+    logs.stop_logging()
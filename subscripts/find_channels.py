@@ -222,7 +222,7 @@ def find_channels():
     logs.output(filename)
 
     os.chdir(paths.data)
-    db = pd.read_csv(paths.database)
+    db = database.load(['obsids', 'modes', 'paths_data', 'times', 'bitsize'])
 
     d = defaultdict(list)
     for obsid, group in db.groupby(['obsids']):
@@ -252,6 +252,6 @@ def find_channels():
 
     # Update database and save
     df = pd.DataFrame(d)
-    db = database.merge(db,df,['energy_channels'])
+    db = database.upsert(db,['paths_data'],df)
     database.save(db)
     logs.stop_logging()
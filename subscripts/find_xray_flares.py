@@ -3,19 +3,67 @@
 # Written by David Gardenier, 2015-2016
 
 
-def cut_flare(path_obsid, lc, bkg_lc, res, mode):
+def flare_windows(rate, n_bins, limit, upper_limit=80000, lower_limit=300):
     '''
-    Function to determine if xray flare is present, and if so, to cut it from
-    the lightcurve and bkg lightcurve before trying to calculate power colours
+    Function to find the windows of bins to cut around X-ray flares. A flare
+    starts at the first bin j of two consecutive bins above the limit, and
+    the window around it runs from lower_limit bins before j up to
+    upper_limit bins after j. The search for the next flare only continues
+    after that window.
+
+    Input parameters:
+     - rate: background corrected rate
+     - n_bins: number of time bins in the lightcurve
+     - limit: rate above which a X-ray flare must exist
+     - upper_limit, lower_limit: number of bins to cut after and before the
+                                 start of a flare
+
+    Output parameters:
+     - starts: index of the start of each flare
+     - low: index at which each window is bounded below
+     - high: index at which each window is bounded above
     '''
-
     import numpy as np
 
-    try:
-        rate, t, dt, n_bins, error = np.loadtxt(lc, dtype=float, unpack=True)
-    except IOError:
-        print 'ERROR: No lightcurve file'
-        return
+    above = np.asarray(rate[:n_bins]) > limit
+
+    # Bins from which two consecutive bins are above the limit
+    candidates = np.flatnonzero(above[:-1] & above[1:])
+
+    # Flares may only start beyond the window of the previous flare. As
+    # windows are long, there are few flares to step through
+    starts = []
+    i = 0
+    while i < len(candidates):
+        j = candidates[i]
+        starts.append(j)
+        i = np.searchsorted(candidates, j + upper_limit)
+
+    starts = np.array(starts, dtype=int)
+    low = np.maximum(starts - lower_limit, 0)
+    high = np.minimum(starts + upper_limit, n_bins - 1)
+
+    return starts, low, high
+
+
+def find_flares(rate, t, n_bins):
+    '''
+    Function to determine if xray flares are present in a lightcurve, by
+    finding two consecutive bins with a rate more than 7 sigma above the
+    mean, and if so, which bins to cut around them.
+
+    Input parameters:
+     - rate: background corrected rate
+     - t: time grid of the observation
+     - n_bins: number of time bins in the lightcurve
+
+    Output parameters:
+     - keep: boolean array marking the bins outside the flares
+     - flare_times: string with the times between which flares took place
+
+    Returns None if no flares were found.
+    '''
+    import numpy as np
 
     # Calculate the mean rate
     mean_rate = np.mean(rate)
@@ -24,76 +72,65 @@ def cut_flare(path_obsid, lc, bkg_lc, res, mode):
     # Compute the limit above which a X-ray flare must exist
     limit = mean_rate + 7*std
 
-    ind_to_del = []
+    starts, low, high = flare_windows(rate, n_bins, limit)
+
+    if len(starts) == 0:
+        return
+
+    # Determine between which times a flare took place
+    flare_times = ','.join(str(t[l]) + '-' + str(t[h]) for l, h in zip(low, high))
+
+    # Bins in (low, high) are cut, as well as the start of a flare at the
+    # very first bin
+    first = np.minimum(low + 1, starts)
+    edges = np.zeros(len(rate) + 1, dtype=int)
+    np.add.at(edges, first, 1)
+    np.add.at(edges, high, -1)
+    keep = np.cumsum(edges[:-1]) == 0
+
+    return keep, flare_times
+
+
+def noflare_lc_path(path_obsid, mode, res):
+    '''
+    Path of the lightcurve file with X-ray flares cut in an obsid folder.
+    '''
+    return path_obsid + 'noflarelc_' + mode + '_' + res
+
+
+def cut_flare(path_obsid, lc, bkg_lc, res, mode):
+    '''
+    Function to determine if xray flare is present, and if so, to cut it from
+    the lightcurve and bkg lightcurve before trying to calculate power colours
+    '''
+    import binary_files
 
     try:
-        n_bins = int(n_bins[0])
-    except IndexError:
+        rate, t, dt, n_bins, error, bkg_rate = binary_files.read_light_curve(lc, bkg_lc)
+    except IOError:
+        print 'ERROR: No lightcurve file'
+        return
+
+    if n_bins == 0:
         print 'ERROR: Lightcurve file empty'
         return
 
-    j = 0
-    upper_limit = 80000
-    ind_limits = []
-    while j < n_bins - 1:
-
-        if rate[j] > limit and rate[j+1] > limit:
-            ind_to_del.extend([l for l in range(j,max(j-300,0),-1)])
-            ind_to_del.extend([l for l in range(j,min(j+upper_limit,n_bins-1))])
-            ind_limits.append(max(j-300,0))
-            ind_limits.append(min(j+upper_limit,n_bins-1))
-            j += upper_limit
-        else:
-            j += 1
+    flares = find_flares(rate, t, n_bins)
 
     # If X-ray flares were detected
-    if len(ind_to_del) > 0:
-
-        # Determine between which times a flare took place
-        time_limits = [t[i] for i in ind_limits]
-        flare_times = str(time_limits[0])
-        for i,e in enumerate(time_limits[1:]):
-            if not i%2:
-                flare_times += '-' + str(e)
-            else:
-                flare_times += ',' + str(e)
-
-        # Read in the rebinned_background and the rates of the corrected rates
-        try:
-            bkg_rate = np.loadtxt(bkg_lc, dtype=float)
-        except IOError:
-            print 'ERROR: Failed to locate background file'
-            return
-
-        # Remove the X-ray events
-        rate = np.delete(rate, ind_to_del)
-        bkg_rate = np.delete(bkg_rate, ind_to_del)
-        t = np.delete(t, ind_to_del)
-        error = np.delete(error, ind_to_del)
-
-        n_bins = len(rate)
-        bkg_n_bins = len(bkg_rate)
-
-        # Names for output
-        new_file = path_obsid + 'noflarelc_' + mode + '_' + res
-        bkg_file = path_obsid + 'noflarebkg_' + mode + '_' + res
-
-        # Write the X-ray flare corrected rates to a file
-        with open(new_file, 'w') as out_file:
-            for i in range(n_bins):
-                line = [repr(rate[i]),
-                        repr(t[i]),
-                        str(dt[0]),
-                        str(n_bins),
-                        repr(error[i])]
-                out_file.write(' '.join(line) + '\n')
-
-        # Write the background X-ray flare corrected rates to a file
-        with open(bkg_file, 'w') as out_file:
-            for i in range(n_bins):
-                out_file.write(repr(bkg_rate[i]) + '\n')
-
-        return new_file, bkg_file, flare_times
+    if flares:
+        keep, flare_times = flares
+
+        # Name for output
+        new_file = noflare_lc_path(path_obsid, mode, res)
+
+        # Write the X-ray flare corrected rates, together with the background
+        # rates, to a file, removing the X-ray events
+        binary_files.write_light_curve(new_file, t[keep], rate[keep],
+                                       error[keep], bkg_rate[keep], dt,
+                                       flare_times=flare_times)
+
+        return new_file, new_file, flare_times
 
     else:
         return
@@ -126,7 +163,8 @@ def cut_xray_flares():
     logs.output(filename)
 
     os.chdir(paths.data)
-    db = pd.read_csv(paths.database)
+    db = database.load(['obsids', 'modes', 'resolutions', 'paths_obsid',
+                        'bkg_corrected_lc', 'rebinned_bkg'])
 
     d = defaultdict(list)
     for path_lc, group in db.groupby('bkg_corrected_lc'):
@@ -144,13 +182,17 @@ def cut_xray_flares():
 
         if result:
             print 'Flare between:', result[2]
-            d['bkg_corrected_lc'].append(path_lc)
-            d['lc_no_flare'].append(result[0])
-            d['bkg_no_flare'].append(result[1])
-            d['flare_times'].append(result[2])
+        else:
+            # Clear any flare found in an earlier run
+            result = [float('NaN')]*3
+
+        d['bkg_corrected_lc'].append(path_lc)
+        d['lc_no_flare'].append(result[0])
+        d['bkg_no_flare'].append(result[1])
+        d['flare_times'].append(result[2])
 
     # Update database and save
     df = pd.DataFrame(d)
-    db = database.merge(db,df,['lc_no_flare','bkg_no_flare','flare_times'])
+    db = database.upsert(db,['bkg_corrected_lc'],df)
     database.save(db)
     logs.stop_logging()
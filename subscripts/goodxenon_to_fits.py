@@ -25,7 +25,8 @@ def goodxenon_to_fits():
     logs.output(filename)
 
     os.chdir(paths.data)
-    db = pd.read_csv(paths.database)
+    db = database.load(['obsids', 'modes', 'resolutions', 'paths_obsid',
+                        'paths_po_pm_pr'])
 
     # Running it over gx1 or gx2 will give same result, but only needs to be
     # run once
@@ -73,7 +74,7 @@ def goodxenon_to_fits():
     df = pd.DataFrame(d)
 
     # Ensure that the column paths_gx is updated
-    db = database.merge(db,df,['paths_gx'])
+    db = database.upsert(db,['obsids','modes','resolutions'],df)
 
     database.save(db)
     logs.stop_logging()
@@ -0,0 +1,61 @@
+# Functions to calculate hues from power colours
+# Written by David Gardenier, 2015-2016
+
+# Central point of the power colour-colour diagram, around which the hue
+# angle is defined
+X0 = 4.51920
+Y0 = 0.453724
+
+
+def cal_hue(x, y, xerr, yerr, x0=X0, y0=Y0):
+    '''
+    Function to calculate the hue on basis of power colour-ratio values.
+    Works on single values as well as on whole arrays or pandas columns.
+
+    Assuming:
+     - errors symmetric along either axis
+     - errors uncorrelated with each other
+     - errors given relative to a value
+
+    Input parameters:
+     - x, y: pc1 and pc2 values
+     - xerr, yerr: errors on pc1 and pc2
+     - x0, y0: central point of the power colour-colour diagram
+
+    Returns:
+     - [tuple] hue, hue_error (floats for single values, otherwise arrays)
+    '''
+    import numpy as np
+
+    scalar = np.ndim(x) == 0
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    xerr = np.asarray(xerr, dtype=float)
+    yerr = np.asarray(yerr, dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Angles are defined in log-space
+        dx = np.log10(x) - np.log10(x0)
+        dy = np.log10(y) - np.log10(y0)
+
+        # Calculate angle
+        rads = np.arctan2(dy,dx)
+        rads %= 2*np.pi
+        # Add 135 degrees as the hue angle is defined
+        # from the line extending in north-west direction
+        degs = -(rads*(180/np.pi)) + 135
+        # Fixing things with minus degrees
+        degs = np.where(degs < 0, (180 - np.abs(degs)) + 180, degs)
+
+        # Calculate errors with error propagation
+        above = (yerr*x*np.log10(x/x0))**2+(xerr*y*np.log10(y/y0))**2
+        below = (x*y*(np.log10(x/x0)**2 + np.log10(y/y0)**2))**2
+        radserr = np.sqrt(above/below)
+        radserr %= 2*np.pi
+        degserr = radserr*180/np.pi
+
+    if scalar:
+        return float(degs), float(degserr)
+
+    return degs, degserr
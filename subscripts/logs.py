@@ -31,6 +31,13 @@ class Logger(object):
             self.terminal.write(message)
         self.log.write(message)
 
+    def flush(self):
+        # Needed by anything flushing the standard streams, such as
+        # multiprocessing when starting worker processes
+        if paths.terminal_output:
+            self.terminal.flush()
+        self.log.flush()
+
 
 def output(filename):
     if not os.path.exists(paths.logs):
@@ -6,6 +6,13 @@ subscripts = os.path.dirname(os.path.realpath(__file__)) + '/'
 data = '/scratch/david/master_project/xte_J1550m564/'
 data_info = data + 'info/'
 database = data_info + 'database_xte_J1550m564.csv'
+# Either 'csv' or 'sqlite'. The csv database can be exported from sqlite with
+# database.export_csv
+database_backend = 'csv'
+database_sqlite = data_info + 'database_xte_J1550m564.sqlite'
+# Whether steps compare the contents of their input files to decide whether
+# an output can be skipped, rather than their size and modification time
+provenance_checksums = False
 
 logs = data_info + 'log_scripts/'
 terminal_output = True
@@ -28,7 +28,7 @@ def pcu_filters():
     logs.output(filename)
 
     os.chdir(paths.data)
-    db = pd.read_csv(paths.database)
+    db = database.load(['obsids', 'filters', 'paths_obsid'])
 
     d = defaultdict(list)
     for obsid, group in db.groupby(['obsids']):
@@ -98,6 +98,6 @@ def pcu_filters():
 
     # Add starting times of each obsid to database
     df = pd.DataFrame(d)
-    db = database.merge(db,df,['times_obsid', 'times_pcu', 'npcu'])
+    db = database.upsert(db,['obsids'],df)
     database.save(db)
     logs.stop_logging()
@@ -0,0 +1,288 @@
+# Functions to run the steps of the pipeline as a graph of dependent tasks.
+# Each step starts as soon as the steps it depends on have finished, so
+# independent steps, such as the timing and spectral analysis, can run
+# alongside each other in separate processes.
+# Written by David Gardenier, 2015-2016
+
+# Steps of the pipeline as (function, module, steps it depends on, whether
+# it has to run on its own). Steps which save the database as a whole, or
+# add rows to it, have to run on their own, as their changes can't be
+# combined with those of other steps (see database.save)
+STEPS = [('download', 'download_data', [], True),
+         ('locate_files', 'locate_files', ['download'], True),
+         ('determine_info', 'determine_info', ['locate_files'], True),
+         ('spacecraft_filters', 'spacecraft_filters', ['determine_info'], False),
+         ('goodxenon_to_fits', 'goodxenon_to_fits', ['determine_info'], False),
+         ('find_channels', 'find_channels', ['determine_info'], False),
+         ('pcu_filters', 'pcu_filters', ['spacecraft_filters'], False),
+         ('create_backgrounds', 'create_backgrounds', ['spacecraft_filters'], True),
+         ('extract_lc_and_sp', 'extract_lc_and_sp', ['goodxenon_to_fits',
+                                                     'find_channels',
+                                                     'pcu_filters',
+                                                     'create_backgrounds'], False),
+         ('find_bursts', 'find_bursts', ['extract_lc_and_sp'], False),
+         ('correct_for_background', 'correct_for_background', ['extract_lc_and_sp'], False),
+         ('create_power_spectra', 'create_power_spectra', ['correct_for_background'], False),
+         ('rebin_power_spectra', 'rebin_power_spectra', ['create_power_spectra'], False),
+         ('create_power_colours', 'create_power_colours', ['create_power_spectra'], False),
+         ('create_response', 'create_responses', ['extract_lc_and_sp'], False),
+         ('calculate_hi', 'calculate_hi', ['create_response'], False)]
+
+
+def run_step(name, module, queue, config=None):
+    '''
+    Function to run a single step in a process of its own, letting the main
+    process know when it's done.
+
+    Input parameters:
+     - name: name of the function of the step
+     - module: name of the module in subscripts holding the function
+     - queue: queue on which to put the name, start and end time of the
+              step, and whether it succeeded
+     - config: configuration of the run (see run_config), otherwise the
+               settings in paths.py are used
+    '''
+    import time
+    import traceback
+
+    start = time.time()
+    succeeded = True
+    try:
+        if config is not None:
+            config.apply()
+        step = getattr(__import__(module, globals(), {}, [name]), name)
+        step()
+    except Exception:
+        print 'ERROR: Step', name, 'failed'
+        print traceback.format_exc().rstrip()
+        succeeded = False
+
+    queue.put((name, start, time.time(), succeeded))
+
+
+def wait_for_process(queue, processes, interval=1.):
+    '''
+    Function to wait for the next process to report back on the queue.
+    Processes which ended without doing so, for instance when killed for
+    running out of memory, are given back without a message.
+
+    Input parameters:
+     - queue: queue on which the processes put a message starting with
+              their name
+     - processes: dictionary with the running processes by name
+     - interval: seconds between checks on the processes
+
+    Output parameters:
+     - name of the process
+     - message of the process, or None if it ended without one
+    '''
+    import Queue
+
+    while True:
+        try:
+            message = queue.get(timeout=interval)
+            return message[0], message
+        except Queue.Empty:
+            pass
+
+        for name, process in processes.iteritems():
+            if process.exitcode is None:
+                continue
+            # Anything put on the queue before it ended should be there now
+            try:
+                message = queue.get(timeout=interval)
+                return message[0], message
+            except Queue.Empty:
+                print 'ERROR:', name, 'ended with exit code', process.exitcode
+                return name, None
+
+
+def critical_path(steps, times):
+    '''
+    Function to find the chain of dependent steps which took longest, and
+    therefore determined how long the pipeline took to run.
+
+    Input parameters:
+     - steps: steps of the pipeline (see STEPS)
+     - times: dictionary with the run time in seconds of each step which ran
+
+    Output parameters:
+     - [list] names of the steps on the critical path, in order
+     - total run time of these steps
+    '''
+    longest = {}
+    path = {}
+    for name, module, dependencies, alone in steps:
+        if name not in times:
+            continue
+        before = [(longest[d], path[d]) for d in dependencies if d in longest]
+        previous, chain = max(before) if before else (0., [])
+        longest[name] = previous + times[name]
+        path[name] = chain + [name]
+
+    if not longest:
+        return [], 0.
+
+    last = max(longest, key=longest.get)
+    return path[last], longest[last]
+
+
+def run_pipeline(steps=STEPS, workers=1, config=None):
+    '''
+    Function to run the steps of the pipeline, each step starting as soon as
+    the steps it depends on have finished. Steps depending on a failed step
+    are skipped. Afterwards the run time of each step and the critical path
+    are reported.
+
+    Input parameters:
+     - steps: steps to run (see STEPS), in an order in which each step comes
+              after the steps it depends on
+     - workers: maximum number of steps to run at the same time
+     - config: configuration of the run (see run_config), otherwise the
+               settings in paths.py are used
+
+    Output parameters:
+     - dictionary with the run time in seconds of each step which succeeded
+    '''
+    import time
+    import multiprocessing
+
+    names = [s[0] for s in steps]
+    for name, module, dependencies, alone in steps:
+        for d in dependencies:
+            if d not in names or names.index(d) > names.index(name):
+                raise ValueError('Step ' + name + ' depends on ' + d +
+                                 ', which does not come before it')
+
+    start = time.time()
+    queue = multiprocessing.Queue()
+    waiting = list(steps)
+    running = {}
+    times = {}
+    failed = []
+
+    while waiting or running:
+
+        # Skip steps which can't run anymore
+        for step in list(waiting):
+            if any(d in failed for d in step[2]):
+                print 'Skipping', step[0], '(depends on a failed step)'
+                waiting.remove(step)
+                failed.append(step[0])
+
+        # Start any steps of which all dependencies have finished
+        for step in list(waiting):
+            name, module, dependencies, alone = step
+            if len(running) >= workers:
+                break
+            if not all(d in times for d in dependencies):
+                continue
+            if running and (alone or any(s[3] for s in running.values())):
+                continue
+
+            print 'Starting', name
+            process = multiprocessing.Process(target=run_step,
+                                              args=(name, module, queue, config))
+            process.start()
+            running[name] = step + (process,)
+            waiting.remove(step)
+
+            if alone:
+                break
+
+        if not running:
+            break
+
+        # Wait for a step to finish
+        processes = dict((n, r[4]) for n, r in running.iteritems())
+        name, message = wait_for_process(queue, processes)
+        running.pop(name)[4].join()
+        if message is not None and message[3]:
+            name, started, ended, succeeded = message
+            times[name] = ended - started
+            print 'Finished', name, 'in %.1f s' % times[name]
+        else:
+            failed.append(name)
+
+    total = time.time() - start
+
+    # Report on the run
+    print 'Run time per step:'
+    for name, module, dependencies, alone in steps:
+        if name in times:
+            print '  %-25s %10.1f s' % (name, times[name])
+        else:
+            print '  %-25s %12s' % (name, 'not run')
+
+    path, length = critical_path(steps, times)
+    print 'Critical path (%.1f s of %.1f s in total):' % (length, total)
+    print '  ' + ' -> '.join(path)
+
+    return times
+
+
+def run_source(config, steps, workers, queue):
+    '''
+    Function to run the pipeline over a single source in a process of its
+    own, letting the main process know when it's done.
+    '''
+    import traceback
+
+    succeeded = False
+    try:
+        config.apply()
+        times = run_pipeline(steps, workers=workers, config=config)
+        succeeded = len(times) == len(steps)
+    except Exception:
+        print 'ERROR: Pipeline of', config.selection, 'failed'
+        print traceback.format_exc().rstrip()
+
+    queue.put((config.selection, succeeded))
+
+
+def run_sources(configs, steps=STEPS, workers=1, processes=None):
+    '''
+    Function to run the pipeline over several sources at the same time,
+    each in a process of its own with its own configuration, so nothing is
+    shared between them.
+
+    Input parameters:
+     - configs: configurations of the sources (see run_config)
+     - steps: steps to run (see STEPS)
+     - workers: maximum number of steps to run at the same time per source
+     - processes: maximum number of sources to run at the same time, by
+                  default enough to give each step a core of its own
+
+    Output parameters:
+     - [list] names of the sources of which all steps succeeded
+    '''
+    import multiprocessing
+
+    if processes is None:
+        processes = max(1, multiprocessing.cpu_count() // workers)
+
+    queue = multiprocessing.Queue()
+    waiting = list(configs)
+    running = {}
+    succeeded = []
+
+    while waiting or running:
+
+        while waiting and len(running) < processes:
+            config = waiting.pop(0)
+            print 'Starting', config.selection
+            process = multiprocessing.Process(target=run_source,
+                                              args=(config, steps, workers,
+                                                    queue))
+            process.start()
+            running[config.selection] = process
+
+        selection, message = wait_for_process(queue, running)
+        running.pop(selection).join()
+        if message is not None and message[1]:
+            succeeded.append(selection)
+            print 'Finished', selection
+        else:
+            print 'ERROR: Not all steps succeeded for', selection
+
+    return succeeded
@@ -0,0 +1,150 @@
+# Functions to keep track of the inputs from which each output of a step was
+# made. A hash of the input files, parameters and code of a step is stored in
+# the database next to each output, so a rerun can skip outputs of which none
+# of the inputs have changed.
+# Written by David Gardenier, 2015-2016
+
+def provenance_column(step):
+    '''Name of the database column with the input hashes of a step'''
+    return 'provenance_' + step
+
+
+def file_signature(path):
+    '''
+    Function to describe the state of an input file. Paths in the database
+    are often given without their extension (.gz), in which case all files
+    starting with the path are used.
+
+    Input parameters:
+     - path: path to the file
+
+    Output parameters:
+     - [list] with the path, size and modification time of each file, or
+       with only the path if no file could be found. The contents of the
+       files are used instead of the modification time if so set in paths.py
+    '''
+    import os
+    import glob
+    import hashlib
+    import paths
+
+    if not isinstance(path, basestring):
+        return [(repr(path),)]
+
+    if os.path.isfile(path):
+        files = [path]
+    else:
+        files = sorted(glob.glob(path + '*'))
+    if not files:
+        return [(path,)]
+
+    signature = []
+    for f in files:
+        stat = os.stat(f)
+        if getattr(paths, 'provenance_checksums', False):
+            h = hashlib.sha1()
+            with open(f, 'rb') as data:
+                for block in iter(lambda: data.read(2**20), ''):
+                    h.update(block)
+            signature.append((f, stat.st_size, h.hexdigest()))
+        else:
+            signature.append((f, stat.st_size, repr(stat.st_mtime)))
+    return signature
+
+
+def listed_files(path):
+    '''
+    Function to give the paths in a list file, such as those given to the
+    ftools with @. Gives an empty list if the file can't be read.
+    '''
+    if not isinstance(path, basestring):
+        return []
+    try:
+        with open(path) as text:
+            return [l.split()[0] for l in text if l.strip()]
+    except IOError:
+        return []
+
+
+def code_version(names):
+    '''
+    Function to give a hash of the source code of a step, so outputs are made
+    again after the code changes. Changes to code outside the listed files,
+    such as the ftools or other packages, aren't noticed, in which case the
+    step has to be run with force=True.
+
+    Input parameters:
+     - names: names of the modules in subscripts the output depends on,
+              starting with the step itself, and of any other files there
+              which are passed to the ftools (e.g. bitfile_M)
+
+    Output parameters:
+     - hash (string)
+    '''
+    import os
+    import hashlib
+    import paths
+
+    h = hashlib.sha1()
+    for name in names:
+        path = paths.subscripts + name
+        if not os.path.isfile(path):
+            path += '.py'
+        with open(path, 'rb') as source:
+            h.update(name + '\n' + hashlib.sha1(source.read()).hexdigest())
+    return h.hexdigest()
+
+
+def input_hash(files, parameters, code):
+    '''
+    Function to hash everything an output depends on.
+
+    Input parameters:
+     - files: paths to the input files (see file_signature)
+     - parameters: list with any other values which determine the output
+     - code: code version of the step (see code_version)
+
+    Output parameters:
+     - hash (string)
+    '''
+    import hashlib
+
+    h = hashlib.sha1(code)
+    for f in files:
+        for signature in file_signature(f):
+            h.update(repr(signature))
+    h.update(repr(list(parameters)))
+    return h.hexdigest()
+
+
+def unchanged(rows, step, h, outputs):
+    '''
+    Function to check whether an output can be skipped, which is the case
+    when the rows in the database were all made from inputs with the same
+    hash, and the output files they point to are still present.
+
+    Input parameters:
+     - rows: database rows of the output (pandas dataframe)
+     - step: name of the step
+     - h: hash of the current inputs (see input_hash)
+     - outputs: names of the columns with the output files
+
+    Output parameters:
+     - True if the output is up to date
+    '''
+    import os
+
+    column = provenance_column(step)
+    if rows.shape[0] == 0 or column not in rows:
+        return False
+    if not (rows[column] == h).all():
+        return False
+
+    for c in outputs:
+        if c not in rows:
+            return False
+        for path in rows[c].values:
+            # Missing outputs (NaN) were missing from the same inputs before
+            if isinstance(path, basestring) and not os.path.exists(path):
+                return False
+    return True
@@ -0,0 +1,176 @@
+# Functions to logarithmically rebin power spectra in frequency*power, ready
+# for plotting
+# Written by David Gardenier, 2015-2016
+
+
+def rebinned_path(path_ps):
+    '''
+    Path of the rebinned version of a power spectrum, stored next to it.
+    '''
+    for ext in ('.psd', '.ps'):
+        if path_ps.endswith(ext):
+            path_ps = path_ps[:-len(ext)]
+            break
+    return path_ps + '_rebinned.psd'
+
+
+def log_rebin(frequency, power, frequency_error, power_error, bin_edges):
+    '''
+    Function to rebin a power spectrum in frequency*power, using the mean of
+    all frequencies falling within each bin. Errors are propagated to the
+    frequency*power values, and combined in quadrature per bin.
+
+    Input parameters:
+     - frequency, power: frequency grid and power spectrum
+     - frequency_error, power_error: errors on both
+     - bin_edges: edges of the bins, including the rightmost edge
+
+    Output parameters:
+     - bin_means: mean frequency*power per bin (NaN for empty bins)
+     - bin_errors: error on the mean per bin (zero for empty bins)
+     - counts: number of frequencies per bin
+    '''
+    import numpy as np
+
+    frequency = np.asarray(frequency, dtype=float)
+    power = np.asarray(power, dtype=float)
+    n_bins = len(bin_edges) - 1
+
+    freq_power = frequency*power
+
+    # Error on frequency*power
+    with np.errstate(divide='ignore', invalid='ignore'):
+        freq_power_error = np.abs(freq_power)*np.sqrt((frequency_error/frequency)**2 +
+                                                      (power_error/power)**2 +
+                                                      2*(frequency_error*power_error)/freq_power)
+
+    # Find in which bin each frequency falls, with the last bin including its
+    # right edge (as with scipy's binned_statistic)
+    index = np.searchsorted(bin_edges, frequency, side='right') - 1
+    index[frequency == bin_edges[-1]] = n_bins - 1
+    inside = (index >= 0) & (index < n_bins)
+    index = index[inside]
+
+    counts = np.bincount(index, minlength=n_bins)
+    sums = np.bincount(index, weights=freq_power[inside], minlength=n_bins)
+    squared_errors = np.bincount(index, weights=freq_power_error[inside]**2,
+                                 minlength=n_bins)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bin_means = sums/counts
+        bin_errors = np.where(counts > 0, np.sqrt(squared_errors)/counts, 0.)
+
+    bin_means[counts == 0] = float('NaN')
+
+    return bin_means, bin_errors, counts
+
+
+def rebin_power_spectrum(path_ps, low=-3, high=2, num=50):
+    '''
+    Function to rebin a power spectrum file on a logarithmic frequency grid,
+    and to save the result next to it.
+
+    Input parameters:
+     - path_ps: path to the power spectrum
+     - low, high, num: bin edges as given by numpy's logspace
+
+    Output parameters:
+     - path to the rebinned power spectrum
+    '''
+    import numpy as np
+    import binary_files
+
+    ps, ps_error, freq, freq_error, ps_squared, num_seg = binary_files.read_power_spectrum(path_ps)
+
+    bin_edges = np.logspace(low, high, num=num)
+    bin_means, bin_errors, counts = log_rebin(freq, ps, freq_error, ps_error,
+                                              bin_edges)
+
+    path_rebinned = rebinned_path(path_ps)
+    binary_files.write_columns(path_rebinned,
+                               [bin_edges[:-1],
+                                bin_edges[1:],
+                                np.sqrt(bin_edges[:-1]*bin_edges[1:]),
+                                bin_means,
+                                bin_errors,
+                                counts],
+                               ['bin_low',
+                                'bin_high',
+                                'bin_centre',
+                                'freq_power',
+                                'freq_power_error',
+                                'counts'],
+                               {'power_spectrum': path_ps,
+                                'number_of_segments': int(num_seg),
+                                'logspace': [low, high, num]})
+
+    return path_rebinned
+
+
+def read_rebinned_power_spectrum(path_rebinned):
+    '''
+    Function to read a rebinned power spectrum.
+
+    Output parameters:
+     - bin_means: mean frequency*power per bin
+     - bin_edges: edges of all bins, including the rightmost edge
+     - bin_errors: error on the mean per bin
+    '''
+    import numpy as np
+    import binary_files
+
+    columns, meta = binary_files.read_columns(path_rebinned)
+    bin_edges = np.append(columns['bin_low'], columns['bin_high'][-1:])
+
+    return columns['freq_power'], bin_edges, columns['freq_power_error']
+
+
+def rebin_power_spectra(low=-3, high=2, num=50):
+    '''
+    Function to create a logarithmically rebinned version of each power
+    spectrum, so that plotting scripts only need to load a few dozen points.
+
+    Arguments:
+     - low, high, num: bin edges as given by numpy's logspace
+    '''
+
+    purpose = 'Rebinning Power Spectra'
+    print len(purpose)*'=' + '\n' + purpose + '\n' + len(purpose)*'='
+
+    import os
+    import pandas as pd
+    from collections import defaultdict
+    import paths
+    import logs
+    import database
+
+    # Set log file
+    filename = __file__.split('/')[-1].split('.')[0]
+    logs.output(filename)
+
+    os.chdir(paths.data)
+    db = database.load(['obsids', 'modes', 'resolutions', 'power_spectra'])
+
+    d = defaultdict(list)
+    for path_ps, group in db.groupby('power_spectra'):
+
+        obsid = group.obsids.values[0]
+        mode = group.modes.values[0]
+        res = group.resolutions.values[0]
+
+        print obsid, mode, res
+
+        try:
+            path_rebinned = rebin_power_spectrum(path_ps, low, high, num)
+        except IOError:
+            print 'ERROR: Power spectrum not present'
+            continue
+
+        d['power_spectra'].append(path_ps)
+        d['rebinned_power_spectra'].append(path_rebinned)
+
+    # Update database and save
+    df = pd.DataFrame(d)
+    db = database.upsert(db,['power_spectra'],df)
+    database.save(db)
+    logs.stop_logging()
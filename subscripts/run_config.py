@@ -0,0 +1,60 @@
+# Settings of a run of the pipeline over a single source, so that several
+# sources can be run at the same time without changing the paths file.
+# Written by David Gardenier, 2015-2016
+
+import os
+
+ROOT = '/scratch/david/master_project/'
+
+
+class RunConfig(object):
+    '''
+    Settings of a run of the pipeline over a source, taking the place of the
+    settings in paths.py. By default the folders follow the layout of
+    misc/paths.txt, with all data of a source in a folder with its name.
+
+    Arguments:
+     - selection: name of the source
+     - root: folder with a data folder per source and the obsid lists
+     - obsid_list: list of obsids to run over, otherwise the list of the
+                   source in the obsid_lists folder
+     - database: path of the csv database
+     - database_backend: 'csv' or 'sqlite' (see database.py)
+     - terminal_output: whether to show the output of the steps, next to
+                        writing it to the logs
+    '''
+
+    # Settings of the paths file which are set by a run configuration
+    SETTINGS = ['selection', 'data', 'data_info', 'database',
+                'database_backend', 'database_sqlite', 'logs',
+                'terminal_output', 'obsid_lists', 'obsid_list']
+
+    def __init__(self, selection, root=ROOT, obsid_list=None, database=None,
+                 database_backend='csv', terminal_output=True):
+        self.selection = selection
+        self.data = root + selection + '/'
+        self.data_info = self.data + 'info/'
+        self.database = database
+        if database is None:
+            self.database = self.data_info + 'database_' + selection + '.csv'
+        self.database_backend = database_backend
+        self.database_sqlite = os.path.splitext(self.database)[0] + '.sqlite'
+        self.logs = self.data_info + 'log_scripts/'
+        self.terminal_output = terminal_output
+        self.obsid_lists = root + 'obsid_lists/'
+        self.obsid_list = obsid_list
+        if obsid_list is None:
+            self.obsid_list = self.obsid_lists + selection + '.lst'
+
+    def __repr__(self):
+        return 'RunConfig(%r)' % self.selection
+
+    def apply(self):
+        '''
+        Set the settings of this run for all steps running in this process,
+        which read them from the paths file.
+        '''
+        import paths
+
+        for name in self.SETTINGS:
+            setattr(paths, name, getattr(self, name))
@@ -3,10 +3,12 @@
 # the South Atlantic Anomality etc. Uses the ftool maketime
 # Written by David Gardenier, 2015-2016
 
-def spacecraft_filters():
+def spacecraft_filters(force=False):
     '''
     Function to run the ftool maketime over all filter files (.xfl.gz files).
-    Creates time_filter.gti files and updates database with path to gti files
+    Creates time_filter.gti files and updates database with path to gti files.
+    Obsids of which the filter file hasn't changed since the last run are
+    skipped, unless forced.
     '''
 
     purpose = 'Create time filters'
@@ -22,13 +24,17 @@ def spacecraft_filters():
     import logs
     import execute_shell_commands as shell
     import database
+    import provenance
 
     # Set log file
     filename = __file__.split('/')[-1].split('.')[0]
     logs.output(filename)
 
     os.chdir(paths.data)
-    db = pd.read_csv(paths.database)
+    code = provenance.code_version(['spacecraft_filters',
+                                    'execute_shell_commands'])
+    db = database.load(['obsids', 'paths_obsid', 'gti',
+                        provenance.provenance_column('spacecraft_filters')])
 
     # Run maketime for each obsid
     d = defaultdict(list)
@@ -36,8 +42,16 @@ def spacecraft_filters():
 
         print obsid
 
-        # Check whether an observation has high count rates
         lc = group.paths_obsid.values[0] + 'stdprod/xp' + obsid.replace('-','') + '_n1.lc.gz'
+        f = group.paths_obsid.values[0] + 'stdprod/x' + obsid.replace('-','') + '.xfl.gz'
+        gti = group.paths_obsid.values[0] + 'time_filter.gti'
+
+        h = provenance.input_hash([f, lc], [], code)
+        if not force and provenance.unchanged(group, 'spacecraft_filters', h, ['gti']):
+            print 'Unchanged since last run'
+            continue
+
+        # Check whether an observation has high count rates
         try:
             hdulist = fits.open(lc)
             data = hdulist[1].data
@@ -46,9 +60,6 @@ def spacecraft_filters():
         except IOError:
             mean = 0.
 
-        f = group.paths_obsid.values[0] + 'stdprod/x' + obsid.replace('-','') + '.xfl.gz'
-        gti = group.paths_obsid.values[0] + 'time_filter.gti'
-
         # Remove previous version (maketime doesn't like them)
         try:
             os.remove(gti)
@@ -85,9 +96,10 @@ def spacecraft_filters():
         d['obsids'].append(obsid)
         d['filters'].append(f)
         d['gti'].append(gti)
+        d[provenance.provenance_column('spacecraft_filters')].append(h)
 
     # Update database and save
     df = pd.DataFrame(d)
-    db = database.merge(db,df,['filters','gti'])
+    db = database.upsert(db,['obsids'],df)
     database.save(db)
     logs.stop_logging()
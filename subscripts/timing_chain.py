@@ -0,0 +1,297 @@
+# Functions to run the timing analysis of each lightcurve in a single pass:
+# background correction, cutting X-ray flares, power spectra and power colours
+# Written by David Gardenier, 2015-2016
+
+def chain_products(task):
+    '''
+    Function to run the timing analysis of a single lightcurve in memory.
+    The lightcurve is corrected for its background, any X-ray flares are cut
+    out, and power spectra are calculated for each segment length. Only the
+    power spectra (and the sums behind them) are written to file, unless the
+    intermediate lightcurves are asked for as well.
+
+    Input parameters:
+     - task: dictionary with the lightcurve parameters, as set up in
+             timing_chain
+
+    Output parameters:
+     - dictionary with a database row, or None if no power spectra were made
+     - the bins of the power spectrum of the standard segment length needed
+       for its power colours (see create_power_colours.trim_power_spectrum),
+       or None if not calculated
+    '''
+    import binary_files
+    from correct_for_background import subtract_background, bkg_corrected_lc_path
+    from find_xray_flares import find_flares, noflare_lc_path
+    from create_power_spectra import light_curve_power_spectra, write_power_spectra
+    from create_power_colours import trim_power_spectrum
+
+    if task['path_std1'] is None:
+        print('ERROR: No std1 file for this obsid. Aborting power spectrum.')
+        return None, None
+
+    # Correct for the background
+    try:
+        t, rate, error, bkg_rate, dt = subtract_background(task['path_lc'],
+                                                           task['path_bkg'],
+                                                           task['mode'])
+    except IOError:
+        print 'ERROR: No lightcurve!'
+        return None, None
+
+    if len(t) == 0:
+        print 'ERROR: Lightcurve file empty'
+        return None, None
+
+    row = {}
+    if task['keep_intermediates']:
+        path = bkg_corrected_lc_path(task['path_obsid'], task['mode'],
+                                     task['res'])
+        binary_files.write_light_curve(path, t, rate, error, bkg_rate, dt,
+                                       lightcurve=task['path_lc'],
+                                       background=task['path_bkg'])
+        row['rebinned_bkg'] = path
+        row['bkg_corrected_lc'] = path
+
+    # Cut out any X-ray flares
+    flares = find_flares(rate, t, len(t))
+    if flares:
+        keep, flare_times = flares
+        print 'Flare between:', flare_times
+
+        t = t[keep]
+        rate = rate[keep]
+        error = error[keep]
+        bkg_rate = bkg_rate[keep]
+
+        row['flare_times'] = flare_times
+        if task['keep_intermediates']:
+            path = noflare_lc_path(task['path_obsid'], task['mode'],
+                                   task['res'])
+            binary_files.write_light_curve(path, t, rate, error, bkg_rate, dt,
+                                           flare_times=flare_times)
+            row['lc_no_flare'] = path
+            row['bkg_no_flare'] = path
+
+    # Calculate power spectra, keeping the sums behind them
+    sums = {}
+    outputs = light_curve_power_spectra(rate, t, dt, len(t), bkg_rate,
+                                        task['path_std1'], task['npcu'],
+                                        segment_lengths=task['segment_lengths'],
+                                        fft_mode=task['fft_mode'],
+                                        single_precision=task['single_precision'],
+                                        sums=sums)
+    if not outputs:
+        return None, None
+
+    row.update(write_power_spectra(outputs, sums, task['path_obsid'],
+                                   task['mode'], task['res'],
+                                   task['segment_lengths'], task['fft_mode']))
+
+    # Power colours are calculated from the standard power spectra. Only the
+    # bins within the bands are handed back, as the main process holds on to
+    # them until all lightcurves are done
+    data = None
+    if 256 in outputs:
+        ps, ps_error, ps_squared, M, freq, freq_error = outputs[256]
+        data = trim_power_spectrum((ps, ps_error, freq, freq_error,
+                                    ps_squared, M), task['band_sets'])
+
+    return row, data
+
+
+def chain_lightcurve(task):
+    '''
+    Function to run chain_products on a single lightcurve. Like
+    create_power_spectra.process_lightcurve, it runs either in the main
+    process or in a worker of a process pool, so anything printed is
+    captured and handed back to be logged by the main process. Any failure
+    only affects this lightcurve.
+
+    Output parameters:
+     - text printed while processing the lightcurve
+     - database row and trimmed power spectrum (see chain_products)
+    '''
+    import sys
+    import traceback
+    from StringIO import StringIO
+
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+
+    try:
+        print task['obsid'], task['mode'], task['res']
+        row, data = chain_products(task)
+
+    except Exception:
+        print 'ERROR: Failed to run timing chain'
+        print traceback.format_exc().rstrip()
+        row, data = None, None
+
+    finally:
+        text = sys.stdout.getvalue()
+        sys.stdout = stdout
+
+    return text, row, data
+
+
+def timing_chain(segment_lengths=[256], fft_mode='full', single_precision=False,
+                 band_sets=None, error_mode='linear', n_draws=1000, seed=None,
+                 workers=1, keep_intermediates=False):
+    '''
+    Function to run the timing analysis straight from the extracted
+    lightcurves, replacing correct_for_background, cut_xray_flares,
+    create_power_spectra and create_power_colours. Each lightcurve and its
+    background are read once, after which everything happens in memory. Only
+    the power spectra and their sums are written to file, and the database
+    is updated once at the end.
+
+    Arguments:
+     - segment_lengths, fft_mode, single_precision, workers: see
+       create_power_spectra
+     - band_sets, error_mode, n_draws, seed: see create_power_colours, using
+       its standard band sets if not given
+     - keep_intermediates: also write the background corrected and X-ray
+                           flare cut lightcurves, for debugging
+    '''
+
+    # Let the user know what's going to happen
+    purpose = 'Running Timing Chain'
+    print len(purpose)*'=' + '\n' + purpose + '\n' + len(purpose)*'='
+
+    import os
+    import sys
+    import pandas as pd
+    import glob
+    import multiprocessing
+    from itertools import imap
+    import paths
+    import logs
+    import database
+    from create_power_spectra import power_spectra_column, power_spectrum_sums_column
+    from create_power_colours import BAND_SETS, trimmed_power_colours, power_colour_columns
+
+    if band_sets is None:
+        band_sets = BAND_SETS
+
+    # Set log file
+    filename = __file__.split('/')[-1].split('.')[0]
+    logs.output(filename)
+
+    # Get database
+    os.chdir(paths.data)
+    db = database.load(['obsids', 'modes', 'resolutions', 'paths_obsid',
+                        'paths_data', 'npcu', 'lightcurves',
+                        'lightcurves_bkg'])
+
+    # Gather the parameters of each lightcurve. The gx1 and gx2 lightcurves
+    # of an obsid give the same output files, so are only processed once
+    tasks = []
+    shared = {}
+    for path_lc, group in db.groupby('lightcurves'):
+
+        # Layer background subtraction is done in xspec, so skip these
+        if path_lc.endswith('per_layer.lc'):
+            continue
+
+        obsid = group.obsids.values[0]
+        path_obsid = group.paths_obsid.values[0]
+        res = group.resolutions.values[0]
+        mode = group.modes.values[0]
+
+        # Std2 files won't have a high enough time resolution to create
+        # power colours in the high band
+        if mode == 'std2' or mode == 'std1':
+            continue
+
+        if (mode == 'gx1' or mode == 'gx2'):
+            mode = 'gx'
+
+        key = (path_obsid, mode, res)
+        if key in shared:
+            shared[key].append(path_lc)
+            continue
+
+        # Find std1 path
+        try:
+            std1 = db[((db.obsids==obsid) & (db.modes=='std1'))].paths_data.iloc[0]
+            path_std1 = glob.glob(std1 + '*')[0]
+        except IndexError:
+            path_std1 = None
+
+        shared[key] = [path_lc]
+        tasks.append({'key': key,
+                      'path_lc': path_lc,
+                      'path_bkg': group.lightcurves_bkg.values[0],
+                      'obsid': obsid,
+                      'path_obsid': path_obsid,
+                      'mode': mode,
+                      'res': res,
+                      'path_std1': path_std1,
+                      # Maximum number of pcus on during the observation
+                      'npcu': group.npcu.values[0],
+                      'segment_lengths': segment_lengths,
+                      'fft_mode': fft_mode,
+                      'single_precision': single_precision,
+                      'band_sets': band_sets,
+                      'keep_intermediates': keep_intermediates})
+
+    # Results are handed back in the order of the tasks, whether or not the
+    # lightcurves are spread over a pool of processes
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap(chain_lightcurve, tasks)
+    else:
+        pool = None
+        results = imap(chain_lightcurve, tasks)
+
+    rows = {}
+    power_spectra = []
+    # Workers are stopped straight away if anything goes wrong
+    finished = False
+    try:
+        for task, (text, row, data) in zip(tasks, results):
+            sys.stdout.write(text)
+            if row:
+                rows[task['key']] = row
+            if data is not None:
+                power_spectra.append((task['key'], data))
+        finished = True
+    finally:
+        if pool:
+            if finished:
+                pool.close()
+            else:
+                pool.terminate()
+            pool.join()
+
+    # Calculate the power colours of all power spectra at once
+    colours = trimmed_power_colours(power_spectra, band_sets,
+                                    error_mode=error_mode, n_draws=n_draws,
+                                    seed=seed)
+    for key, values in colours.iteritems():
+        for name, bands in band_sets:
+            for column, value in zip(power_colour_columns(name, error_mode),
+                                     values[name]):
+                rows[key][column] = value
+
+    # Each row belongs to all lightcurves giving the same output files
+    d = []
+    for key, row in rows.iteritems():
+        for path_lc in shared[key]:
+            d.append(dict(row, lightcurves=path_lc))
+
+    # Update database and save, clearing the flare times of lightcurves
+    # without flares
+    columns = [power_spectra_column(s) for s in segment_lengths]
+    columns += [power_spectrum_sums_column(s) for s in segment_lengths]
+    columns += ['flare_times']
+    if keep_intermediates:
+        columns += ['rebinned_bkg', 'bkg_corrected_lc', 'lc_no_flare',
+                    'bkg_no_flare']
+    for name, bands in band_sets:
+        columns.extend(power_colour_columns(name, error_mode))
+    df = pd.DataFrame(d, columns=['lightcurves'] + columns)
+    db = database.upsert(db,['lightcurves'],df)
+    database.save(db)
+    logs.stop_logging()